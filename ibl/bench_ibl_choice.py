@@ -0,0 +1,47 @@
+import argparse
+import time
+from metro_log_parser import MetroLogAnalyzer, ATTRIBUTE_SCHEMA
+import ibl_choice
+import ibl_memory
+
+# 基准测试：IBL决策在穷举模式与按列车分解（coordinate/beam）模式下的耗时和候选组合数
+# 决策状态取自日志中的各回合，智能体与ibl_model相同：先用日志populate，每次决策后用下一回合的得分变化respond
+
+
+def run(mode, rounds, columns, decisions, beam_width):
+    """依次在日志回合的状态上决策decisions次，返回每次的 (耗时秒数, 交给choose的候选数, 评估的组合数)"""
+    agent = ibl_memory.make_agent()
+    ibl_memory.bulk_populate(agent, *columns)
+    results = []
+    for i in range(decisions):
+        game_round = rounds[i % len(rounds)]
+        options = [ibl_choice.train_options(t.id, t.status, t.station_id is not None) for t in game_round.trains]
+        attributes = ATTRIBUTE_SCHEMA.from_round(game_round)
+        start = time.perf_counter()
+        _, num_choices, num_evaluated = ibl_choice.choose(agent, attributes, options, mode=mode, beam_width=beam_width)
+        results.append((time.perf_counter() - start, num_choices, num_evaluated))
+        agent.respond(rounds[(i + 1) % len(rounds)].score_change)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IBL决策模式基准测试")
+    parser.add_argument("--file", default="metro_logs_2025-02-25T01_40_19.393Z.json")
+    parser.add_argument("--decisions", type=int, default=4, help="每种模式的决策次数（循环使用日志回合的状态）")
+    parser.add_argument("--modes", nargs="+", choices=ibl_choice.DECISION_MODES, default=list(ibl_choice.DECISION_MODES))
+    parser.add_argument("--beam-width", type=int, default=4)
+    args = parser.parse_args()
+
+    analyzer = MetroLogAnalyzer(args.file)
+    rounds = list(analyzer.rounds)
+    columns = ATTRIBUTE_SCHEMA.extract_rows(rounds)
+    print(f"{'模式':>12} {'平均耗时':>10} {'最长耗时':>10} {'choose候选数':>12} {'评估组合数':>10}")
+    for mode in args.modes:
+        results = run(mode, rounds, columns, args.decisions, args.beam_width)
+        times = [r[0] for r in results]
+        print(f"{mode:>12} {sum(times) / len(times):9.3f}s {max(times):9.3f}s "
+              f"{sum(r[1] for r in results) / len(results):12.0f} {sum(r[2] for r in results) / len(results):10.0f}")
+
+
+if __name__ == "__main__":
+    main()
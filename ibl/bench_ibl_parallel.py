@@ -0,0 +1,67 @@
+import argparse
+import time
+from metro_log_parser import MetroLogCorpus, ATTRIBUTE_SCHEMA
+import ibl_choice
+import ibl_memory
+import ibl_parallel
+
+# 基准测试：InstanceAgent穷举决策在当前进程中串行评估与ParallelChooser多进程评估的耗时，
+# 两个智能体种子相同，检查每次决策和最终的实例记忆完全一致
+
+
+def store_contents(agent):
+    return [(bucket_key, key, instance.outcome, instance.times, instance.counts, instance.old_count)
+            for bucket_key, key, instance in agent.store]
+
+
+def run(agent, rounds, decisions, pool=None):
+    """在日志回合的状态上决策decisions次，返回 (每次选中的动作元组, 每次决策耗时秒数, 每次组合数)"""
+    chosen, times, counts = [], [], []
+    for i in range(decisions):
+        game_round = rounds[i % len(rounds)]
+        options = [ibl_choice.train_options(t.id, t.status, t.station_id is not None) for t in game_round.trains]
+        attributes = ATTRIBUTE_SCHEMA.from_round(game_round)
+        start = time.perf_counter()
+        action_tuple, _, evaluated = ibl_choice.choose(agent, attributes, options, mode='exhaustive', pool=pool)
+        times.append(time.perf_counter() - start)
+        chosen.append(action_tuple)
+        counts.append(evaluated)
+        agent.respond(rounds[(i + 1) % len(rounds)].score_change)
+    return chosen, times, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IBL穷举决策并行评估基准测试")
+    parser.add_argument("--logs", default="metro_logs_2025-02-25T01_40_19.393Z.json",
+                        help="日志文件、目录（读取其中的metro_logs_*.json）或glob模式")
+    parser.add_argument("--decisions", type=int, default=10)
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--max-instances", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = MetroLogCorpus(args.logs, workers=1)
+    rounds = [r for session_id in corpus.session_ids for r in corpus.sessions[session_id].rounds]
+    columns = ATTRIBUTE_SCHEMA.extract_rows(rounds)
+
+    def make_agent():
+        agent = ibl_memory.make_agent(store=True, seed=args.seed, max_instances=args.max_instances)
+        ibl_memory.bulk_populate(agent, *columns)
+        return agent
+
+    serial_agent = make_agent()
+    expected, times, counts = run(serial_agent, rounds, args.decisions)
+    print(f"{'进程数':>6} {'平均决策耗时':>12} {'平均组合数':>10}")
+    print(f"{'串行':>6} {sum(times) / len(times) * 1e3:10.1f}ms {sum(counts) / len(counts):10.0f}")
+    for workers in args.workers:
+        agent = make_agent()
+        with ibl_parallel.ParallelChooser(agent, workers) as pool:
+            chosen, times, counts = run(agent, rounds, args.decisions, pool)
+        assert chosen == expected, f"{workers}个进程的决策与串行不一致"
+        assert store_contents(agent) == store_contents(serial_agent), f"{workers}个进程的实例记忆与串行不一致"
+        print(f"{workers:>6} {sum(times) / len(times) * 1e3:10.1f}ms {sum(counts) / len(counts):10.0f}")
+    print(f"✅ 决策和实例记忆与串行一致（整理 {serial_agent.stats['consolidations']} 次）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import os
+import tempfile
+import time
+from metro_log_parser import MetroLogCorpus, ATTRIBUTE_SCHEMA
+import ibl_memory
+
+# 基准测试：逐回合 agent.populate 与 ibl_memory.bulk_populate 预填充整个日志语料的耗时，
+# 检查两者得到的实例记忆相同（实例、引用时间戳），并测量实例快照的保存和读取耗时
+
+
+def loop_populate(rounds):
+    """逐回合构建属性dict并调用populate（原ibl_model的做法，保留作对照）"""
+    agent = ibl_memory.make_agent()
+    for attributes, action_tuple, score_change in ATTRIBUTE_SCHEMA.extract_log(rounds):
+        agent.populate([{"action_tuple": action_tuple, **attributes}], outcome=score_change)
+    return agent
+
+
+def memory_contents(agent):
+    """实例记忆的内容：{实例属性: 引用时间戳列表}"""
+    return {key: sorted(chunk._references[:chunk._reference_count].tolist()) for key, chunk in agent._memory.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IBL实例批量预填充基准测试")
+    parser.add_argument("--logs", default="metro_logs_2025-02-25T01_40_19.393Z.json",
+                        help="日志文件、目录（读取其中的metro_logs_*.json）或glob模式")
+    parser.add_argument("--repeat", type=int, default=20, help="语料重复次数（模拟多局日志，重复的回合会被合并）")
+    args = parser.parse_args()
+
+    corpus = MetroLogCorpus(args.logs, workers=1)
+    rounds = [r for session_id in corpus.session_ids for r in corpus.sessions[session_id].rounds] * args.repeat
+
+    start = time.perf_counter()
+    expected = loop_populate(rounds)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    columns = ATTRIBUTE_SCHEMA.extract_rows(rounds)
+    extract_time = time.perf_counter() - start
+    start = time.perf_counter()
+    agent = ibl_memory.make_agent()
+    total, unique = ibl_memory.bulk_populate(agent, *columns)
+    bulk_time = time.perf_counter() - start
+
+    assert memory_contents(agent) == memory_contents(expected), "批量预填充的实例记忆与逐回合populate不一致"
+    assert agent._last_learn_time == expected._last_learn_time
+    print(f"✅ 实例记忆一致：{total} 个回合，合并后 {unique} 个实例")
+    print(f"逐回合populate {loop_time:.3f}s, 按列提取 {extract_time:.3f}s + 批量写入 {bulk_time:.3f}s"
+          f" ({loop_time / (extract_time + bulk_time):.1f}x)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ibl_memory.pkl')
+        start = time.perf_counter()
+        ibl_memory.save_snapshot(agent, path, corpus.paths)
+        save_time = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = ibl_memory.load_snapshot(path, corpus.paths)
+        load_time = time.perf_counter() - start
+        assert memory_contents(loaded) == memory_contents(agent), "快照读取后的实例记忆不一致"
+        print(f"实例快照 {os.path.getsize(path) / 1024:.0f} KB：保存 {save_time:.3f}s, 读取 {load_time:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import time
+from metro_log_parser import MetroLogCorpus, ATTRIBUTE_SCHEMA
+import ibl_choice
+import ibl_memory
+
+# 基准测试：长时间运行时，pyibl的记忆与instance_store（不限制 / 有界）的决策耗时和实例数随决策次数的变化
+# 决策状态循环取自日志回合，每次决策后用下一回合的得分变化respond
+
+
+def run(agent, rounds, decisions, mode, window):
+    """决策decisions次，每window次记录一次 (已决策次数, 该窗口内平均决策耗时秒数, 当前实例数)"""
+    samples = []
+    elapsed = 0.0
+    for i in range(decisions):
+        game_round = rounds[i % len(rounds)]
+        options = [ibl_choice.train_options(t.id, t.status, t.station_id is not None) for t in game_round.trains]
+        attributes = ATTRIBUTE_SCHEMA.from_round(game_round)
+        start = time.perf_counter()
+        ibl_choice.choose(agent, attributes, options, mode=mode)
+        elapsed += time.perf_counter() - start
+        agent.respond(rounds[(i + 1) % len(rounds)].score_change)
+        if (i + 1) % window == 0:
+            size = agent.store.size if hasattr(agent, 'store') else len(agent._memory)
+            samples.append((i + 1, elapsed / window, size))
+            elapsed = 0.0
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IBL实例记忆长时间运行基准测试")
+    parser.add_argument("--logs", default="metro_logs_2025-02-25T01_40_19.393Z.json",
+                        help="日志文件、目录（读取其中的metro_logs_*.json）或glob模式")
+    parser.add_argument("--decisions", type=int, default=2000)
+    parser.add_argument("--window", type=int, default=500, help="每多少次决策统计一次")
+    parser.add_argument("--mode", choices=ibl_choice.DECISION_MODES, default="beam")
+    parser.add_argument("--max-instances", type=int, default=2000)
+    parser.add_argument("--activation-threshold", type=float, default=-3.0)
+    args = parser.parse_args()
+
+    corpus = MetroLogCorpus(args.logs, workers=1)
+    rounds = [r for session_id in corpus.session_ids for r in corpus.sessions[session_id].rounds]
+    columns = ATTRIBUTE_SCHEMA.extract_rows(rounds)
+    configs = [
+        ('pyibl', {}),
+        ('store', {'store': True}),
+        ('store有界', {'store': True, 'max_instances': args.max_instances,
+                     'activation_threshold': args.activation_threshold}),
+    ]
+    print(f"{'记忆':>10} {'决策次数':>8} {'平均决策耗时':>12} {'实例数':>8}")
+    for name, options in configs:
+        agent = ibl_memory.make_agent(**options)
+        ibl_memory.bulk_populate(agent, *columns)
+        for decided, latency, size in run(agent, rounds, args.decisions, args.mode, args.window):
+            print(f"{name:>10} {decided:8d} {latency * 1e3:10.2f}ms {size:8d}")
+        if hasattr(agent, 'metrics'):
+            print(f"{name:>10} 指标: {agent.metrics()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import itertools
+import math
+from metro_log_parser import ATTRIBUTE_SCHEMA
+from instance_store import InstanceAgent
+
+# IBL决策的候选生成：穷举所有列车动作的组合（原ibl_model的做法），
+# 或按列车分解，在共享的状态属性上对联合动作做坐标/束搜索，只评估少量组合。
+
+DECISION_MODES = ('exhaustive', 'coordinate', 'beam')
+
+
+def train_options(train_id, status, at_station):
+    """单个列车本轮可行的动作（如 '3stop'），第一个总是monitor"""
+    if status == 'running':
+        options = ['monitor', 'stop', 'reverse']
+    elif status == 'stopped':
+        options = ['monitor', 'start', 'reverse']
+    else:
+        options = ['monitor']  # trapped及未知状态
+    if at_station and status in ('running', 'stopped', 'trapped'):
+        options.append('evacuate')
+    return [ATTRIBUTE_SCHEMA.action_name(train_id, a) for a in options]
+
+
+def allowed_actions(obs):
+    """在线观察中每个列车（按id顺序）的可行动作列表"""
+    return [train_options(train_id, train['status'], isinstance(train['stationId'], (int, float)))
+            for train_id, train in enumerate(obs['trains'])]
+
+
+class BlendScorer:
+    """在同一状态下计算联合动作的IBL混合值，不提交选择、不写入实例
+
+    状态属性只规范化一次，每个候选只替换action_tuple；结果按候选缓存。
+    计算方式与pyibl Agent.choose相同（精确匹配的实例混合，没有实例时为default_utility），依赖pyibl 5.2的内部属性；
+    InstanceAgent（见instance_store）直接使用它自己的blender。
+    """
+    def __init__(self, agent, attributes):
+        self.values = {}  # 联合动作 → 混合值
+        if isinstance(agent, InstanceAgent):
+            self._blend = agent.blender(attributes)
+            return
+        self.agent = agent
+        self.memory = agent._memory
+        # 与choose一样，先把时间推进到最后一次学习之后
+        if agent._last_learn_time >= self.memory.time:
+            self.memory.advance(agent._last_learn_time - self.memory.time + 1)
+        self.query = agent._canonicalize_choice({"action_tuple": None, **attributes})
+
+    def _blend(self, action_tuple):
+        self.query["action_tuple"] = action_tuple
+        value = self.memory.blend("_utility", self.query)
+        return self.agent.default_utility if value is None else value
+
+    def __call__(self, action_tuple):
+        value = self.values.get(action_tuple)
+        if value is None:
+            value = self.values[action_tuple] = self._blend(action_tuple)
+        return value
+
+    def best(self, count):
+        """混合值最高的count个联合动作"""
+        return [c for c, _ in sorted(self.values.items(), key=lambda item: -item[1])[:count]]
+
+
+def coordinate_search(score, options, max_sweeps=3):
+    """坐标上升：从全部monitor出发，依次对每个列车尝试其它动作，混合值提高就接受，直到一轮内没有变化"""
+    current = [opts[0] for opts in options]
+    best = score(tuple(current))
+    for _ in range(max_sweeps):
+        changed = False
+        for m, opts in enumerate(options):
+            for option in opts:
+                if option == current[m]:
+                    continue
+                candidate = current.copy()
+                candidate[m] = option
+                value = score(tuple(candidate))
+                if value > best:
+                    best, current, changed = value, candidate, True
+        if not changed:
+            break
+    return tuple(current)
+
+
+def beam_search(score, options, beam_width=4):
+    """束搜索：按列车顺序逐个展开动作（未展开的列车为monitor），每步保留混合值最高的beam_width个联合动作"""
+    beams = [tuple(opts[0] for opts in options)]
+    for m, opts in enumerate(options):
+        expanded = {}
+        for beam in beams:
+            for option in opts:
+                candidate = beam[:m] + (option,) + beam[m + 1:]
+                if candidate not in expanded:
+                    expanded[candidate] = score(candidate)
+        beams = sorted(expanded, key=lambda c: -expanded[c])[:beam_width]
+    return beams[0]
+
+
+def choose(agent, attributes, options, mode='exhaustive', beam_width=4, shortlist=4, pool=None):
+    """为当前状态选择联合动作，返回 (action_tuple, 交给agent.choose的候选数, 评估过的联合动作数)
+
+    exhaustive: 所有列车动作组合都交给agent.choose（组合数为各列车动作数之积）。
+    coordinate/beam: 先用BlendScorer搜索，再把混合值最高的shortlist个组合交给agent.choose，
+    由pyibl完成最终选择（保留其噪声和平局处理），之后照常调用agent.respond。
+    pool为agent的ibl_parallel.ParallelChooser时，exhaustive模式的组合分片交给多个进程评估，决策与串行相同。
+    """
+    if mode == 'exhaustive' and pool is not None:
+        evaluated = math.prod(len(opts) for opts in options)
+        return pool.choose(attributes, options), evaluated, evaluated
+    if mode == 'exhaustive':
+        candidates = list(itertools.product(*options))
+        evaluated = len(candidates)
+    else:
+        score = BlendScorer(agent, attributes)
+        if mode == 'coordinate':
+            best = coordinate_search(score, options)
+        elif mode == 'beam':
+            best = beam_search(score, options, beam_width)
+        else:
+            raise ValueError(f"未知的决策模式: {mode}，可选 {DECISION_MODES}")
+        candidates = [best] + [c for c in score.best(shortlist) if c != best][:shortlist - 1]
+        evaluated = len(score.values)
+    choices = [{"action_tuple": candidate, **attributes} for candidate in candidates]
+    return agent.choose(choices)["action_tuple"], len(choices), evaluated
@@ -0,0 +1,124 @@
+import os
+import pickle
+from collections import Counter
+from pyibl import Agent
+from metro_log_parser import MetroLogCorpus, ATTRIBUTE_SCHEMA
+from instance_store import InstanceAgent
+
+# IBL实例记忆的批量预填充和快照：
+# 整个日志语料先按列提取属性值，相同的 (动作, 属性, 得分变化) 实例合并为一个，出现次数作为该实例的多次引用（时间戳），
+# 再一次性写入智能体的记忆；结果可以保存为二进制快照，下次启动直接读取。
+
+SNAPSHOT_VERSION = 2
+
+
+def make_agent(store=False, **store_options):
+    """与ibl_model相同设置的IBL智能体；store为True时使用有界、带索引的InstanceAgent（store_options见instance_store）"""
+    attributes = ["action_tuple"] + list(ATTRIBUTE_SCHEMA.names)
+    if store:
+        return InstanceAgent(attributes, default_utility=1.0, noise=0.1, decay=0.5, **store_options)
+    return Agent(attributes=attributes, default_utility=1.0, noise=0.1, decay=0.5)
+
+
+def corpus_rows(source, cache_dir=None, workers=None):
+    """读取日志语料（目录、glob模式或文件列表，同MetroLogCorpus），按列返回所有回合的 (属性值元组, 动作元组, scoreChange) 及日志路径"""
+    corpus = MetroLogCorpus(source, workers=workers, cache_dir=cache_dir)
+    rows, actions, outcomes = [], [], []
+    for session_id in corpus.session_ids:
+        r, a, o = ATTRIBUTE_SCHEMA.extract_rows(corpus.sessions[session_id].rounds)
+        rows += r
+        actions += a
+        outcomes += o
+    return rows, actions, outcomes, corpus.paths
+
+
+def bulk_populate(agent, rows, actions, outcomes, when=0):
+    """把按列给出的实例批量写入agent的记忆，效果与逐个 agent.populate([choice], outcome, when) 相同
+
+    rows中的属性值按agent.attributes中action_tuple之后的顺序排列。相同的实例只创建一次，
+    其余出现只追加一次引用（同为when时刻）。返回 (实例总数, 合并后的实例数)。
+    pyibl Agent依赖pyibl 5.2 / pyactup 2.2的内部属性；InstanceAgent见其populate_values。
+    """
+    if not (len(rows) == len(actions) == len(outcomes)):
+        raise ValueError(f"列长度不一致: rows={len(rows)}, actions={len(actions)}, outcomes={len(outcomes)}")
+    if isinstance(agent, InstanceAgent):
+        return agent.populate_values([(action,) + row for action, row in zip(actions, rows)], outcomes, when)
+    names = agent.attributes[1:]
+    counts = Counter(zip(actions, rows, outcomes))
+    memory = agent._memory
+
+    def load():
+        for (action, row, outcome), count in counts.items():
+            if len(row) != len(names):
+                raise ValueError(f"属性值个数 {len(row)} 与智能体的属性数 {len(names)} 不一致")
+            slots = {"_utility": Agent._outcome_value(outcome), "action_tuple": action}
+            slots.update(zip(names, row))
+            chunk = memory.learn(slots) or memory[tuple(sorted(slots.items()))]
+            for _ in range(count - 1):
+                memory._cite(chunk)
+
+    agent._at_time(when, load)
+    if counts:
+        agent._last_learn_time = max(agent._last_learn_time, when)
+    return len(rows), len(counts)
+
+
+def _fingerprint(paths):
+    """日志文件的 (绝对路径, 大小, 修改时间)，用于判断快照是否过期"""
+    return [(os.path.abspath(p), os.stat(p).st_size, os.stat(p).st_mtime_ns) for p in paths]
+
+
+def save_snapshot(agent, path, paths=()):
+    """把智能体（含实例记忆）保存为二进制快照，paths为生成它的日志文件"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    snapshot = {'version': SNAPSHOT_VERSION, 'attributes': agent.attributes,
+                'sources': _fingerprint(paths), 'agent': agent}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path, paths=None, store=False):
+    """读取save_snapshot保存的智能体；快照不存在、格式版本、属性或智能体类型不符、或（给出paths时）日志已变化，返回None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            snapshot = pickle.load(f)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        print(f"⚠️ 读取实例快照失败，将重新生成: {e}")
+        return None
+    if snapshot.get('version') != SNAPSHOT_VERSION or snapshot['attributes'] != make_agent().attributes:
+        return None
+    if isinstance(snapshot['agent'], InstanceAgent) != store:
+        return None
+    if paths is not None and snapshot['sources'] != _fingerprint(paths):
+        return None
+    return snapshot['agent']
+
+
+def populated_agent(source, snapshot_path=None, cache_dir=None, store=False, **store_options):
+    """由日志语料得到已预填充的智能体：快照有效时直接读取，否则批量预填充并（给出snapshot_path时）保存快照
+
+    store / store_options同make_agent；读取InstanceAgent的快照时，store_options覆盖快照中的设置。
+    """
+    paths = MetroLogCorpus._resolve_paths(source)
+    if snapshot_path:
+        agent = load_snapshot(snapshot_path, paths, store)
+        if agent is not None:
+            for name, value in store_options.items():
+                if hasattr(agent, name):
+                    setattr(agent, name, value)
+            size = agent.store.size if store else len(agent._memory)
+            print(f"读取实例快照 {snapshot_path}：{size} 个实例")
+            return agent
+    agent = make_agent(store, **store_options)
+    rows, actions, outcomes, paths = corpus_rows(paths, cache_dir=cache_dir)
+    total, unique = bulk_populate(agent, rows, actions, outcomes)
+    print(f"由 {len(paths)} 个日志预填充 {total} 个实例，合并后 {unique} 个")
+    if snapshot_path:
+        save_snapshot(agent, snapshot_path, paths)
+    return agent
@@ -0,0 +1,145 @@
+import itertools
+import math
+import multiprocessing
+import pickle
+import time
+import numpy as np
+
+# 穷举决策的并行评估：所有列车动作组合按下标分片交给多个工作进程，
+# 每个进程持有InstanceAgent实例记忆的只读副本，每次决策前按主进程的journal增量同步；
+# 各分片返回其中的最高混合值、取得该值的候选下标和没有匹配实例的候选位图，主进程合并后按与串行 InstanceAgent.choose
+# 相同的方式写入默认效用、处理平局，得到与串行完全相同的决策（噪声和平局只由种子、时间和候选决定，见instance_store）。
+# 默认效用实例在journal中只记为一条 (状态, 动作选项, 位图) 操作，各进程按候选顺序自行展开写入，
+# 与串行的写入顺序相同（整理时激活值相同的实例按存储顺序淘汰）。
+
+
+def product_item(options, index):
+    """itertools.product(*options) 中第index个组合"""
+    item = []
+    for opts in reversed(options):
+        index, i = divmod(index, len(opts))
+        item.append(opts[i])
+    return tuple(reversed(item))
+
+
+def evaluate_shard(agent, attributes, options, start, stop):
+    """评估第 start..stop-1 个组合，返回 (最高混合值, 取得该值的下标列表, 没有匹配实例的组合的位图)
+
+    位图为长度 stop-start 的布尔数组经np.packbits打包的结果。
+    """
+    bucket_key, key = agent.store.keys(agent._values({"action_tuple": None, **attributes}))
+    bucket = agent.store.buckets.get(bucket_key, {})
+    state = key[1:]
+    best, best_indices = None, []
+    unmatched = np.zeros(stop - start, dtype=bool)
+    for i, action_tuple in enumerate(itertools.islice(itertools.product(*options), start, stop), start):
+        key = (action_tuple,) + state
+        group = bucket.get(key)
+        if group:
+            value = agent._blend(group, bucket_key, key)
+        else:
+            value = agent.default_utility
+            unmatched[i - start] = True
+            if value is None:
+                continue  # 没有default_utility时由主进程报错
+        if best is None or value > best:
+            best, best_indices = value, [i]
+        elif value == best:
+            best_indices.append(i)
+    return best, best_indices, np.packbits(unmatched)
+
+
+def _worker(connection, payload):
+    """工作进程：持有实例记忆副本，处理 ('choose', journal, 时间, 状态属性, 动作选项, start, stop) 和 ('close',)"""
+    agent = pickle.loads(payload)
+    while True:
+        message = connection.recv()
+        if message[0] == 'close':
+            break
+        _, ops, now, attributes, options, start, stop = message
+        agent.apply_journal(ops)
+        agent.time = now
+        connection.send(evaluate_shard(agent, attributes, options, start, stop))
+    connection.close()
+
+
+class ParallelChooser:
+    """用workers个进程为InstanceAgent做穷举决策，结果与 agent.choose(所有组合) 相同
+
+    创建时把智能体复制到各进程，之后主进程对实例记忆的修改（populate/respond/整理）记录在agent.journal中，
+    随下一次决策发给各进程重放。决策后照常调用 agent.respond。用完后调用close（或使用with）。
+    """
+    def __init__(self, agent, workers=None):
+        if agent.journal is not None:
+            raise ValueError("该智能体已经连接了一个ParallelChooser")
+        self.agent = agent
+        self.workers = workers or multiprocessing.cpu_count()
+        payload = pickle.dumps(agent, protocol=pickle.HIGHEST_PROTOCOL)
+        agent.journal = []
+        context = multiprocessing.get_context()
+        self.connections = []
+        self.processes = []
+        for _ in range(self.workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, args=(child, payload), daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def choose(self, attributes, options):
+        """在状态attributes下从各列车动作options的所有组合中选择，返回选中的动作元组"""
+        agent = self.agent
+        if agent._pending is not None:
+            raise RuntimeError("上一次选择还没有respond")
+        start = time.perf_counter()
+        agent._advance()
+        ops, agent.journal = agent.journal, []
+        total = math.prod(len(opts) for opts in options)
+        size = -(-total // self.workers)
+        shards = [(a, min(a + size, total)) for a in range(0, total, size)]
+        for connection, (a, b) in zip(self.connections, shards):
+            connection.send(('choose', ops, agent.time, attributes, options, a, b))
+        # 没有分到候选的进程也要同步journal
+        for connection in self.connections[len(shards):]:
+            connection.send(('choose', ops, agent.time, attributes, options, 0, 0))
+        results = [connection.recv() for connection in self.connections]
+
+        best, best_indices = None, []
+        unmatched = np.concatenate([np.unpackbits(bits, count=b - a).astype(bool)
+                                    for (_, _, bits), (a, b) in zip(results, shards)])
+        for value, indices, _ in results:
+            if value is None:
+                continue
+            if best is None or value > best:
+                best, best_indices = value, list(indices)
+            elif value == best:
+                best_indices += indices
+        if unmatched.any():
+            if agent.default_utility is None:
+                first = int(np.flatnonzero(unmatched)[0])
+                raise RuntimeError(f"组合 {product_item(options, first)} 没有匹配的实例，也没有default_utility")
+            if agent.default_utility_populates:
+                agent.learn_combinations(attributes, options, np.packbits(unmatched), agent.default_utility, 0)
+        chosen = product_item(options, agent.tie_break(best_indices))
+        agent._pending = agent._values({"action_tuple": chosen, **attributes})
+        agent.record_decision(total, time.perf_counter() - start)
+        return chosen
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(('close',))
+            except (BrokenPipeError, OSError):
+                pass
+            connection.close()
+        for process in self.processes:
+            process.join()
+        self.agent.journal = None
+        self.connections, self.processes = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
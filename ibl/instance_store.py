@@ -0,0 +1,412 @@
+import gc
+import hashlib
+import itertools
+import math
+import secrets
+import sys
+import time
+from collections import Counter
+import numpy as np
+from metro_log_parser import ATTRIBUTE_SCHEMA
+
+# 有界、带索引的IBL实例记忆，用于长时间运行的IBL智能体：
+# 实例按离散属性（每个列车的车站、轨道、方向、状态）的取值分桶，桶内再按其余属性（含动作）精确匹配，
+# 检索一个候选只查找它所在的桶；激活值衰减到阈值以下的实例被删除，较早的引用时间戳被合并，
+# 超过容量时淘汰激活值最低的实例。混合值的计算与pyibl相同（精确匹配、对数几率噪声、温度默认为 noise*sqrt(2)）。
+# 噪声和平局选择由 (种子, 时间, 候选, 实例序号) 计算，不依赖计算顺序，多进程分片评估（ibl_parallel）与串行结果相同。
+
+DISCRETE_TRAIN_FIELDS = ('train_in_stationId_', 'trackId_', 'direction_', 'status_')
+DISCRETE_ATTRIBUTES = tuple(n for n in ATTRIBUTE_SCHEMA.train_names if n.startswith(DISCRETE_TRAIN_FIELDS))
+
+MASK64 = (1 << 64) - 1
+TIE_BREAK_KEY = 0x7469655F627265616B  # 平局选择使用的候选键
+
+
+def mix64(x):
+    """splitmix64的混合函数：64位整数 → 均匀分布的64位整数"""
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+def candidate_key(bucket_key, key):
+    """候选（桶键, 桶内键）的稳定64位键，与进程和PYTHONHASHSEED无关"""
+    return int.from_bytes(hashlib.blake2b(repr((bucket_key, key)).encode(), digest_size=8).digest(), 'little')
+
+
+def counter_noise(seed, now, key, count, scale):
+    """第 0..count-1 个实例的对数几率噪声，只由 (seed, now, key, 实例序号) 决定"""
+    base = mix64(mix64(seed ^ now) ^ key)
+    noise = np.empty(count)
+    for j in range(count):
+        u = ((mix64((base + j) & MASK64) >> 11) + 0.5) / 9007199254740992.0  # (0, 1)
+        noise[j] = scale * math.log(u / (1 - u))
+    return noise
+
+
+class Instance:
+    """一个实例：结果值和引用时间戳
+
+    近期引用按 (时间, 次数) 精确保存；合并后的较早引用只保留次数和时间范围，
+    激活值按均匀分布近似（Petrov 2006，与pyactup的optimized_learning相同）。
+    """
+    __slots__ = ('outcome', 'times', 'counts', 'old_count', 'old_first', 'old_last')
+
+    def __init__(self, outcome, when, count=1):
+        self.outcome = outcome
+        self.times = [when]
+        self.counts = [count]
+        self.old_count = 0
+        self.old_first = self.old_last = when
+
+    @property
+    def references(self):
+        return sum(self.counts) + self.old_count
+
+    def cite(self, when, count=1):
+        if self.times[-1] == when:
+            self.counts[-1] += count
+        else:
+            self.times.append(when)
+            self.counts.append(count)
+
+    def base_level(self, now, decay):
+        """不含噪声的基础激活值 ln(Σ (now - t)^-decay)"""
+        total = 0.0
+        for t, c in zip(self.times, self.counts):
+            total += c * (now - t) ** -decay
+        if self.old_count:
+            span = self.old_last - self.old_first
+            if span > 0:
+                d1 = 1 - decay
+                total += self.old_count * ((now - self.old_first) ** d1 - (now - self.old_last) ** d1) / (d1 * span)
+            else:
+                total += self.old_count * (now - self.old_first) ** -decay
+        return math.log(total)
+
+    def compress(self, keep):
+        """只保留最近keep个引用时间，更早的并入近似部分，返回合并的时间戳个数"""
+        merged = len(self.times) - keep
+        if merged <= 0:
+            return 0
+        if not self.old_count:
+            self.old_first = self.times[0]
+        self.old_count += sum(self.counts[:merged])
+        self.old_last = self.times[merged - 1]
+        del self.times[:merged], self.counts[:merged]
+        return merged
+
+
+class InstanceStore:
+    """按离散属性分桶的实例集合：buckets[离散属性值][其余属性值] → [Instance]（每个不同结果一个）"""
+    def __init__(self, attributes, discrete_attributes):
+        self.attributes = tuple(attributes)
+        discrete = set(discrete_attributes)
+        missing = discrete - set(self.attributes)
+        if missing:
+            raise ValueError(f"离散属性不在属性列表中: {sorted(missing)}")
+        self.discrete_index = [i for i, a in enumerate(self.attributes) if a in discrete]
+        self.rest_index = [i for i, a in enumerate(self.attributes) if a not in discrete]
+        self.buckets = {}
+        self.size = 0
+
+    def keys(self, values):
+        """属性值（按attributes顺序）→ (桶键, 桶内键)"""
+        return tuple(values[i] for i in self.discrete_index), tuple(values[i] for i in self.rest_index)
+
+    def group(self, values):
+        """与values精确匹配的实例列表，没有时为None"""
+        bucket_key, key = self.keys(values)
+        bucket = self.buckets.get(bucket_key)
+        return bucket.get(key) if bucket else None
+
+    def learn(self, values, outcome, when, count=1):
+        """加入一个实例；已有相同属性和结果的实例时只追加引用"""
+        bucket_key, key = self.keys(values)
+        return self.learn_keys(bucket_key, key, outcome, when, count)
+
+    def learn_keys(self, bucket_key, key, outcome, when, count=1):
+        group = self.buckets.setdefault(bucket_key, {}).setdefault(key, [])
+        for instance in group:
+            if instance.outcome == outcome:
+                instance.cite(when, count)
+                return instance
+        instance = Instance(outcome, when, count)
+        group.append(instance)
+        self.size += 1
+        return instance
+
+    def __iter__(self):
+        """逐个产出 (桶键, 桶内键, Instance)"""
+        for bucket_key, bucket in self.buckets.items():
+            for key, group in bucket.items():
+                for instance in group:
+                    yield bucket_key, key, instance
+
+    def remove(self, doomed):
+        """删除doomed中的实例（按id），并清理空的组和桶"""
+        for bucket_key in list(self.buckets):
+            bucket = self.buckets[bucket_key]
+            for key in list(bucket):
+                group = [instance for instance in bucket[key] if id(instance) not in doomed]
+                self.size -= len(bucket[key]) - len(group)
+                if group:
+                    bucket[key] = group
+                else:
+                    del bucket[key]
+            if not bucket:
+                del self.buckets[bucket_key]
+
+    def memory_bytes(self):
+        """实例存储占用的内存估计（容器、键元组、实例和时间戳列表，不含共享的属性值对象）"""
+        total = sys.getsizeof(self.buckets)
+        for bucket_key, bucket in self.buckets.items():
+            total += sys.getsizeof(bucket_key) + sys.getsizeof(bucket)
+            for key, group in bucket.items():
+                total += sys.getsizeof(key) + sys.getsizeof(group)
+                for instance in group:
+                    total += sys.getsizeof(instance) + sys.getsizeof(instance.times) + sys.getsizeof(instance.counts)
+        return total
+
+
+class InstanceAgent:
+    """使用InstanceStore的IBL智能体，接口与ibl_model中用到的pyibl Agent部分相同（populate/choose/respond）
+
+    choices为属性dict的列表，第一个属性（action_tuple）为动作。时间、默认效用的写入和平局处理与pyibl 5.2相同，
+    噪声和平局的随机数由seed按计数器方式生成（见counter_noise），seed为None时随机选取。
+    max_instances / activation_threshold 为None时不限制。每consolidate_interval次respond整理一次记忆：
+    删除激活值（不含噪声）低于activation_threshold的实例，把每个实例keep_references个以前的引用时间合并，
+    仍超过max_instances时淘汰激活值最低的实例，直到只剩 max_instances * evict_fraction 个，
+    以免此后每次respond都触发整理。
+    """
+    def __init__(self, attributes, default_utility=None, noise=0.1, decay=0.5, temperature=None,
+                 default_utility_populates=True, discrete_attributes=DISCRETE_ATTRIBUTES, max_instances=None,
+                 activation_threshold=None, keep_references=16, consolidate_interval=100, evict_fraction=0.9,
+                 seed=None):
+        if temperature is None:
+            temperature = noise * math.sqrt(2)
+        if temperature <= 0:
+            raise ValueError("noise为0时必须指定正的temperature")
+        self.attributes = list(attributes)
+        self.default_utility = default_utility
+        self.noise = noise
+        self.decay = decay
+        self.temperature = temperature
+        self.default_utility_populates = default_utility_populates
+        self.max_instances = max_instances
+        self.activation_threshold = activation_threshold
+        self.keep_references = keep_references
+        self.consolidate_interval = consolidate_interval
+        self.evict_fraction = evict_fraction
+        self.store = InstanceStore(self.attributes, discrete_attributes)
+        self.seed = (secrets.randbits(64) if seed is None else seed) & MASK64
+        self.journal = None  # 不为None时记录对实例的修改，供副本增量同步（见ibl_parallel）
+        self.time = 0
+        self._last_learn_time = 0
+        self._pending = None
+        self._responses = 0
+        self.stats = Counter()  # 决策、混合、整理的计数和累计耗时
+
+    def _values(self, choice):
+        return tuple(choice.get(a) for a in self.attributes)
+
+    def _advance(self):
+        """与pyibl一样，决策前把时间推进到最后一次学习之后"""
+        if self._last_learn_time >= self.time:
+            self.time = self._last_learn_time + 1
+
+    def _learn(self, values, outcome, when, count=1):
+        self.store.learn(values, outcome, when, count)
+        if self.journal is not None:
+            self.journal.append(('learn', values, outcome, when, count))
+
+    def _blend(self, group, bucket_key, key):
+        """一组精确匹配实例的混合值：按含噪声的激活值做softmax加权平均"""
+        if len(group) == 1:
+            return group[0].outcome
+        activations = np.fromiter((instance.base_level(self.time, self.decay) for instance in group),
+                                  dtype=np.float64, count=len(group))
+        if self.noise:
+            activations += counter_noise(self.seed, self.time, candidate_key(bucket_key, key), len(group), self.noise)
+        weights = np.exp((activations - activations.max()) / self.temperature)
+        return float(np.dot(weights, [instance.outcome for instance in group]) / weights.sum())
+
+    def populate(self, choices, outcome, when=None):
+        when = self.time if when is None else when
+        if when > self.time:
+            raise ValueError(f"populate的时间 {when} 不能晚于当前时间 {self.time}")
+        for choice in choices:
+            self._learn(self._values(choice), outcome, when)
+        self._last_learn_time = max(self._last_learn_time, when)
+
+    def populate_values(self, values, outcomes, when=0):
+        """批量加入实例（属性值元组按attributes顺序），相同的实例合并为多次引用，返回 (实例总数, 合并后的实例数)"""
+        counts = Counter(zip(values, outcomes))
+        for (row, outcome), count in counts.items():
+            if len(row) != len(self.attributes):
+                raise ValueError(f"属性值个数 {len(row)} 与智能体的属性数 {len(self.attributes)} 不一致")
+            self._learn(row, outcome, when, count)
+        if counts:
+            self._last_learn_time = max(self._last_learn_time, when)
+        return len(values), len(counts)
+
+    def learn_combinations(self, attributes, options, mask, outcome, when):
+        """在同一状态下为 itertools.product(*options) 中mask为真的组合按顺序加入实例
+
+        mask为按位打包的布尔数组（np.packbits），journal中只记录状态属性、动作选项和mask，不展开组合。
+        """
+        bucket_key, key = self.store.keys(self._values({"action_tuple": None, **attributes}))
+        state = key[1:]
+        total = math.prod(len(opts) for opts in options)
+        selected = np.unpackbits(mask, count=total).astype(bool).tolist()
+        bucket = self.store.buckets.setdefault(bucket_key, {})
+        # 一次创建大量对象时暂停循环垃圾回收（新建的实例没有循环引用），否则回收占大部分耗时
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for action_tuple in itertools.compress(itertools.product(*options), selected):
+                key = (action_tuple,) + state
+                if key in bucket:
+                    self.store.learn_keys(bucket_key, key, outcome, when)
+                else:
+                    bucket[key] = [Instance(outcome, when)]  # 通常是没有匹配实例的组合，直接建组
+                    self.store.size += 1
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if self.journal is not None:
+            self.journal.append(('learn_combinations', attributes, options, mask, outcome, when))
+
+    def blend(self, values):
+        """属性值元组的混合值，没有匹配实例时为None；不写入实例"""
+        bucket_key, key = self.store.keys(values)
+        group = self.store.buckets.get(bucket_key, {}).get(key)
+        return self._blend(group, bucket_key, key) if group else None
+
+    def blender(self, attributes):
+        """固定状态属性、只改变动作的混合值函数（供ibl_choice.BlendScorer使用），没有匹配实例时为default_utility"""
+        self._advance()
+        bucket_key, key = self.store.keys(self._values({"action_tuple": None, **attributes}))
+        bucket = self.store.buckets.get(bucket_key, {})
+        state = key[1:]
+
+        def blend(action_tuple):
+            start = time.perf_counter()
+            key = (action_tuple,) + state
+            group = bucket.get(key)
+            value = self._blend(group, bucket_key, key) if group else self.default_utility
+            self.stats['blends'] += 1
+            self.stats['blend_seconds'] += time.perf_counter() - start
+            return value
+        return blend
+
+    def choose(self, choices):
+        if self._pending is not None:
+            raise RuntimeError("上一次选择还没有respond")
+        start = time.perf_counter()
+        self._advance()
+        queries = [self._values(choice) for choice in choices]
+        utilities = []
+        for query in queries:
+            bucket_key, key = self.store.keys(query)
+            group = self.store.buckets.get(bucket_key, {}).get(key)
+            if group:
+                utilities.append(self._blend(group, bucket_key, key))
+                continue
+            if self.default_utility is None:
+                raise RuntimeError(f"选项 {query} 没有匹配的实例，也没有default_utility")
+            utilities.append(self.default_utility)
+            if self.default_utility_populates:
+                self._learn(query, self.default_utility, 0)
+        best_utility = max(utilities)
+        best = self.tie_break([i for i, u in enumerate(utilities) if u == best_utility])
+        self._pending = queries[best]
+        self.record_decision(len(queries), time.perf_counter() - start)
+        return choices[best]
+
+    def tie_break(self, best_indices):
+        """在混合值相同的候选（按候选顺序）中选一个，只由seed和时间决定"""
+        if len(best_indices) == 1:
+            return best_indices[0]
+        return best_indices[mix64(mix64(self.seed ^ self.time) ^ TIE_BREAK_KEY) % len(best_indices)]
+
+    def record_decision(self, candidates, elapsed):
+        self.stats['decisions'] += 1
+        self.stats['blends'] += candidates
+        self.stats['choose_seconds'] += elapsed
+        self.stats['max_choose_seconds'] = max(self.stats['max_choose_seconds'], elapsed)
+
+    def respond(self, outcome):
+        if self._pending is None:
+            raise RuntimeError("没有等待结果的选择")
+        self._learn(self._pending, outcome, self.time)
+        self._last_learn_time = self.time
+        self._pending = None
+        self._responses += 1
+        if (self.consolidate_interval and self._responses % self.consolidate_interval == 0) or \
+                (self.max_instances is not None and self.store.size > self.max_instances):
+            self.consolidate()
+
+    def consolidate(self):
+        """整理记忆：合并较早的引用时间，删除激活值低于阈值的实例，超过容量时淘汰激活值最低的实例"""
+        start = time.perf_counter()
+        if self.journal is not None:
+            self.journal.append(('consolidate', self.time, self._last_learn_time))
+        now = max(self.time, self._last_learn_time) + 1  # 下一次决策时的时间
+        merged = 0
+        activations = []
+        doomed = set()
+        for _, _, instance in self.store:
+            if self.keep_references and self.decay < 1:
+                merged += instance.compress(self.keep_references)
+            activation = instance.base_level(now, self.decay)
+            if self.activation_threshold is not None and activation < self.activation_threshold:
+                doomed.add(id(instance))
+            else:
+                activations.append((activation, len(activations), id(instance)))  # 激活值相同时按存储顺序淘汰
+        dropped = len(doomed)
+        if self.max_instances is not None and len(activations) > self.max_instances:
+            activations.sort()
+            keep = int(self.max_instances * self.evict_fraction)
+            doomed.update(i for _, _, i in activations[:len(activations) - keep])
+        if doomed:
+            self.store.remove(doomed)
+        self.stats['consolidations'] += 1
+        self.stats['merged_references'] += merged
+        self.stats['dropped'] += dropped
+        self.stats['evicted'] += len(doomed) - dropped
+        self.stats['consolidate_seconds'] += time.perf_counter() - start
+
+    def apply_journal(self, ops):
+        """在副本上按顺序重放另一个智能体journal中记录的修改"""
+        for op in ops:
+            if op[0] == 'learn':
+                self.store.learn(*op[1:])
+            elif op[0] == 'learn_combinations':
+                self.learn_combinations(*op[1:])
+            else:
+                _, self.time, self._last_learn_time = op
+                self.consolidate()
+
+    def metrics(self):
+        """记忆大小和延迟指标"""
+        stats = self.stats
+        decisions = stats['decisions'] or 1
+        return {
+            'time': self.time,
+            'instances': self.store.size,
+            'buckets': len(self.store.buckets),
+            'references': sum(instance.references for _, _, instance in self.store),
+            'memory_bytes': self.store.memory_bytes(),
+            'decisions': stats['decisions'],
+            'mean_choose_ms': stats['choose_seconds'] / decisions * 1e3,
+            'max_choose_ms': stats['max_choose_seconds'] * 1e3,
+            # choose和BlendScorer中每个候选的平均耗时（choose的耗时含默认效用的写入和最终选择）
+            'mean_candidate_us': (stats['choose_seconds'] + stats['blend_seconds']) / (stats['blends'] or 1) * 1e6,
+            'consolidations': stats['consolidations'],
+            'consolidate_ms': stats['consolidate_seconds'] * 1e3,
+            'merged_references': stats['merged_references'],
+            'dropped': stats['dropped'],
+            'evicted': stats['evicted'],
+        }
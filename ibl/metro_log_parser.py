@@ -1,8 +1,25 @@
+import codecs
+import copy
+import glob
+import hashlib
 import json
-from dataclasses import dataclass
-from typing import List, Dict, Optional, Union
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from dataclasses import dataclass, asdict, field
+from typing import List, Dict, Optional, Union, Iterator, Tuple, Any
 
-@dataclass
+class _Record:
+    """日志记录dataclass的基类：按字段元组序列化，读回时直接调用构造函数，快照加载比逐字段setstate快"""
+    __slots__ = ()
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, name) for name in self.__slots__)
+
+@dataclass(slots=True)
 class GameSettings:
     failure_points_count: int
     failure_points_flood_increase_base_mu: float
@@ -21,8 +38,8 @@ class GameSettings:
     elevation_difference_factor: float
     flood_difference_factor: float
 
-@dataclass
-class Train:
+@dataclass(slots=True)
+class Train(_Record):
     id: int
     station_id: Optional[int]
     track_id: int
@@ -39,8 +56,8 @@ class Train:
     delayed_rounds: int
     last_move_round: int
 
-@dataclass
-class Station:
+@dataclass(slots=True)
+class Station(_Record):
     id: int
     current_flood_level: float
     passengers_change: Optional[int]
@@ -52,7 +69,8 @@ class Station:
     elevation: float
     is_transfer: bool
 
-class TrackNode:
+@dataclass(slots=True)
+class TrackNode(_Record):
     track_id: int
     station_a: int
     station_b: int
@@ -61,15 +79,15 @@ class TrackNode:
     node_current_flood_level: float
     node_is_failure_point: bool
 
-@dataclass
-class TrainLocation:
+@dataclass(slots=True)
+class TrainLocation(_Record):
     type: str
     id: int
     name: str
     index_in_line: int
 
-@dataclass
-class PlayerAction:
+@dataclass(slots=True)
+class PlayerAction(_Record):
     action_type: str
     target_train: Train
     target_location: TrainLocation
@@ -77,30 +95,851 @@ class PlayerAction:
     round: int
     select_time_used: int
 
-@dataclass
-class GameRound:
+@dataclass(slots=True, eq=False)
+class GameRound(_Record):
+    """一个回合的记录
+
+    trains/stations/track_nodes/player_actions在第一次访问时才从原始记录raw解析，结果缓存在对象中；
+    只读取得分等标量字段时不会构建任何子对象。
+    """
     round_id: int
     round_num: int
     timestamp: str
     total_score: int
     score_change: int
     decision_time_used: int
-    trains: List[Train]
-    stations: List[Station]
-    track_nodes: List[TrackNode]
-    player_actions: List[PlayerAction]
+    raw: Optional[dict] = field(default=None, repr=False)
+    _trains: Optional[List[Train]] = field(default=None, repr=False)
+    _stations: Optional[List[Station]] = field(default=None, repr=False)
+    _track_nodes: Optional[List[TrackNode]] = field(default=None, repr=False)
+    _player_actions: Optional[List[PlayerAction]] = field(default=None, repr=False)
+
+    @property
+    def trains(self) -> List[Train]:
+        if self._trains is None:
+            self._trains = _parse_trains(self.raw['trains'])
+        return self._trains
+
+    @property
+    def stations(self) -> List[Station]:
+        if self._stations is None:
+            self._stations = _parse_stations(self.raw['stations'])
+        return self._stations
+
+    @property
+    def track_nodes(self) -> List[TrackNode]:
+        if self._track_nodes is None:
+            self._track_nodes = _parse_track_nodes(self.raw['tracks'])
+        return self._track_nodes
+
+    @property
+    def player_actions(self) -> List[PlayerAction]:
+        if self._player_actions is None:
+            self._player_actions = _parse_player_actions(self.raw['playerActions'])
+        return self._player_actions
+
+    def materialize(self) -> 'GameRound':
+        """解析全部子对象并释放原始记录（原始记录会被复用或修改时使用）"""
+        self.trains, self.stations, self.track_nodes, self.player_actions
+        self.raw = None
+        return self
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, GameRound):
+            return NotImplemented
+        return ((self.round_id, self.round_num, self.timestamp, self.total_score, self.score_change,
+                 self.decision_time_used, self.trains, self.stations, self.track_nodes, self.player_actions)
+                == (other.round_id, other.round_num, other.timestamp, other.total_score, other.score_change,
+                    other.decision_time_used, other.trains, other.stations, other.track_nodes, other.player_actions))
+
+    def __reduce__(self):
+        # 序列化前先解析全部子对象，不保存原始记录：读回的回合（快照、进程池结果）不需要再解析
+        self.materialize()
+        return _Record.__reduce__(self)
+
+
+def _parse_trains(trains: List[dict]) -> List[Train]:
+    """解析列车状态数据"""
+    return [Train(
+        id=t['id'],
+        station_id=t['stationId'],
+        track_id=t['trackId'],
+        node_position=t['nodePosition'],
+        capacity=t['capacity'],
+        passengers_change=t.get('passengersChange', None),
+        passengers=t['currentPassengers'],
+        position_change=t.get('positionChange', None),
+        status_change=t.get('statusChange', None),
+        status=t['currentStatus'],
+        direction_change=t.get('directionChange', None),
+        direction=t['currentDirection'],
+        line_id=t['lineId'],
+        delayed_rounds=t.get('delayedRounds', 0),
+        last_move_round=t.get('lastMoveRound', 0)
+    ) for t in trains]
+
+
+def _parse_stations(stations: List[dict]) -> List[Station]:
+    """解析车站状态数据"""
+    return [Station(
+        id=s['id'],
+        current_flood_level=s['currentFloodLevel'],
+        passengers_change=s.get('passengersChange', None),
+        passengers=s['currentPassengers'],
+        pump_used=s['pumpUsed'],
+        pump_threshold=s['pumpThreshold'],
+        pump_rate=s['pumpRate'],
+        is_failure_point=s['isFailurePoint'],
+        elevation=s['elevation'],
+        is_transfer=s['isTransfer']
+    ) for s in stations]
+
+
+def _parse_track_nodes(tracks: List[dict]) -> List[TrackNode]:
+    """解析轨道节点数据"""
+    return [TrackNode(
+        track_id=t['id'],
+        station_a=t['stationA'],
+        station_b=t['stationB'],
+        line_id=t['lineId'],
+        node_id=n['id'],
+        node_current_flood_level=n['currentFloodLevel'],
+        node_is_failure_point=n['isFailurePoint']
+    ) for t in tracks for n in t['nodes']]
+
+
+def _parse_train_location(location: dict) -> TrainLocation:
+    """解析列车位置数据"""
+    return TrainLocation(
+        type=location['type'],
+        id=location['id'],
+        name=location['name'],
+        index_in_line=location['indexInLine']
+    )
+
+
+def _parse_train(train: dict) -> Train:
+    """解析列车数据"""
+    return Train(
+        id=train['id'],
+        station_id=train['stationId'],
+        track_id=train['trackId'],
+        node_position=train['nodePosition'],
+        capacity=train['capacity'],
+        passengers=train['passengers'],
+        status=train['status'],
+        direction=train['direction'],
+        line_id=train['lineId'],
+        delayed_rounds=train.get('delayedRounds', 0),
+        last_move_round=train.get('lastMoveRound', 0),
+        passengers_change=train.get('passengersChange', None),
+        status_change=train.get('statusChange', None),
+        direction_change=train.get('directionChange', None),
+        position_change=train.get('positionChange', None)
+    )
+
+
+def _parse_player_actions(player_actions: List[dict]) -> List[PlayerAction]:
+    """解析玩家操作数据"""
+    return [PlayerAction(
+        action_type=a['type'],
+        target_train=_parse_train(a['targetTrain']),
+        target_location=_parse_train_location(a['targetLocation']),
+        timestamp=a['timestamp'],
+        round=a['round'],
+        select_time_used=a['selectTimeUsed']
+    ) for a in player_actions]
+
+
+def iter_log_entries(file_path: str, follow: bool = False, poll_interval: float = 0.5,
+                     idle_timeout: Optional[float] = None, chunk_size: int = 1 << 16) -> Iterator[dict]:
+    """逐个解析日志JSON数组中的元素，内存占用只与单个回合的大小有关
+
+    follow=True时像 tail -f 一样持续等待新写入的回合：
+    既支持不断追加元素的文件，也支持每次整体重写、末尾带 "]" 的文件（在 "]" 处等待其被新元素替换）。
+    idle_timeout秒内没有新数据时结束；为None时一直等待。
+    等待时检查路径上的文件：被重命名替换（写临时文件再改名的原子保存）时打开新文件，从已读到的位置继续，
+    新文件比已读位置短时视为新的日志，从头读取。
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    offset = 0  # buffer[0] 在文件中的字节偏移
+    started = False
+    closed_stat = None  # 读到 "]" 时文件的 (大小, 修改时间)
+    last_data = time.monotonic()
+    f = open(file_path, 'rb')
+    try:
+        while True:
+            pos, closed = 0, False
+            while True:
+                while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                    pos += 1
+                if pos == len(buffer):
+                    break
+                char = buffer[pos]
+                if not started:
+                    if char != '[':
+                        raise ValueError(f"{file_path} 不是JSON数组")
+                    started = True
+                    pos += 1
+                elif char == ',':
+                    pos += 1
+                elif char == ']':
+                    closed = True
+                    break
+                else:
+                    try:
+                        entry, pos = decoder.raw_decode(buffer, pos)
+                    except json.JSONDecodeError:
+                        break  # 元素还不完整，继续读取
+                    yield entry
+
+            offset += len(buffer[:pos].encode('utf-8'))
+            buffer = buffer[pos:]
+            if closed:
+                if not follow:
+                    return
+                # 数组已闭合：文件有变化时回到 "]" 处重新读取，否则等待
+                stat = os.fstat(f.fileno())
+                if closed_stat != (stat.st_size, stat.st_mtime_ns):
+                    closed_stat = (stat.st_size, stat.st_mtime_ns)
+                    f.seek(offset)
+                    text_decoder.reset()
+                    buffer = ''
+                chunk = f.read(chunk_size) if not buffer else b''
+            else:
+                closed_stat = None
+                chunk = f.read(chunk_size)
+
+            if chunk:
+                buffer += text_decoder.decode(chunk)
+                if not buffer.lstrip().startswith(']'):
+                    last_data = time.monotonic()
+                continue
+            if not follow:
+                if buffer.strip() or not started:
+                    raise ValueError(f"{file_path} 不完整：数组未闭合")
+                return
+            if idle_timeout is not None and time.monotonic() - last_data > idle_timeout:
+                return
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                stat = None  # 正在替换，下次再检查
+            if stat is not None:
+                own = os.fstat(f.fileno())
+                if (stat.st_dev, stat.st_ino) != (own.st_dev, own.st_ino):
+                    f.close()
+                    f = open(file_path, 'rb')
+                    if os.fstat(f.fileno()).st_size < offset:
+                        offset, started = 0, False  # 新的日志，从头读取
+                    f.seek(offset)
+                    text_decoder.reset()
+                    buffer = ''
+                    closed_stat = None
+                    continue
+            time.sleep(poll_interval)
+    finally:
+        f.close()
+
+
+# 列式导出中字符串字段的编码
+STATUS_CODES = {'running': 0, 'stopped': 1, 'trapped': 2}
+DIRECTION_CODES = {'forward': 0, 'backward': 1}
+ACTION_CODES = {'monitor': 0, 'start': 1, 'stop': 2, 'reverse': 3, 'evacuate': 4}
+
+
+def log_entries_to_columns(entries) -> Dict[str, np.ndarray]:
+    """将日志记录（dict的可迭代对象）转为列式数组，每个数组第一维为回合
+
+    回合: round_num, round_id, total_score, score_change, decision_time_used
+    车站 [回合, 车站]: station_flood, station_passengers, station_pump_used, station_failure
+    轨道节点 [回合, 节点]: node_flood, node_failure
+    列车 [回合, 列车]: train_station / train_track（-1表示null）, train_position, train_status, train_direction,
+        train_passengers, train_delayed
+    玩家操作 [回合, 列车]: actions（ACTION_CODES，没有操作的列车为monitor）
+    """
+    columns = {name: [] for name in (
+        'round_num', 'round_id', 'total_score', 'score_change', 'decision_time_used',
+        'station_flood', 'station_passengers', 'station_pump_used', 'station_failure',
+        'node_flood', 'node_failure',
+        'train_station', 'train_track', 'train_position', 'train_status', 'train_direction',
+        'train_passengers', 'train_delayed', 'actions')}
+    for e in entries:
+        columns['round_num'].append(e['round'])
+        columns['round_id'].append(e['id'])
+        columns['total_score'].append(e['totalScore'])
+        columns['score_change'].append(e['scoreChange'])
+        columns['decision_time_used'].append(e['decisionTimeUsed'])
+
+        stations = e['stations']
+        columns['station_flood'].append([s['currentFloodLevel'] for s in stations])
+        columns['station_passengers'].append([s['currentPassengers'] for s in stations])
+        columns['station_pump_used'].append([s['pumpUsed'] for s in stations])
+        columns['station_failure'].append([s['isFailurePoint'] for s in stations])
+
+        nodes = [n for t in e['tracks'] for n in t['nodes']]
+        columns['node_flood'].append([n['currentFloodLevel'] for n in nodes])
+        columns['node_failure'].append([n['isFailurePoint'] for n in nodes])
+
+        trains = e['trains']
+        columns['train_station'].append([-1 if t['stationId'] is None else t['stationId'] for t in trains])
+        columns['train_track'].append([-1 if t['trackId'] is None else t['trackId'] for t in trains])
+        columns['train_position'].append([t['nodePosition'] for t in trains])
+        columns['train_status'].append([STATUS_CODES[t['currentStatus']] for t in trains])
+        columns['train_direction'].append([DIRECTION_CODES[t['currentDirection']] for t in trains])
+        columns['train_passengers'].append([t['currentPassengers'] for t in trains])
+        columns['train_delayed'].append([t.get('delayedRounds', 0) for t in trains])
+
+        # 与_get_action_attributes一致：同一列车有多个操作时取最后一个
+        actions = [ACTION_CODES['monitor']] * len(trains)
+        for a in e['playerActions']:
+            actions[a['targetTrain']['id']] = ACTION_CODES[a['type']]
+        columns['actions'].append(actions)
+
+    dtypes = {
+        'round_num': np.int32, 'round_id': np.int64, 'total_score': np.int64, 'score_change': np.int64,
+        'decision_time_used': np.int32,
+        'station_flood': np.float32, 'station_passengers': np.int32, 'station_pump_used': bool, 'station_failure': bool,
+        'node_flood': np.float32, 'node_failure': bool,
+        'train_station': np.int8, 'train_track': np.int8, 'train_position': np.int16, 'train_status': np.int8,
+        'train_direction': np.int8, 'train_passengers': np.int32, 'train_delayed': np.int32, 'actions': np.int8,
+    }
+    return {name: np.asarray(values, dtype=dtypes[name]) for name, values in columns.items()}
+
+
+def load_columns(path: str) -> Dict[str, np.ndarray]:
+    """读取save_columns写出的npz文件，返回列式数组dict；设置在 'settings' 中（GameSettings）"""
+    with np.load(path) as data:
+        columns = {name: data[name] for name in data.files}
+    columns['settings'] = GameSettings(**json.loads(str(columns['settings'])))
+    return columns
+
+
+# IBL属性：日志回合和在线观察共用同一套属性名和提取逻辑
+TRAIN_ATTRIBUTE_FIELDS = ('train_in_stationId_', 'trackId_', 'nodePosition_', 'passengers_in_train_',
+                          'delayedRounds_', 'direction_', 'status_')
+STATION_ATTRIBUTE_FIELDS = ('isTransfer_', 'floodLevel_', 'isFailurePoint_', 'elevation_', 'pumpUsed_')
+
+
+class AttributeSchema:
+    """IBL属性定义：属性名按 列车0..7、车站0..15 的顺序预先生成并intern
+
+    提取时先按固定顺序收集属性值，再与属性名一次zip成dict；
+    日志回合（GameRound）和在线观察（服务器返回的dict）只在读取字段时不同，其余完全共用。
+    """
+    def __init__(self, num_trains: int = 8, num_stations: int = 16):
+        self.num_trains = num_trains
+        self.num_stations = num_stations
+        self.train_names = tuple(sys.intern(f + str(i)) for i in range(num_trains) for f in TRAIN_ATTRIBUTE_FIELDS)
+        self.station_names = tuple(sys.intern(f + str(i)) for i in range(num_stations) for f in STATION_ATTRIBUTE_FIELDS)
+        self.names = self.train_names + self.station_names
+        self.monitor_actions = tuple(f"{i}monitor" for i in range(num_trains))
+        self._action_names: Dict[Tuple[int, str], str] = {}
+
+    def payload(self, values: list) -> Dict[str, Union[str, int, float]]:
+        """按names顺序排列的属性值 → IBL属性dict"""
+        return dict(zip(self.names, values))
+
+    def record_values(self, trains: List[Train], stations: List[Station]) -> list:
+        values = []
+        for t in trains:
+            values += (str(t.station_id), str(t.track_id), t.node_position, t.passengers, t.delayed_rounds,
+                       t.direction, t.status)
+        for s in stations:
+            values += (s.is_transfer, s.current_flood_level, s.is_failure_point, s.elevation, s.pump_used)
+        return values
+
+    def observation_values(self, obs: dict) -> list:
+        values = []
+        for t in obs['trains']:
+            values += (str(t['stationId']), str(t['trackId']), t['nodePosition'], t['passengers'], t['delayedRounds'],
+                       t['direction'], t['status'])
+        for s in obs['stations']:
+            values += (s['isTransfer'], s['floodLevel'], s['isFailurePoint'], s['elevation'], s['pumpUsed'])
+        return values
+
+    def from_round(self, game_round: GameRound) -> Dict[str, Union[str, int, float]]:
+        return self.payload(self.record_values(game_round.trains, game_round.stations))
+
+    def from_observation(self, obs: dict) -> Dict[str, Union[str, int, float]]:
+        return self.payload(self.observation_values(obs))
+
+    def action_name(self, train_id: int, action_type: str) -> str:
+        """IBL中单个列车的动作，如 '3stop'"""
+        key = (train_id, action_type)
+        name = self._action_names.get(key)
+        if name is None:
+            name = self._action_names[key] = sys.intern(str(train_id) + action_type)
+        return name
+
+    def action_tuple(self, player_actions: List[PlayerAction]) -> Tuple[str, ...]:
+        """回合中玩家操作对应的动作元组，没有操作的列车为monitor，同一列车有多个操作时取最后一个"""
+        moves = list(self.monitor_actions)
+        for action in player_actions:
+            moves[action.target_train.id] = self.action_name(action.target_train.id, action.action_type)
+        return tuple(moves)
+
+    def extract_log(self, rounds) -> List[Tuple[Dict[str, Union[str, int, float]], Tuple[str, ...], int]]:
+        """一次遍历整个日志，返回每个回合的 (属性dict, 动作元组, scoreChange)，可直接用于IBL的populate"""
+        return [(self.from_round(r), self.action_tuple(r.player_actions), r.score_change) for r in rounds]
+
+    def extract_rows(self, rounds) -> Tuple[List[tuple], List[Tuple[str, ...]], List[int]]:
+        """一次遍历整个日志，按列返回 (属性值元组列表, 动作元组列表, scoreChange列表)
+
+        属性值元组按names顺序排列，不生成dict，供批量预填充IBL实例（见ibl_memory.bulk_populate）。
+        """
+        rows, actions, outcomes = [], [], []
+        for r in rounds:
+            rows.append(tuple(self.record_values(r.trains, r.stations)))
+            actions.append(self.action_tuple(r.player_actions))
+            outcomes.append(r.score_change)
+        return rows, actions, outcomes
+
+
+ATTRIBUTE_SCHEMA = AttributeSchema()
+
+
+# 解析结果缓存：快照文件名由日志路径、大小、修改时间和格式版本决定，日志变化后自动失效
+CACHE_VERSION = 4
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _snapshot_path(cache_dir: str, file_path: str, variant: str = '') -> str:
+    stat = os.stat(file_path)
+    key = f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{CACHE_VERSION}|{variant}"
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(cache_dir, f"{name}.{digest}.pkl")
+
+
+def _evict_snapshots(cache_dir: str, max_bytes: int) -> None:
+    """缓存目录超过max_bytes时，按最近使用时间从旧到新删除快照"""
+    snapshots = []
+    for path in glob.glob(os.path.join(cache_dir, '*.pkl')):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        snapshots.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in snapshots)
+    for _, size, path in sorted(snapshots):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _diff_entry(old: Any, new: Any, path: tuple, sets: list, deletes: list) -> None:
+    """递归比较两条日志记录，把变化的叶子路径写入sets，把消失的键写入deletes"""
+    if type(old) is dict and type(new) is dict:
+        for key, value in new.items():
+            if key in old:
+                _diff_entry(old[key], value, path + (key,), sets, deletes)
+            else:
+                sets.append((path + (key,), value))
+        deletes.extend(path + (key,) for key in old if key not in new)
+    elif type(old) is list and type(new) is list and len(old) == len(new):
+        for i, (a, b) in enumerate(zip(old, new)):
+            _diff_entry(a, b, path + (i,), sets, deletes)
+    elif type(old) is not type(new) or old != new:
+        sets.append((path, new))
+
+
+def _apply_diff(entry: dict, diff: Tuple[list, list]) -> None:
+    """在entry上原地应用一个差异"""
+    sets, deletes = diff
+    for path in deletes:
+        target = entry
+        for key in path[:-1]:
+            target = target[key]
+        del target[path[-1]]
+    for path, value in sets:
+        target = entry
+        for key in path[:-1]:
+            target = target[key]
+        # 容器值需要复制，保证之后的回放不会改动差异本身
+        target[path[-1]] = copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+
+class DeltaRoundStore:
+    """差异编码的回合存储：每keyframe_interval个回合存一个完整关键帧，其余回合只存与上一回合的差异
+
+    随机访问第i个回合需要从最近的关键帧开始应用最多keyframe_interval-1个差异；
+    顺序回放时每个回合只应用一个差异（关键帧所在回合也保存了差异）。
+    """
+    def __init__(self, keyframe_interval: int = 10):
+        if keyframe_interval < 1:
+            raise ValueError("keyframe_interval必须大于0")
+        self.keyframe_interval = keyframe_interval
+        self.keyframes: List[dict] = []  # 第 k*keyframe_interval 个回合的完整记录
+        self.diffs: List[Optional[Tuple[list, list]]] = []  # 每个回合与上一回合的差异 (sets, deletes)，第0个回合为None
+        self._last: Optional[dict] = None
+
+    @classmethod
+    def from_entries(cls, entries, keyframe_interval: int = 10) -> 'DeltaRoundStore':
+        store = cls(keyframe_interval)
+        for entry in entries:
+            store.append(entry)
+        return store
+
+    def append(self, entry: dict) -> None:
+        """追加一个回合；entry之后不应再被修改（差异中会引用它的子对象）"""
+        if self._last is None:
+            self.diffs.append(None)
+        else:
+            sets, deletes = [], []
+            _diff_entry(self._last, entry, (), sets, deletes)
+            self.diffs.append((sets, deletes))
+        if (len(self.diffs) - 1) % self.keyframe_interval == 0:
+            self.keyframes.append(copy.deepcopy(entry))
+        self._last = entry
+
+    def __len__(self) -> int:
+        return len(self.diffs)
+
+    def entry(self, i: int) -> dict:
+        """还原第i个回合的完整记录（返回独立的副本）"""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        k = i // self.keyframe_interval
+        entry = copy.deepcopy(self.keyframes[k])
+        for diff in self.diffs[k * self.keyframe_interval + 1:i + 1]:
+            _apply_diff(entry, diff)
+        return entry
+
+    def iter_entries(self, start: int = 0) -> Iterator[dict]:
+        """从第start个回合开始顺序回放。为避免复制，每次产出的是同一个被原地更新的dict，需要保留时请自行复制"""
+        if start >= len(self):
+            return
+        entry = self.entry(start)
+        yield entry
+        for diff in self.diffs[start + 1:]:
+            _apply_diff(entry, diff)
+            yield entry
+
+    def __getstate__(self) -> dict:
+        # 不保存上一回合的引用，读回时由关键帧和差异还原
+        return {'keyframe_interval': self.keyframe_interval, 'keyframes': self.keyframes, 'diffs': self.diffs}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['keyframe_interval'])
+        self.keyframes, self.diffs = state['keyframes'], state['diffs']
+        if self.diffs:
+            self._last = self.entry(len(self) - 1)
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str) -> 'DeltaRoundStore':
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+class DeltaRounds:
+    """以DeltaRoundStore为后端、可像列表一样访问的GameRound序列（按需解析）"""
+    def __init__(self, store: DeltaRoundStore, analyzer: 'MetroLogAnalyzer'):
+        self.store = store
+        self.analyzer = analyzer
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.analyzer._parse_single_round(self.store.entry(i))
+
+    def __iter__(self) -> Iterator[GameRound]:
+        for entry in self.store.iter_entries():
+            # iter_entries原地更新同一个dict，回合需立即解析完整
+            yield self.analyzer._parse_single_round(entry).materialize()
+
+
+class LogIndex:
+    """加载时一次扫描建立的二级索引，查询只需查表，返回回合下标（rounds中的位置，即row）
+
+    - round_rows: 回合号 → row
+    - action_rows: 操作类型 → 出现该操作的row（有序数组）
+    - action_postings: 操作类型 → {(列车id, 位置类型, 是否换乘站): row有序数组}，按列车/位置筛选时只合并对应的几个数组
+    - flood_crossings / flood_runs: 车站id → 洪水升至警戒线（flood_warning_threshold）以上的row / 处于警戒线以上的区间 [start, end)
+    - flooded_rows: 任意车站处于警戒线以上的row
+    - status_transitions: 列车id → (row, 原状态, 新状态) 列表
+    - status_runs: (状态, 位置类型) → (列车id, start, end) 区间列表，位置类型为 'station' 或 'track'
+    """
+    def __init__(self, rounds, flood_warning_threshold: float):
+        self.flood_warning_threshold = flood_warning_threshold
+        self.round_rows: Dict[int, int] = {}
+        self.action_postings: Dict[str, Dict[Tuple[int, str, bool], np.ndarray]] = {}
+        self.flood_crossings: Dict[int, List[int]] = {}
+        self.flood_runs: Dict[int, List[Tuple[int, int]]] = {}
+        self.status_transitions: Dict[int, List[Tuple[int, str, str]]] = {}
+        self.status_runs: Dict[Tuple[str, str], List[Tuple[int, int, int]]] = {}
+        self.transfer_stations: set = set()
+
+        postings: Dict[str, Dict[Tuple[int, str, int], List[int]]] = {}  # 操作类型 → (列车id, 位置类型, 位置id) → row列表
+        flooded_rows = []
+        flood_start: Dict[int, int] = {}  # 当前处于警戒线以上的车站 → 起始row
+        train_state: Dict[int, Tuple[Tuple[str, str], int]] = {}  # 列车id → ((状态, 位置类型), 起始row)
+        row = -1
+        for row, game_round in enumerate(rounds):
+            self.round_rows.setdefault(game_round.round_num, row)
+            for action in game_round.player_actions:
+                location = action.target_location
+                postings.setdefault(action.action_type, {}).setdefault(
+                    (action.target_train.id, location.type, location.id), []).append(row)
+
+            any_flooded = False
+            for station in game_round.stations:
+                if station.is_transfer:
+                    self.transfer_stations.add(station.id)
+                if station.current_flood_level >= flood_warning_threshold:
+                    any_flooded = True
+                    if station.id not in flood_start:
+                        flood_start[station.id] = row
+                        self.flood_crossings.setdefault(station.id, []).append(row)
+                elif station.id in flood_start:
+                    self.flood_runs.setdefault(station.id, []).append((flood_start.pop(station.id), row))
+            if any_flooded:
+                flooded_rows.append(row)
+
+            for train in game_round.trains:
+                key = (train.status, 'track' if train.station_id is None else 'station')
+                previous = train_state.get(train.id)
+                if previous is None:
+                    train_state[train.id] = (key, row)
+                elif previous[0] != key:
+                    if previous[0][0] != train.status:
+                        self.status_transitions.setdefault(train.id, []).append((row, previous[0][0], train.status))
+                    self.status_runs.setdefault(previous[0], []).append((train.id, previous[1], row))
+                    train_state[train.id] = (key, row)
+
+        # 收尾：仍未结束的区间截止到最后一个回合之后
+        end = row + 1
+        for station_id, start in flood_start.items():
+            self.flood_runs.setdefault(station_id, []).append((start, end))
+        for train_id, (key, start) in train_state.items():
+            self.status_runs.setdefault(key, []).append((train_id, start, end))
+        for runs in self.status_runs.values():
+            runs.sort(key=lambda run: run[1])
+        self.num_rows = end
+        self.flooded_rows = np.array(flooded_rows, dtype=np.int64)
+        # 换乘站要扫描完才能确定，最后再按 (列车id, 位置类型, 是否换乘站) 合并
+        for action_type, by_location in postings.items():
+            merged: Dict[Tuple[int, str, bool], List[int]] = {}
+            for (train_id, loc_type, loc_id), rows in by_location.items():
+                transfer = loc_type == 'station' and loc_id in self.transfer_stations
+                merged.setdefault((train_id, loc_type, transfer), []).extend(rows)
+            self.action_postings[action_type] = {
+                key: np.unique(np.array(rows, dtype=np.int64)) for key, rows in merged.items()
+            }
+        self.action_rows = {
+            action_type: np.unique(np.concatenate(list(by_key.values())))
+            for action_type, by_key in self.action_postings.items()
+        }
+
+    def row(self, round_num: int) -> Optional[int]:
+        """回合号对应的row，不存在时返回None"""
+        return self.round_rows.get(round_num)
+
+    def rows_with_action(self, action_type: str, train_id: Optional[int] = None, location_type: Optional[str] = None,
+                         transfer: Optional[bool] = None) -> np.ndarray:
+        """出现指定操作的row；可按列车、位置类型（'station'/'track'）和是否换乘站进一步筛选
+
+        筛选只查看该操作下 (列车id, 位置类型, 是否换乘站) 的几个posting，不扫描全部记录。
+        """
+        if train_id is None and location_type is None and transfer is None:
+            return self.action_rows.get(action_type, np.empty(0, dtype=np.int64))
+        arrays = [
+            rows for (train, loc_type, is_transfer), rows in self.action_postings.get(action_type, {}).items()
+            if (train_id is None or train == train_id)
+            and (location_type is None or loc_type == location_type)
+            and (transfer is None or is_transfer == transfer)
+        ]
+        if not arrays:
+            return np.empty(0, dtype=np.int64)
+        return arrays[0] if len(arrays) == 1 else np.unique(np.concatenate(arrays))
+
+    def flooded(self, station_id: Optional[int] = None) -> np.ndarray:
+        """洪水处于警戒线以上的row；不指定车站时为任意车站"""
+        if station_id is None:
+            return self.flooded_rows
+        runs = self.flood_runs.get(station_id, [])
+        if not runs:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, end) for start, end in runs])
+
+    def transitions(self, train_id: Optional[int] = None, to_status: Optional[str] = None) -> List[Tuple[int, int, str, str]]:
+        """列车状态变化 (row, 列车id, 原状态, 新状态)，按row排序"""
+        train_ids = self.status_transitions if train_id is None else [train_id]
+        result = [
+            (row, t, old, new) for t in train_ids for row, old, new in self.status_transitions.get(t, [])
+            if to_status is None or new == to_status
+        ]
+        return sorted(result)
+
+    def trains_in_status(self, status: str, location_type: Optional[str] = None) -> List[Tuple[int, int]]:
+        """处于指定状态的 (row, 列车id)，如 trains_in_status('trapped', 'track') 为困在轨道节点上的列车"""
+        location_types = ['station', 'track'] if location_type is None else [location_type]
+        return sorted(
+            (row, train_id)
+            for loc in location_types for train_id, start, end in self.status_runs.get((status, loc), [])
+            for row in range(start, end)
+        )
+
 
 class MetroLogAnalyzer:
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, stream: bool = False, cache_dir: Optional[str] = None,
+                 cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES, delta_interval: Optional[int] = None,
+                 build_index: bool = False):
+        """stream=True时不一次性加载整个文件，只读取第一个元素中的设置，回合通过iter_rounds()逐个解析
+
+        给出cache_dir时优先从该目录读取解析结果快照（跳过JSON解码和对象构建），
+        快照不存在或日志已变化时重新解析并写入快照；目录总大小超过cache_max_bytes时淘汰最久未用的快照。
+
+        给出delta_interval时逐回合读取文件并存入DeltaRoundStore（每delta_interval回合一个关键帧），
+        rounds为按需解析的DeltaRounds，适合很长的日志。
+
+        build_index=True时加载后建立LogIndex（self.log_index），也可之后调用build_index()。
+        """
+        self.file_path = file_path
+        self.delta_store: Optional[DeltaRoundStore] = None
+        self.log_index: Optional[LogIndex] = None
+        self._load(stream, cache_dir, cache_max_bytes, delta_interval)
+        if build_index:
+            self.build_index()
+
+    def _load(self, stream: bool, cache_dir: Optional[str], cache_max_bytes: int, delta_interval: Optional[int]) -> None:
+        file_path = self.file_path
+        if delta_interval is not None:
+            self.raw_logs = None
+            if cache_dir is None or not self._load_snapshot(cache_dir, variant='delta'):
+                self.delta_store = DeltaRoundStore.from_entries(iter_log_entries(file_path), delta_interval)
+                if len(self.delta_store) == 0:
+                    raise ValueError(f"{file_path} 中没有回合记录")
+                self.settings = self._parse_global_settings(self.delta_store.keyframes[0]['setting'])
+                if cache_dir is not None:
+                    self._save_snapshot(cache_dir, cache_max_bytes, variant='delta')
+            self.rounds = DeltaRounds(self.delta_store, self)
+            return
+
+        if stream:
+            self.raw_logs = None
+            self.rounds = None
+            first_entry = next(iter_log_entries(file_path), None)
+            if first_entry is None:
+                raise ValueError(f"{file_path} 中没有回合记录")
+            self.settings = self._parse_global_settings(first_entry['setting'])
+            return
+
+        if cache_dir is not None and self._load_snapshot(cache_dir):
+            return
+
         with open(file_path, 'r') as f:
             self.raw_logs = json.load(f)
         
         self.settings = self._parse_global_settings()
         self.rounds = self._parse_all_rounds()
 
-    def _parse_global_settings(self) -> GameSettings:
+        if cache_dir is not None:
+            self._save_snapshot(cache_dir, cache_max_bytes)
+
+    def build_index(self) -> LogIndex:
+        """扫描一遍所有回合建立二级索引；流式模式下逐回合读取文件"""
+        self.log_index = LogIndex(self.iter_rounds(), self.settings.flood_warning_threshold)
+        return self.log_index
+
+    def select(self, rows) -> List[GameRound]:
+        """按查询返回的row取出回合；流式模式下重新逐回合读取文件，读到所需的最大row为止"""
+        rows = [int(row) for row in rows]
+        if self.rounds is not None:
+            return [self.rounds[row] for row in rows]
+        wanted = set(rows)
+        if not wanted:
+            return []
+        last = max(wanted)
+        found: Dict[int, GameRound] = {}
+        num_rows = 0
+        for num_rows, game_round in enumerate(self.iter_rounds(), 1):
+            if num_rows - 1 in wanted:
+                found[num_rows - 1] = game_round
+            if num_rows > last:
+                break
+        missing = wanted - found.keys()
+        if missing:
+            raise IndexError(f"row {min(missing)} 超出范围，日志共 {num_rows} 个回合")
+        return [found[row] for row in rows]
+
+    def _load_snapshot(self, cache_dir: str, variant: str = '') -> bool:
+        """读取有效的快照，成功时返回True；快照中不含原始日志，raw_logs为None"""
+        path = _snapshot_path(cache_dir, self.file_path, variant)
+        try:
+            with open(path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except (pickle.UnpicklingError, EOFError, AttributeError, TypeError) as e:
+            print(f"日志缓存快照损坏，重新解析: {path} ({e})")
+            return False
+        os.utime(path)  # 记录最近使用时间，供淘汰时参考
+        self.raw_logs = None
+        self.settings = snapshot['settings']
+        if variant == 'delta':
+            self.delta_store = snapshot['delta_store']
+        else:
+            self.rounds = snapshot['rounds']
+        return True
+
+    def _save_snapshot(self, cache_dir: str, max_bytes: int, variant: str = '') -> None:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _snapshot_path(cache_dir, self.file_path, variant)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        if variant == 'delta':
+            snapshot = {'settings': self.settings, 'delta_store': self.delta_store}
+        else:
+            # 快照只保存解析后的对象，读取时不需要JSON解码或构建dataclass
+            snapshot = {'settings': self.settings, 'rounds': [r.materialize() for r in self.rounds]}
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)  # 原子替换，并发启动的进程不会读到写了一半的快照
+        _evict_snapshots(cache_dir, max_bytes)
+
+    def iter_rounds(self, follow: bool = False, poll_interval: float = 0.5,
+                    idle_timeout: Optional[float] = None) -> Iterator[GameRound]:
+        """逐个产出GameRound；follow=True时持续等待仍在写入的日志中新追加的回合"""
+        if self.rounds is not None and not follow:
+            yield from self.rounds
+            return
+        for data in iter_log_entries(self.file_path, follow=follow, poll_interval=poll_interval,
+                                     idle_timeout=idle_timeout):
+            yield self._parse_single_round(data)
+
+    def to_columns(self) -> Dict[str, np.ndarray]:
+        """列式数组表示，见log_entries_to_columns；流式模式下逐回合读取文件，差异编码模式下顺序回放"""
+        if self.raw_logs is not None:
+            entries = self.raw_logs
+        elif self.delta_store is not None:
+            entries = self.delta_store.iter_entries()
+        else:
+            entries = iter_log_entries(self.file_path)
+        return log_entries_to_columns(entries)
+
+    def save_columns(self, path: str) -> None:
+        """将列式数组和设置写入未压缩的npz文件，可用load_columns快速读回"""
+        np.savez(path, settings=json.dumps(asdict(self.settings)), **self.to_columns())
+
+    def _parse_global_settings(self, setting_data: Optional[dict] = None) -> GameSettings:
         """解析全局游戏设置（仅在第一回合出现）"""
-        setting_data = self.raw_logs[0]['setting']
+        if setting_data is None:
+            setting_data = self.raw_logs[0]['setting']
         return GameSettings(
             failure_points_count=setting_data['failurePointCount'],
             failure_points_flood_increase_base_mu=setting_data['failurePointFloodIncreaseBaseMu'],
@@ -125,7 +964,7 @@ class MetroLogAnalyzer:
         return [self._parse_single_round(round_data) for round_data in self.raw_logs]
 
     def _parse_single_round(self, data: dict) -> GameRound:
-        """解析单个回合数据"""
+        """解析单个回合数据（子对象按需解析，见GameRound）"""
         return GameRound(
             round_id=data['id'],
             round_num=data['round'],
@@ -133,132 +972,18 @@ class MetroLogAnalyzer:
             total_score=data['totalScore'],
             score_change=data['scoreChange'],
             decision_time_used=data['decisionTimeUsed'],
-            trains=self._parse_trains(data['trains']),
-            stations=self._parse_stations(data['stations']),
-            track_nodes=self._parse_track_nodes(data['tracks']),
-            player_actions=self._parse_player_actions(data['playerActions'])
+            raw=data
         )
 
-    def _parse_trains(self, trains: List[dict]) -> List[Train]:
-        """解析列车状态数据"""
-        return [Train(
-            id=t['id'],
-            station_id=t['stationId'],
-            track_id=t['trackId'],
-            node_position=t['nodePosition'],
-            capacity=t['capacity'],
-            passengers_change=t.get('passengersChange', None),
-            passengers=t['currentPassengers'],
-            position_change=t.get('positionChange', None),
-            status_change=t.get('statusChange', None),
-            status=t['currentStatus'],
-            direction_change=t.get('directionChange', None),
-            direction=t['currentDirection'],
-            line_id=t['lineId'],
-            delayed_rounds=t.get('delayedRounds', 0),
-            last_move_round=t.get('lastMoveRound', 0)
-        ) for t in trains]
-    
-    def _get_train_attributes(self, train: Train) -> Dict[str, Union[str, int, float]]:
-        return {
-            "train_in_stationId_" + str(train.id): str(train.station_id),
-            "trackId_" + str(train.id): str(train.track_id),
-            "nodePosition_" + str(train.id): train.node_position,
-            "passengers_in_train_" + str(train.id): train.passengers,
-            "delayedRounds_" + str(train.id): train.delayed_rounds,
-            "direction_" + str(train.id): train.direction,
-            "status_" + str(train.id): train.status
-        }
-
-    def _parse_stations(self, stations: List[dict]) -> List[Station]:
-        """解析车站状态数据"""
-        return [Station(
-            id=s['id'],
-            current_flood_level=s['currentFloodLevel'],
-            passengers_change=s.get('passengersChange', None),
-            passengers=s['currentPassengers'],
-            pump_used=s['pumpUsed'],
-            pump_threshold=s['pumpThreshold'],
-            pump_rate=s['pumpRate'],
-            is_failure_point=s['isFailurePoint'],
-            elevation=s['elevation'],
-            is_transfer=s['isTransfer']
-        ) for s in stations]
-    
-    def _get_station_attributes(self, station: Station) -> Dict[str, Union[str, int, float]]:
-        return {
-            "isTransfer_" + str(station.id): station.is_transfer,
-            "floodLevel_" + str(station.id): station.current_flood_level,
-            "isFailurePoint_" + str(station.id): station.is_failure_point,
-            "elevation_" + str(station.id): station.elevation,
-            "pumpUsed_" + str(station.id): station.pump_used,
-        }
-
-    def _parse_track_nodes(self, tracks: List[dict]) -> List[TrackNode]:
-        """解析轨道节点数据"""
-        return [(TrackNode(
-            track_id=t['id'],
-            station_a=t['stationA'],
-            station_b=t['stationB'],
-            line_id=t['lineId'],
-            node_id=n['id'],
-            node_current_flood_level=n['currentFloodLevel'],
-            node_is_failure_point=n['isFailurePoint']
-            ) for n in t['nodes']
-        ) for t in tracks]
-    
-    def _parse_train_location(self, location: dict) -> TrainLocation:
-        """解析列车位置数据"""
-        return TrainLocation(
-            type=location['type'],
-            id=location['id'],
-            name=location['name'],
-            index_in_line=location['indexInLine']
-        )
-    
-    def _parse_train(self, train: dict) -> Train:
-        """解析列车数据"""
-        return Train(
-            id=train['id'],
-            station_id=train['stationId'],
-            track_id=train['trackId'],
-            node_position=train['nodePosition'],
-            capacity=train['capacity'],
-            passengers=train['passengers'],
-            status=train['status'],
-            direction=train['direction'],
-            line_id=train['lineId'],
-            delayed_rounds=train.get('delayedRounds', 0),
-            last_move_round=train.get('lastMoveRound', 0),
-            passengers_change=train.get('passengersChange', None),
-            status_change=train.get('statusChange', None),
-            direction_change=train.get('directionChange', None),
-            position_change=train.get('positionChange', None)
-        )
-    
-    def _parse_player_actions(self, player_actions: List[dict]) -> List[PlayerAction]:
-        """解析玩家操作数据"""
-        return [PlayerAction(
-            action_type=a['type'],
-            target_train=self._parse_train(a['targetTrain']),
-            target_location=self._parse_train_location(a['targetLocation']),
-            timestamp=a['timestamp'],
-            round=a['round'],
-            select_time_used=a['selectTimeUsed']
-        ) for a in player_actions]
-    
     def _get_attributes(self, trains: List[Train], stations: List[Station]) -> Dict[str, Union[str, int, float]]:
-        train_attributes = dict(item for train in trains for item in self._get_train_attributes(train).items())
-        station_attributes = dict(item for station in stations for item in self._get_station_attributes(station).items())
-        return {**train_attributes, **station_attributes}
-    
+        return ATTRIBUTE_SCHEMA.payload(ATTRIBUTE_SCHEMA.record_values(trains, stations))
+
     def _get_action_attributes(self, player_actions: List[PlayerAction]) -> tuple[str, str, str, str, str, str, str, str]:
-        move_list = ["0monitor", "1monitor", "2monitor", "3monitor", "4monitor", "5monitor", "6monitor", "7monitor"]
-        for action in player_actions:
-            train_id = action.target_train.id
-            action_type = action.action_type
-            move_list[train_id] = str(train_id) + action_type
-        return tuple(move_list)
+        return ATTRIBUTE_SCHEMA.action_tuple(player_actions)
+
+    def ibl_instances(self) -> List[Tuple[Dict[str, Union[str, int, float]], Tuple[str, ...], int]]:
+        """所有回合的IBL实例 (属性dict, 动作元组, scoreChange)，见AttributeSchema.extract_log"""
+        return ATTRIBUTE_SCHEMA.extract_log(self.iter_rounds())
     
     # @staticmethod
     # def _extract_position_id(position_str: str, target_type: str) -> Optional[int]:
@@ -270,9 +995,114 @@ class MetroLogAnalyzer:
     #             return int(part.split('_')[-1])
     #     return None
 
+def _load_session(file_path: str, cache_dir: Optional[str]) -> Tuple[str, MetroLogAnalyzer, float]:
+    """进程池中解析单个日志文件，返回 (路径, 解析结果, 耗时秒数)"""
+    start = time.perf_counter()
+    analyzer = MetroLogAnalyzer(file_path, cache_dir=cache_dir)
+    analyzer.raw_logs = None  # 原始日志不传回主进程，需要时按文件重新读取
+    for game_round in analyzer.rounds:
+        game_round.materialize()  # 回合中的原始记录同样不传回
+    return file_path, analyzer, time.perf_counter() - start
+
+
+class MetroLogCorpus:
+    """多个日志文件（多局游戏）的集合，用进程池并行解析
+
+    source可以是目录（读取其中的metro_logs_*.json）、glob模式或文件路径列表。
+    每个文件为一个session，session_id为文件名（不含扩展名）。workers默认为CPU核数，为1时在当前进程中解析。
+    """
+    def __init__(self, source: Union[str, List[str]], workers: Optional[int] = None, cache_dir: Optional[str] = None):
+        self.paths = self._resolve_paths(source)
+        if not self.paths:
+            raise ValueError(f"没有找到日志文件: {source}")
+
+        workers = min(workers or os.cpu_count() or 1, len(self.paths))
+        start = time.perf_counter()
+        if workers == 1:
+            results = [_load_session(path, cache_dir) for path in self.paths]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunksize = max(1, len(self.paths) // (workers * 4))
+                results = list(pool.map(_load_session, self.paths, [cache_dir] * len(self.paths), chunksize=chunksize))
+        self.load_time = time.perf_counter() - start
+
+        self.session_ids = self._make_session_ids(self.paths)
+        self.sessions: Dict[str, MetroLogAnalyzer] = {}
+        self.timings: Dict[str, float] = {}  # 每个文件的解析耗时（秒）
+        for session_id, (_, analyzer, elapsed) in zip(self.session_ids, results):
+            self.sessions[session_id] = analyzer
+            self.timings[session_id] = elapsed
+
+        # 按设置分组；所有session设置相同时settings为该设置，否则为None
+        self.settings_groups: Dict[Tuple, List[str]] = {}
+        for session_id, analyzer in self.sessions.items():
+            key = tuple(asdict(analyzer.settings).items())
+            self.settings_groups.setdefault(key, []).append(session_id)
+        self.settings = self.sessions[self.session_ids[0]].settings if len(self.settings_groups) == 1 else None
+
+        # 全局索引：第i个回合对应 (session_id, 该session中的回合下标)
+        self.index: List[Tuple[str, int]] = [
+            (session_id, i) for session_id in self.session_ids for i in range(len(self.sessions[session_id].rounds))
+        ]
+
+    @staticmethod
+    def _resolve_paths(source: Union[str, List[str]]) -> List[str]:
+        if isinstance(source, (list, tuple)):
+            return list(source)
+        if os.path.isdir(source):
+            return sorted(glob.glob(os.path.join(source, 'metro_logs_*.json')))
+        return sorted(glob.glob(source))
+
+    @staticmethod
+    def _make_session_ids(paths: List[str]) -> List[str]:
+        """以文件名作为session_id，不同目录下同名时改用完整路径"""
+        stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+        return [stem if stems.count(stem) == 1 else path for stem, path in zip(stems, paths)]
+
+    @property
+    def consistent(self) -> bool:
+        """所有session的GameSettings是否一致"""
+        return len(self.settings_groups) == 1
+
+    def groups(self) -> List[Tuple[GameSettings, List[str]]]:
+        """按设置分组的 (GameSettings, [session_id])"""
+        return [(GameSettings(**dict(key)), session_ids) for key, session_ids in self.settings_groups.items()]
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, i: int) -> Tuple[str, GameRound]:
+        session_id, round_index = self.index[i]
+        return session_id, self.sessions[session_id].rounds[round_index]
+
+    def iter_rounds(self) -> Iterator[Tuple[str, GameRound]]:
+        for session_id in self.session_ids:
+            for game_round in self.sessions[session_id].rounds:
+                yield session_id, game_round
+
+    def to_columns(self) -> Dict[str, np.ndarray]:
+        """所有session的列式数组按回合拼接，'session' 列为每个回合所属session在session_ids中的下标"""
+        per_session = [self.sessions[session_id].to_columns() for session_id in self.session_ids]
+        columns = {name: np.concatenate([c[name] for c in per_session]) for name in per_session[0]}
+        columns['session'] = np.concatenate([
+            np.full(len(c['round_num']), i, dtype=np.int32) for i, c in enumerate(per_session)
+        ])
+        return columns
+
+    def report(self) -> None:
+        """打印每个文件的解析耗时和设置分组情况"""
+        for session_id in self.session_ids:
+            print(f"{session_id}: {len(self.sessions[session_id].rounds)} 回合, {self.timings[session_id] * 1000:.1f}ms")
+        print(f"共 {len(self.sessions)} 个文件、{len(self)} 个回合，总耗时 {self.load_time:.2f}s")
+        if not self.consistent:
+            print(f"⚠️ 设置不一致，共 {len(self.settings_groups)} 组：")
+            for settings, session_ids in self.groups():
+                print(f"  {len(session_ids)} 个文件: {settings}")
+
+
 # 使用示例
 if __name__ == "__main__":
-    analyzer = MetroLogAnalyzer("metro_logs_2025-02-25T01_40_19.393Z.json")
+    analyzer = MetroLogAnalyzer("metro_logs_2025-02-25T01_40_19.393Z.json", cache_dir=".metro_log_cache")
     
     print(f"游戏设置：故障点数量={analyzer.settings.failure_points_count}")
     print(f"总回合数：{len(analyzer.rounds)}")
@@ -282,6 +1112,10 @@ if __name__ == "__main__":
     print(f"时间：{first_round.timestamp}")
     print(f"初始得分：{first_round.total_score}")
     print(f"洪水最严重的车站：{max(first_round.stations, key=lambda s: s.current_flood_level).id}号站")
+
+    index = analyzer.build_index()
+    print(f"\n有停车操作的回合：{[r.round_num for r in analyzer.select(index.rows_with_action('stop'))]}")
+    print(f"洪水超过警戒线的回合：{[r.round_num for r in analyzer.select(index.flooded())]}")
     
     last_round = analyzer.rounds[-1]
     print(f"\n最终回合统计：")
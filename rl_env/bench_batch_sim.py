@@ -0,0 +1,48 @@
+import argparse
+import time
+import numpy as np
+from metro_sim import MetroSim, BatchMetroSim
+
+# 基准测试：BatchMetroSim在不同并行局数K下的吞吐（env-steps/s），并与逐局推进的MetroSim对比
+
+
+def bench_single(steps, seed):
+    """MetroSim逐局推进，作为基线"""
+    sim = MetroSim(seed=seed)
+    rng = np.random.default_rng(seed)
+    actions = rng.integers(0, 5, size=(steps, 8))
+    start = time.perf_counter()
+    for r in range(steps):
+        if sim.round >= 30:
+            sim.reset()
+        sim.step([{'trainId': i, 'actionType': int(a)} for i, a in enumerate(actions[r])])
+    return steps / (time.perf_counter() - start)
+
+
+def bench_batch(num_games, steps, seed):
+    """BatchMetroSim一次推进K局，吞吐按 K × 回合数 计"""
+    sim = BatchMetroSim(num_games, seed=seed)
+    rng = np.random.default_rng(seed)
+    actions = rng.integers(0, 5, size=(steps, num_games, 8))
+    start = time.perf_counter()
+    for r in range(steps):
+        sim.step(actions[r])
+    return num_games * steps / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BatchMetroSim吞吐基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 4, 16, 64, 256, 1024, 4096])
+    parser.add_argument("--steps", type=int, default=300, help="每个K推进的回合数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    baseline = bench_single(args.steps, args.seed)
+    print(f"{'MetroSim':>10}: {baseline:10.0f} env-steps/s")
+    for k in args.sizes:
+        throughput = bench_batch(k, args.steps, args.seed)
+        print(f"{'K=' + str(k):>10}: {throughput:10.0f} env-steps/s  ({throughput / baseline:6.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
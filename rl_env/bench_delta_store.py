@@ -0,0 +1,71 @@
+import argparse
+import copy
+import gc
+import pickle
+import random
+import time
+import tracemalloc
+from metro_log_parser import DeltaRoundStore, iter_log_entries
+
+# 基准测试：差分存储（关键帧+逐回合差异）与完整快照的内存/磁盘占用及访问耗时对比
+
+
+def synthesize(entries, num_rounds, seed):
+    """在日志末尾按小幅随机变化续写到num_rounds回合，模拟长会话"""
+    rng = random.Random(seed)
+    entries = list(entries)
+    while len(entries) < num_rounds:
+        entry = copy.deepcopy(entries[-1])
+        entry.pop('setting', None)
+        entry['round'] = len(entries)
+        entry['scoreChange'] = rng.randint(-500, 1500)
+        entry['totalScore'] += entry['scoreChange']
+        for station in rng.sample(entry['stations'], 3):
+            station['currentFloodLevel'] = round(rng.random() * 60, 1)
+        train = rng.choice(entry['trains'])
+        train['nodePosition'] = rng.randint(0, 1)
+        train['currentPassengers'] = rng.randint(0, 100)
+        entries.append(entry)
+    return entries
+
+
+def traced_bytes(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="差分回合存储基准测试")
+    parser.add_argument("--file", default="metro_logs_2025-02-25T01_40_19.393Z.json")
+    parser.add_argument("--rounds", type=int, default=2000, help="续写到的回合数（0表示只用原日志）")
+    parser.add_argument("--interval", type=int, default=10, help="关键帧间隔")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    entries = synthesize(list(iter_log_entries(args.file)), args.rounds, args.seed)
+    full, full_mem = traced_bytes(lambda: copy.deepcopy(entries))
+    store, delta_mem = traced_bytes(lambda: DeltaRoundStore.from_entries(entries, args.interval))
+    full_disk = len(pickle.dumps(full, protocol=pickle.HIGHEST_PROTOCOL))
+    delta_disk = len(pickle.dumps(store, protocol=pickle.HIGHEST_PROTOCOL))
+
+    start = time.perf_counter()
+    for i in range(len(store)):
+        store.entry(i)
+    random_us = (time.perf_counter() - start) / len(store) * 1e6
+    start = time.perf_counter()
+    for _ in store.iter_entries():
+        pass
+    sequential_us = (time.perf_counter() - start) / len(store) * 1e6
+
+    print(f"{len(entries)} 回合，关键帧间隔 {args.interval}")
+    print(f"内存: 完整 {full_mem / 1e6:8.2f} MB  差分 {delta_mem / 1e6:8.2f} MB  ({full_mem / delta_mem:.1f}x)")
+    print(f"磁盘: 完整 {full_disk / 1e6:8.2f} MB  差分 {delta_disk / 1e6:8.2f} MB  ({full_disk / delta_disk:.1f}x)")
+    print(f"随机访问 {random_us:8.1f} us/回合，顺序回放 {sequential_us:8.1f} us/回合")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import time
+from bench_obs_encoder import collect_observations, timed
+from metro_log_parser import MetroLogAnalyzer, ATTRIBUTE_SCHEMA
+
+# 基准测试：AttributeSchema与原来逐个拼接属性名、合并dict的IBL属性提取耗时对比，并检查两者输出一致
+
+
+def legacy_round_attributes(game_round):
+    """原MetroLogAnalyzer._get_attributes / _get_train_attributes / _get_station_attributes（保留作对照）"""
+    def train_attributes(train):
+        return {
+            "train_in_stationId_" + str(train.id): str(train.station_id),
+            "trackId_" + str(train.id): str(train.track_id),
+            "nodePosition_" + str(train.id): train.node_position,
+            "passengers_in_train_" + str(train.id): train.passengers,
+            "delayedRounds_" + str(train.id): train.delayed_rounds,
+            "direction_" + str(train.id): train.direction,
+            "status_" + str(train.id): train.status
+        }
+
+    def station_attributes(station):
+        return {
+            "isTransfer_" + str(station.id): station.is_transfer,
+            "floodLevel_" + str(station.id): station.current_flood_level,
+            "isFailurePoint_" + str(station.id): station.is_failure_point,
+            "elevation_" + str(station.id): station.elevation,
+            "pumpUsed_" + str(station.id): station.pump_used,
+        }
+
+    trains = dict(item for train in game_round.trains for item in train_attributes(train).items())
+    stations = dict(item for station in game_round.stations for item in station_attributes(station).items())
+    return {**trains, **stations}
+
+
+def legacy_observation_attributes(response):
+    """原ibl_model.env()中由在线观察构建属性的代码（保留作对照）"""
+    train_attributes = {}
+    for train_id in range(8):
+        train = response['trains'][train_id]
+        train_attributes["train_in_stationId_" + str(train_id)] = str(train['stationId'])
+        train_attributes["trackId_" + str(train_id)] = str(train['trackId'])
+        train_attributes["nodePosition_" + str(train_id)] = train['nodePosition']
+        train_attributes["passengers_in_train_" + str(train_id)] = train['passengers']
+        train_attributes["delayedRounds_" + str(train_id)] = train['delayedRounds']
+        train_attributes["direction_" + str(train_id)] = train['direction']
+        train_attributes["status_" + str(train_id)] = train['status']
+    station_attributes = {}
+    for station_id in range(16):
+        station = response['stations'][station_id]
+        station_attributes["isTransfer_" + str(station_id)] = station['isTransfer']
+        station_attributes["floodLevel_" + str(station_id)] = station['floodLevel']
+        station_attributes["isFailurePoint_" + str(station_id)] = station['isFailurePoint']
+        station_attributes["elevation_" + str(station_id)] = station['elevation']
+        station_attributes["pumpUsed_" + str(station_id)] = station['pumpUsed']
+    return {**train_attributes, **station_attributes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IBL属性提取基准测试")
+    parser.add_argument("--file", default="metro_logs_2025-02-25T01_40_19.393Z.json")
+    parser.add_argument("--count", type=int, default=1000, help="在线观察数量")
+    parser.add_argument("--repeat", type=int, default=200, help="日志回合重复次数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rounds = MetroLogAnalyzer(args.file).rounds * args.repeat
+    observations = collect_observations(args.count, args.seed)
+    for game_round in rounds[:len(rounds) // args.repeat]:
+        expected = legacy_round_attributes(game_round)
+        actual = ATTRIBUTE_SCHEMA.from_round(game_round)
+        assert expected == actual and list(expected) == list(actual), "日志回合的属性与原实现不一致"
+    for obs in observations:
+        expected = legacy_observation_attributes(obs)
+        actual = ATTRIBUTE_SCHEMA.from_observation(obs)
+        assert expected == actual and list(expected) == list(actual), "在线观察的属性与原实现不一致"
+    print(f"✅ 属性一致，共 {len(ATTRIBUTE_SCHEMA.names)} 个属性")
+
+    legacy = timed(lambda: [legacy_round_attributes(r) for r in rounds], 3) / len(rounds)
+    schema = timed(lambda: ATTRIBUTE_SCHEMA.extract_log(rounds), 3) / len(rounds)
+    print(f"日志回合: 原实现 {legacy * 1e6:7.1f} us/回合, AttributeSchema {schema * 1e6:7.1f} us/回合"
+          f" ({legacy / schema:4.1f}x，后者还包括动作元组)")
+    legacy = timed(lambda: [legacy_observation_attributes(obs) for obs in observations], 3) / len(observations)
+    schema = timed(lambda: [ATTRIBUTE_SCHEMA.from_observation(obs) for obs in observations], 3) / len(observations)
+    print(f"在线观察: 原实现 {legacy * 1e6:7.1f} us/obs,  AttributeSchema {schema * 1e6:7.1f} us/obs  ({legacy / schema:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import dataclasses
+import gc
+import time
+import tracemalloc
+import metro_log_parser
+from metro_log_parser import MetroLogAnalyzer
+
+# 基准测试：解析后每个回合占用的内存（tracemalloc统计），对比slots记录类型与普通dataclass；
+# 以及只扫描得分时按需解析（GameRound默认）与解析全部子对象的耗时对比
+
+
+RECORD_TYPES = ['Train', 'Station', 'TrackNode', 'TrainLocation', 'PlayerAction']
+
+
+def _legacy_records():
+    """按当前字段生成不带slots的普通dataclass（即改动前的记录类型）"""
+    return {
+        name: dataclasses.make_dataclass(name, [(f.name, f.type) for f in dataclasses.fields(getattr(metro_log_parser, name))])
+        for name in RECORD_TYPES
+    }
+
+
+def measure(file_path, repeat):
+    """解析repeat次（保留所有结果，子对象全部解析），返回每个回合的平均字节数"""
+    analyzer = MetroLogAnalyzer(file_path)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [[r.materialize() for r in analyzer._parse_all_rounds()] for _ in range(repeat)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / sum(len(rounds) for rounds in kept)
+
+
+def scan_scores(file_path, repeat, materialize):
+    """解析并累加所有回合的score_change，返回每个回合的平均耗时（秒）"""
+    analyzer = MetroLogAnalyzer(file_path)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        rounds = analyzer._parse_all_rounds()
+        if materialize:
+            rounds = [r.materialize() for r in rounds]
+        sum(r.score_change for r in rounds)
+    return (time.perf_counter() - start) / (repeat * len(analyzer.rounds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="解析结果内存基准测试")
+    parser.add_argument("--file", default="metro_logs_2025-02-25T01_40_19.393Z.json")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    current = {name: getattr(metro_log_parser, name) for name in RECORD_TYPES}
+    try:
+        for name, cls in _legacy_records().items():
+            setattr(metro_log_parser, name, cls)
+        legacy = measure(args.file, args.repeat)
+    finally:
+        for name, cls in current.items():
+            setattr(metro_log_parser, name, cls)
+    slotted = measure(args.file, args.repeat)
+
+    print(f"普通dataclass: {legacy:10.0f} bytes/回合")
+    print(f"slots:         {slotted:10.0f} bytes/回合  ({legacy / slotted:.2f}x)")
+
+    eager = scan_scores(args.file, args.repeat, materialize=True)
+    lazy = scan_scores(args.file, args.repeat, materialize=False)
+    print(f"扫描得分（解析全部子对象）: {eager * 1e6:8.1f} us/回合")
+    print(f"扫描得分（按需解析）:       {lazy * 1e6:8.1f} us/回合  ({eager / lazy:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import time
+import numpy as np
+from metro_sim import MetroSim
+from obs_encoder import ObsEncoder
+
+# 基准测试：ObsEncoder与原DQNAgent逐字段拼接列表的obs_parser的编码耗时对比，并检查两者输出一致
+
+
+def legacy_parse(obs):
+    """原DQNAgent._get_obs_parser()中的解析器（保留作对照）"""
+    train_features = []
+    for train in obs['trains']:
+        train_id_onehot = [0] * 8
+        train_id_onehot[train['id']] = 1
+        train_features.extend([
+            *train_id_onehot,
+            *([1 if train['stationId'] == i else 0 for i in range(16)] + [1 if train['stationId'] is None else 0]),
+            *[1 if train['trackId'] == i else 0 for i in range(12)],
+            train['nodePosition'],
+            train['capacity'],
+            train['passengers'],
+            train['delayedRounds'],
+            1 if train['direction'] == 'forward' else 0,
+            *[1 if train['lineId'] == i else 0 for i in range(4)],
+            1 if train['status'] == 'running' else 0,
+            1 if train['status'] == 'stopped' else 0,
+            1 if train['status'] == 'trapped' else 0
+        ])
+
+    station_features = []
+    for station in obs['stations']:
+        station_id_onehot = [0] * 16
+        station_id_onehot[station['id']] = 1
+        station_features.extend([
+            *station_id_onehot,
+            float(station['x']),
+            float(station['y']),
+            float(station['passengers']),
+            float(1 if station['isTransfer'] else 0),
+            float(station['floodLevel']),
+            1 if station['isFailurePoint'] else 0,
+            station['elevation'],
+            1 if station['pumpUsed'] else 0,
+        ])
+
+    train_array = np.asarray(train_features, dtype=np.float32)
+    station_array = np.asarray(station_features, dtype=np.float32)
+    return np.concatenate([train_array, station_array])
+
+
+def collect_observations(count, seed):
+    """用MetroSim随机动作生成一批观察"""
+    sim = MetroSim(seed=seed)
+    rng = np.random.default_rng(seed)
+    observations = []
+    for _ in range(count):
+        if sim.round >= 30:
+            sim.reset()
+        actions = [{'trainId': i, 'actionType': int(a)} for i, a in enumerate(rng.integers(0, 5, size=8))]
+        observations.append(sim.step(actions))
+    return observations
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="观察编码基准测试")
+    parser.add_argument("--count", type=int, default=1000, help="观察数量")
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    observations = collect_observations(args.count, args.seed)
+    encoder = ObsEncoder()
+    expected = np.stack([legacy_parse(obs) for obs in observations])
+    assert np.array_equal(expected, encoder.encode_batch(observations)), "ObsEncoder与原解析器输出不一致"
+    assert all(np.array_equal(e, encoder.encode(obs)) for e, obs in zip(expected, observations))
+    print(f"✅ {args.count} 个观察编码一致，obs_dim={encoder.obs_dim}")
+
+    n = len(observations)
+    legacy = timed(lambda: [legacy_parse(obs) for obs in observations], 3) / n
+    single = timed(lambda: [encoder.encode(obs) for obs in observations], 3) / n
+    batches = [observations[i:i + args.batch] for i in range(0, n, args.batch)]
+    out = np.empty((args.batch, encoder.obs_dim), dtype=np.float32)
+    batched = timed(lambda: [encoder.encode_batch(b, out=out[:len(b)]) for b in batches], 3) / n
+    print(f"{'原解析器':>8}: {legacy * 1e6:8.1f} us/obs")
+    print(f"{'encode':>8}: {single * 1e6:8.1f} us/obs  ({legacy / single:5.1f}x)")
+    print(f"{'batch' + str(args.batch):>8}: {batched * 1e6:8.1f} us/obs  ({legacy / batched:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
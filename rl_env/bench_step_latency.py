@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import time
+import msgpack
+import numpy as np
+import websockets
+from metro_env import MetroEnv
+
+# 基准测试：对比旧的“100ms排空”等待方式与按序号匹配响应的step延迟
+# 使用前先启动游戏服务器：npm run start:server
+
+MONITOR_ALL = [{"trainId": i, "actionType": 0} for i in range(8)]
+ACTION_TYPES = ['monitor', 'start', 'stop', 'reverse', 'evacuate']
+
+
+async def _drain(connection):
+    """旧实现：收到响应后继续接收，直到100ms内没有新消息"""
+    while True:
+        try:
+            await asyncio.wait_for(connection.recv(), timeout=0.1)
+        except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+            break
+
+
+async def bench_drain(uri, steps):
+    """复现改动前的step：发送动作数组，取第一条响应后排空缓冲区"""
+    connection = await websockets.connect(uri)
+    await _drain(connection)
+    await connection.send(msgpack.packb([{"trainId": 0, "actionType": "reset"}]))
+    await connection.recv()
+    await _drain(connection)
+
+    latencies = []
+    for _ in range(steps):
+        actions = [{"trainId": a["trainId"], "actionType": ACTION_TYPES[a["actionType"]]} for a in MONITOR_ALL]
+        start = time.perf_counter()
+        await connection.send(msgpack.packb(actions))
+        msgpack.unpackb(await connection.recv(), raw=False)
+        await _drain(connection)
+        latencies.append(time.perf_counter() - start)
+
+    await connection.close()
+    return latencies
+
+
+async def bench_seq(host, port, steps):
+    """新实现：MetroEnv按序号匹配响应，收到即返回"""
+    env = MetroEnv(host=host, port=port)
+    await env.reset(use_msgpack=True)
+
+    latencies = []
+    for _ in range(steps):
+        actions = [dict(a) for a in MONITOR_ALL]
+        start = time.perf_counter()
+        await env.step(actions)
+        latencies.append(time.perf_counter() - start)
+
+    await env.close()
+    return latencies
+
+
+def report(name, latencies):
+    ms = np.asarray(latencies) * 1000
+    print(f"{name:>6}: 平均={ms.mean():7.2f}ms  p50={np.percentile(ms, 50):7.2f}ms  "
+          f"p95={np.percentile(ms, 95):7.2f}ms  吞吐={len(ms) / ms.sum() * 1000:8.1f} steps/s")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="MetroEnv step延迟基准测试")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--steps", type=int, default=30)
+    args = parser.parse_args()
+
+    uri = f"ws://{args.host}:{args.port}"
+    report("drain", await bench_drain(uri, args.steps))
+    report("seq", await bench_seq(args.host, args.port, args.steps))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
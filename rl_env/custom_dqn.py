@@ -2,14 +2,18 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 import numpy as np
-import random
-from collections import deque
 import asyncio
 from metro_env import MetroEnv
+from vector_metro_env import VectorMetroEnv
+from metro_sim import SimMetroEnv, BatchSimVectorEnv
+from obs_encoder import ObsEncoder, STATUS_COLS, STATION_NULL_COLS
 import json
-import websockets
+import argparse
 import matplotlib.pyplot as plt
 import os
+import copy
+import queue
+import threading
 import time
 from IPython import display
 
@@ -33,23 +37,331 @@ class QNetwork(nn.Module):
         return torch.stack([head(x) for head in self.heads], dim=1)  # [batch, 8, 5]
 
 class ReplayBuffer:
-    """经验回放缓冲区"""
-    def __init__(self, capacity):
-        self.buffer = deque(maxlen=capacity)
-    
-    def push(self, state, action, reward, next_state, done):
-        self.buffer.append((state, action, reward, next_state, done))
-    
+    """经验回放缓冲区：预分配数组的环形缓冲区，按索引采样
+
+    给出path时存储在该目录下的内存映射文件中（各数组 + 头部），
+    重启后可继续使用已有数据，其它进程也可用readonly=True打开同一目录并行采样。
+
+    dedup_frames=True时按帧存储：每个槽位存一帧观察，槽位i上的经验为 (帧i, 动作i, 奖励i, 帧next[i], done_i)，
+    同一个stream（如向量环境中的第几个环境）连续push时上一条的next_state直接作为下一条的state，观察只存一次，
+    多个环境交替写入时也能接续；回合结束后的终止帧单独占一个槽位（valid为False），不会与下一局的初始帧相连。
+    prev[j]为以帧j作为next_state的经验槽位，帧j被覆盖时该经验随之失效。
+    """
+    HEADER_FIELDS = ('cursor', 'size', 'capacity', 'obs_dim', 'dedup_frames', 'filled')
+
+    def __init__(self, capacity, obs_dim=None, num_trains=8, seed=None, path=None, readonly=False, dedup_frames=False):
+        self.capacity = capacity
+        self.num_trains = num_trains
+        self.rng = np.random.default_rng(seed)
+        self.path = path
+        self.readonly = readonly
+        self.dedup_frames = dedup_frames
+        self.header = None  # 内存映射模式下的头部，字段见HEADER_FIELDS
+        self.cursor = 0  # 下一个写入位置
+        self.size = 0  # 可采样的经验数
+        self.filled = 0  # 已写入过的槽位数
+        self.heads = {}  # 按帧存储时每个stream最近写入帧的槽位（可被该stream的下一条经验接续）
+        self._head_streams = {}  # 槽位 → stream，槽位被覆盖时取消接续
+        self.obs_dim = None
+
+        header_file = os.path.join(path, 'header.i64') if path is not None else None
+        if header_file is not None and os.path.exists(header_file):
+            header = np.memmap(header_file, dtype=np.int64, mode='r', shape=(len(self.HEADER_FIELDS),))
+            self.capacity, obs_dim, self.dedup_frames = int(header[2]), int(header[3]), bool(header[4])
+            if capacity != self.capacity and not readonly:
+                print(f"回放文件容量为 {self.capacity}，忽略参数 capacity={capacity}")
+        elif readonly:
+            raise FileNotFoundError(f"回放文件不存在: {header_file}")
+        if obs_dim is not None:
+            self._alloc(obs_dim)
+
+    def _alloc(self, obs_dim):
+        """按观察维度预分配存储；未给出obs_dim时在第一次push时分配"""
+        self.obs_dim = obs_dim
+        if self.dedup_frames:
+            layout = {
+                'frames': ('frames.f32', np.float32, (self.capacity, obs_dim)),
+                'valid': ('valid.bool', bool, (self.capacity,)),
+                'next': ('next.i64', np.int64, (self.capacity,)),
+                'prev': ('prev.i64', np.int64, (self.capacity,)),
+            }
+        else:
+            layout = {
+                'states': ('states.f32', np.float32, (self.capacity, obs_dim)),
+                'next_states': ('next_states.f32', np.float32, (self.capacity, obs_dim)),
+            }
+        layout['actions'] = ('actions.i8', np.int8, (self.capacity, self.num_trains))
+        layout['rewards'] = ('rewards.f32', np.float32, (self.capacity,))
+        layout['dones'] = ('dones.bool', bool, (self.capacity,))
+
+        if self.path is None:
+            for attr, (_, dtype, shape) in layout.items():
+                setattr(self, attr, np.zeros(shape, dtype=dtype))
+            if self.dedup_frames:
+                self.prev[:] = -1
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        header_file = os.path.join(self.path, 'header.i64')
+        resume = os.path.exists(header_file)
+        mode = 'r' if self.readonly else ('r+' if resume else 'w+')
+        self.header = np.memmap(header_file, dtype=np.int64, mode=mode, shape=(len(self.HEADER_FIELDS),))
+        if resume:
+            if int(self.header[3]) != obs_dim:
+                raise ValueError(f"回放文件的obs_dim为 {int(self.header[3])}，与当前 {obs_dim} 不一致")
+            self.cursor, self.size, self.filled = int(self.header[0]), int(self.header[1]), int(self.header[5])
+        else:
+            self.header[:] = [0, 0, self.capacity, obs_dim, int(self.dedup_frames), 0]
+            self.header.flush()
+        for attr, (name, dtype, shape) in layout.items():
+            setattr(self, attr, np.memmap(os.path.join(self.path, name), dtype=dtype, mode=mode, shape=shape))
+        if self.dedup_frames and mode == 'w+':
+            self.prev[:] = -1
+
+    def push(self, state, action, reward, next_state, done, stream=0):
+        """写入一条经验；stream为经验所属的环境序号，按帧存储时只与同一stream的上一条经验接续"""
+        if self.readonly:
+            raise RuntimeError("只读回放缓冲区不能写入")
+        if self.obs_dim is None:
+            self._alloc(len(state))
+        if self.dedup_frames:
+            self._push_frame(state, action, reward, next_state, done, stream)
+        else:
+            i = self.cursor
+            self.states[i] = state
+            self.actions[i] = action
+            self.rewards[i] = reward
+            self.next_states[i] = next_state
+            self.dones[i] = done
+            self.cursor = (i + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+            self.filled = self.size
+        self._sync_header()
+
+    def _sync_header(self):
+        if self.header is not None:
+            # 先写数据再更新头部，读者看到的size范围内总是完整的经验
+            self.header[0] = self.cursor
+            self.header[1] = self.size
+            self.header[5] = self.filled
+
+    def push_batch(self, states, actions, rewards, next_states, dones):
+        """批量写入多条经验（数组第一维为条数），用于离线数据集等大批量导入"""
+        if self.readonly:
+            raise RuntimeError("只读回放缓冲区不能写入")
+        n = len(states)
+        if n == 0:
+            return
+        if self.obs_dim is None:
+            self._alloc(states.shape[1])
+        if self.dedup_frames:
+            # 按帧存储需要逐条判断能否接续上一帧
+            for i in range(n):
+                self._push_frame(states[i], actions[i], rewards[i], next_states[i], dones[i])
+        else:
+            if n > self.capacity:  # 超出容量时只保留最后capacity条，与逐条push的结果相同
+                self.cursor = (self.cursor + n - self.capacity) % self.capacity
+                states, actions, rewards, next_states, dones = (
+                    a[n - self.capacity:] for a in (states, actions, rewards, next_states, dones))
+                n = self.capacity
+            idx = (self.cursor + np.arange(n)) % self.capacity
+            self.states[idx] = states
+            self.actions[idx] = actions
+            self.rewards[idx] = rewards
+            self.next_states[idx] = next_states
+            self.dones[idx] = dones
+            self.cursor = (self.cursor + n) % self.capacity
+            self.size = min(self.size + n, self.capacity)
+            self.filled = self.size
+        self._sync_header()
+
+    def _write_frame(self, frame):
+        """在cursor处写入一帧，覆盖的旧槽位及以它为next_state的经验不再可采样"""
+        i = self.cursor
+        if self.valid[i]:
+            self.valid[i] = False
+            self.size -= 1
+        p = self.prev[i]
+        if p >= 0 and self.valid[p] and self.next[p] == i:
+            self.valid[p] = False
+            self.size -= 1
+        self.prev[i] = -1
+        stream = self._head_streams.pop(i, None)
+        if stream is not None:
+            del self.heads[stream]
+        self.frames[i] = frame
+        self.cursor = (i + 1) % self.capacity
+        self.filled = min(self.filled + 1, self.capacity)
+        return i
+
+    def _push_frame(self, state, action, reward, next_state, done, stream=0):
+        # state与该stream最近写入的帧相同（同一局的连续一步）时直接接续，否则另起一个槽位；
+        # 接续的帧不能正好是下一个写入位置（否则会被next_state覆盖）
+        head = self.heads.pop(stream, None)
+        if head is not None:
+            del self._head_streams[head]
+        continues = (head is not None and head != self.cursor and not self.dones[head]
+                     and np.array_equal(self.frames[head], state))
+        i = head if continues else self._write_frame(state)
+        j = self._write_frame(next_state)
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.dones[j] = done  # 终止帧标记为done，下一次push不会接续
+        self.dones[i] = done
+        self.next[i] = j
+        self.prev[j] = i
+        self.valid[i] = True
+        self.size += 1
+        self.heads[stream] = j
+        self._head_streams[j] = stream
+
     def sample(self, batch_size):
-        return random.sample(self.buffer, batch_size)
-    
+        """随机采样一批经验，返回torch张量 (states, actions, rewards, next_states, dones)"""
+        if self.readonly and self.header is not None:
+            self.size, self.filled = int(self.header[1]), int(self.header[5])  # 读者每次采样前刷新写入进度
+        if self.dedup_frames:
+            idx = self._sample_valid(batch_size)
+            states, next_states = self.frames[idx], self.frames[self.next[idx]]
+        else:
+            idx = self.rng.integers(0, self.size, size=batch_size)
+            states, next_states = self.states[idx], self.next_states[idx]
+        return (
+            torch.from_numpy(states),
+            torch.from_numpy(self.actions[idx]),
+            torch.from_numpy(self.rewards[idx]),
+            torch.from_numpy(next_states),
+            torch.from_numpy(self.dones[idx]),
+        )
+
+    def _sample_valid(self, batch_size):
+        """拒绝采样：在已写入的槽位中随机抽取，丢弃不构成完整经验的槽位"""
+        chosen = []
+        remaining = batch_size
+        while remaining > 0:
+            candidates = self.rng.integers(0, self.filled, size=2 * remaining)
+            candidates = candidates[self.valid[candidates]][:remaining]
+            chosen.append(candidates)
+            remaining -= len(candidates)
+        return np.concatenate(chosen)
+
+    def flush(self):
+        """将内存映射的数据写回磁盘"""
+        if self.header is None or self.readonly:
+            return
+        arrays = (self.frames, self.valid, self.next, self.prev) if self.dedup_frames else (self.states, self.next_states)
+        for array in (*arrays, self.actions, self.rewards, self.dones, self.header):
+            array.flush()
+
     def __len__(self):
-        return len(self.buffer)
+        if self.readonly and self.header is not None:
+            self.size = int(self.header[1])
+        return self.size
+
+class Learner(threading.Thread):
+    """独立的学习线程：actor把经验放入队列，学习线程把经验写入回放缓冲区，并持续做经验回放更新
+
+    本次运行的更新次数跟随 replay_ratio × 已提交经验数：学习线程不超过这个数（经验不够时等待新经验），
+    落后超过max_lag次更新时actor在submit中等待学习线程追上，结束时补完剩余的更新。
+    每publish_every次更新发布一份权重副本，actor在每次环境step后检查版本号并换上最新权重。
+    回放缓冲区、q_net、target_net和优化器只由学习线程使用。
+    """
+    def __init__(self, agent, replay_ratio=1.0, publish_every=50, max_lag=1000, queue_size=10000):
+        super().__init__(daemon=True)
+        self.agent = agent
+        self.replay_ratio = replay_ratio
+        self.publish_every = publish_every
+        self.max_lag = max_lag
+        self.queue = queue.Queue(maxsize=queue_size)  # 队列满时actor让出事件循环等待，避免经验无限堆积
+        self.submitted = 0  # actor已提交的经验数
+        self.transitions = 0  # 已写入回放缓冲区的经验数
+        self.start_updates = agent.updates  # 之前（如pretrain）已做的更新不计入本次的更新预算
+        self.weights = (0, None)  # (版本号, 权重副本)，整体替换，actor读取时不需要加锁
+        self.error = None
+        self._ready = len(agent.buffer) >= agent.batch_size  # 回放缓冲区已够一个batch，学习线程可以更新
+        self._stopping = threading.Event()
+
+    @property
+    def updates(self):
+        """本次运行已做的更新次数"""
+        return self.agent.updates - self.start_updates
+
+    def _lagging(self):
+        return self._ready and self.updates < self.replay_ratio * self.submitted - self.max_lag
+
+    async def submit(self, state, action, reward, next_state, done, stream=0):
+        """actor提交一条经验；队列满或学习线程落后太多时在事件循环中等待，不阻塞其它协程"""
+        item = (state, action, reward, next_state, done, stream)
+        while True:
+            if self.error is not None:
+                raise RuntimeError("学习线程已出错") from self.error
+            if not self._lagging():
+                try:
+                    self.queue.put_nowait(item)
+                    self.submitted += 1
+                    return
+                except queue.Full:
+                    pass
+            await asyncio.sleep(0.001)
+
+    def _drain(self, timeout=None):
+        """把队列中的经验写入回放缓冲区；timeout不为None时最多等待这么久以取得第一条"""
+        try:
+            item = self.queue.get(timeout=timeout) if timeout is not None else self.queue.get_nowait()
+        except queue.Empty:
+            return
+        while True:
+            self.agent.buffer.push(*item)
+            self.transitions += 1
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                self._ready = len(self.agent.buffer) >= self.agent.batch_size
+                return
+
+    def _can_update(self):
+        return self._ready and self.updates < self.replay_ratio * self.transitions
+
+    def _update(self):
+        agent = self.agent
+        agent._replay()
+        updates = self.updates
+        if updates % agent.update_target_every == 0:
+            agent.target_net.load_state_dict(agent.q_net.state_dict())
+        if updates % self.publish_every == 0:
+            self._publish()
+
+    def _publish(self):
+        version = self.weights[0] + 1
+        self.weights = (version, {k: v.detach().clone() for k, v in self.agent.q_net.state_dict().items()})
+
+    def run(self):
+        try:
+            while not self._stopping.is_set():
+                self._drain()
+                if not self._can_update():
+                    self._drain(timeout=0.05)
+                    continue
+                self._update()
+            # 补完剩余的更新预算（受max_lag限制，最多约max_lag次）
+            self._drain()
+            while self._can_update():
+                self._update()
+            self._publish()
+        except Exception as e:
+            self.error = e
+            raise
+
+    def stop(self):
+        """写入队列中剩余的经验，补完剩余的更新并结束线程"""
+        self._stopping.set()
+        self.join()
 
 class DQNAgent:
-    def __init__(self, env):
+    def __init__(self, env, buffer_capacity=10000, buffer_path=None, dedup_frames=False):
         self.env = env
-        self.obs_parser = self._get_obs_parser()
+        self.obs_encoder = ObsEncoder()
+        self._obs_buffers = np.zeros((2, self.obs_encoder.obs_dim), dtype=np.float32)  # 见_parse_observation
+        self._obs_slot = 0
         
         # 动作空间参数
         self.train_id_size = 8  # 假设有8个列车
@@ -60,10 +372,12 @@ class DQNAgent:
         # 神经网络参数
         self.q_net = QNetwork(obs_size=self._get_obs_dim(), action_size=self.total_actions)
         self.target_net = QNetwork(obs_size=self._get_obs_dim(), action_size=self.total_actions)
+        self.actor_net = self.q_net  # 用于与环境交互的网络；使用独立学习线程时为定期同步的副本
+        self._actor_version = 0
         self.optimizer = optim.Adam(self.q_net.parameters(), lr=0.001)
         
         # 训练参数
-        self.buffer = ReplayBuffer(10000)
+        self.buffer = ReplayBuffer(buffer_capacity, obs_dim=self._get_obs_dim(), path=buffer_path, dedup_frames=dedup_frames)
         self.batch_size = 64
         self.gamma = 0.99 # 折扣因子
         self.epsilon = 1.0 # 探索率
@@ -71,107 +385,23 @@ class DQNAgent:
         self.epsilon_decay = 0.995 # 探索率衰减
         self.update_target_every = 100 # 更新目标网络的频率
         self.steps = 0 # 步数
+        self.updates = 0 # 经验回放更新次数
         self.episode_rewards = []  # 记录每轮的总奖励
         self.moving_avg = []       # 记录移动平均
 
     def _get_obs_dim(self):
-        """动态获取观察空间维度"""
-        sample_obs = self._parse_observation({
-            'trains': [{
-                'id': 0, 
-                'stationId': None, 
-                'trackId': 0, 
-                'nodePosition': 0, 
-                'capacity': 100, 
-                'passengers': 50, 
-                'status': 'running', 
-                'direction': 'forward', 
-                'lineId': 1, 
-                'delayedRounds': 0, 
-                # 'lastMoveRound': 0
-            }] * 8,
-            'stations': [{
-                'id': 0, 
-                'name': 'H1-West', 
-                'x': 100, 
-                'y': 200, 
-                'passengers': 30, 
-                'isTransfer': False, 
-                # 'connected': [1], 
-                'floodLevel': 0, 
-                # 'previousFloodLevel': 0, 
-                'isFailurePoint': False, 
-                'elevation': 5, 
-                # 'hasPump': True, 
-                # 'pumpThreshold': 10, 
-                # 'pumpRate': 3, 
-                'pumpUsed': False, 
-                # 'lastIncrease': None, 
-                # 'increaseInThisRound': 0
-            }] * 16,
-            'score': 1600, 
-            'info': {'round': 1}
-        })
-        return len(sample_obs)
-
-    def _get_obs_parser(self):
-        """创建观察解析器"""
-        def obs_parser(obs):
-            # 将观察数据展平为向量
-            train_features = []
-            for train in obs['trains']:
-                # 对离散型ID进行独热编码（假设有8个列车）
-                train_id_onehot = [0] * self.train_id_size
-                train_id_onehot[train['id']] = 1
-                
-                train_features.extend([
-                    *train_id_onehot,  # 替换原来的train['id']
-                    *([1 if train['stationId'] == i else 0 for i in range(16)] + [1 if train['stationId'] is None else 0]),  # 16个车站 + 1个null状态的独热编码
-                    *[1 if train['trackId'] == i else 0 for i in range(12)],  # 12条轨道的独热编码
-                    train['nodePosition'], 
-                    train['capacity'],
-                    train['passengers'],
-                    train['delayedRounds'],
-                    1 if train['direction'] == 'forward' else 0,
-                    *[1 if train['lineId'] == i else 0 for i in range(4)],  # 4条线路的独热编码
-                    1 if train['status'] == 'running' else 0,
-                    1 if train['status'] == 'stopped' else 0, 
-                    1 if train['status'] == 'trapped' else 0
-                ])
-            
-            station_features = []
-            for station in obs['stations']:
-                # 对车站ID也进行独热编码（假设有16个车站）
-                station_id_onehot = [0] * self.station_id_size
-                station_id_onehot[station['id']] = 1
-                
-                station_features.extend([
-                    *station_id_onehot,  # 替换原来的station['id']
-                    float(station['x']),
-                    float(station['y']),
-                    float(station['passengers']),
-                    float(1 if station['isTransfer'] else 0),
-                    # station['connected'],
-                    float(station['floodLevel']),
-                    # station['previousFloodLevel'],
-                    1 if station['isFailurePoint'] else 0,
-                    station['elevation'],
-                    # station['hasPump'],
-                    # station['pumpThreshold'],
-                    # station['pumpRate'],
-                    1 if station['pumpUsed'] else 0,
-                ])
-
-            # 使用np.asarray显式指定dtype
-            train_array = np.asarray(train_features, dtype=np.float32)
-            station_array = np.asarray(station_features, dtype=np.float32)
-            
-            return np.concatenate([train_array, station_array])
-        return obs_parser
+        """获取观察空间维度"""
+        return self.obs_encoder.obs_dim
 
     def _parse_observation(self, obs):
-        """处理原始观察数据"""
-        return self.obs_parser(obs)
+        """处理原始观察数据
+
+        结果写入两块预分配缓冲区中的一块（轮流使用，state和next_state可以同时有效），
+        下下次调用时会被覆盖；需要保留时由调用方复制（回放缓冲区写入时复制）。
+        """
+        out = self._obs_buffers[self._obs_slot]
+        self._obs_slot ^= 1
+        return self.obs_encoder.encode(obs, out)
 
     def _action_mapping(self, action_indices):
         """将8个动作索引转换为环境需要的动作列表"""
@@ -180,17 +410,102 @@ class DQNAgent:
             'actionType': int(action_idx)
         } for train_id, action_idx in enumerate(action_indices)]
 
-    async def train(self, episodes=1000):
+    def _action_mask(self, states):
+        """由编码后的观察生成允许动作掩码 [B, 8, 5]
 
-        self.env.ws = await websockets.connect(
-            "ws://localhost:8765",
-            ping_interval=None,
-            max_size=1_000_000_000,
-            open_timeout=10,
-            subprotocols=["json", "msgpack"]
-        )
+        0: Monitor  1: Start  2: Stop  3: Reverse  4: Evacuate
+        running: monitor/stop/reverse，stopped: monitor/start/reverse，trapped: 仅monitor；在车站时均可evacuate
+        """
+        running = states[:, STATUS_COLS[:, 0]] > 0.5  # [B, 8]
+        stopped = states[:, STATUS_COLS[:, 1]] > 0.5
+        trapped = states[:, STATUS_COLS[:, 2]] > 0.5
+        at_station = states[:, STATION_NULL_COLS] < 0.5
+        mask = torch.zeros(states.shape[0], self.train_id_size, self.action_type_size, dtype=torch.bool)
+        mask[:, :, 0] = True
+        mask[:, :, 1] = stopped
+        mask[:, :, 2] = running
+        mask[:, :, 3] = running | stopped
+        mask[:, :, 4] = (running | stopped | trapped) & at_station
+        return mask
+
+    def _select_actions(self, states):
+        """对一批观察 [B, obs_dim] 的所有列车同时进行带掩码的ε-贪心决策，返回动作索引 [B, 8]"""
+        states = torch.as_tensor(states, dtype=torch.float32)
+        mask = self._action_mask(states)
 
-        """训练循环"""
+        with torch.no_grad():
+            q_values = self.actor_net(states)[:, :, :self.action_type_size]  # [B, 8, 5]
+        greedy = q_values.masked_fill(~mask, float('-inf')).argmax(dim=2)
+        # 在允许动作中均匀随机：对独立均匀随机数取argmax
+        explore_actions = torch.rand(mask.shape).masked_fill(~mask, -1.0).argmax(dim=2)
+        explore = torch.rand(greedy.shape) < self.epsilon
+        return torch.where(explore, explore_actions, greedy).numpy()
+
+    async def _record(self, learner, state, action, reward, next_state, done, stream=0):
+        """存储一条经验：使用独立学习线程时交给learner，否则直接写入回放缓冲区；stream为向量环境中的环境序号"""
+        if learner is not None:
+            # 观察可能在_parse_observation的缓冲区中，交给学习线程前复制
+            await learner.submit(state.copy(), action, reward, next_state.copy(), done, stream)
+        else:
+            self.buffer.push(state, action, reward, next_state, done, stream)
+
+    def _after_step(self, learner):
+        """每次环境step之后：同步训练时做一次经验回放并定期更新目标网络；使用learner时只换上其最新发布的权重"""
+        if learner is not None:
+            if learner.error is not None:
+                raise RuntimeError("学习线程已出错") from learner.error
+            version, weights = learner.weights
+            if version != self._actor_version:
+                self.actor_net.load_state_dict(weights)
+                self._actor_version = version
+        else:
+            # 经验回放
+            if len(self.buffer) >= self.batch_size:
+                self._replay()
+
+            # 更新目标网络
+            if self.steps % self.update_target_every == 0:
+                self.target_net.load_state_dict(self.q_net.state_dict())
+        self.steps += 1
+
+    def _start_learner(self, replay_ratio, publish_every, max_lag):
+        """创建并启动学习线程，actor改用q_net的副本"""
+        self.actor_net = copy.deepcopy(self.q_net)
+        self._actor_version = 0
+        learner = Learner(self, replay_ratio=replay_ratio, publish_every=publish_every, max_lag=max_lag)
+        learner.start()
+        return learner
+
+    def _stop_learner(self, learner):
+        if learner is not None:
+            learner.stop()
+            self.actor_net = self.q_net
+
+    def _throughput(self, start_time, start_steps, start_updates):
+        """训练开始以来的 (环境步数/秒, 更新次数/秒)"""
+        elapsed = max(time.perf_counter() - start_time, 1e-9)
+        return (self.steps - start_steps) / elapsed, (self.updates - start_updates) / elapsed
+
+    async def train(self, episodes=1000, learner_thread=False, replay_ratio=1.0, publish_every=50, max_lag=1000):
+        """训练循环
+
+        learner_thread=True时经验回放在独立的学习线程中进行（见Learner），本协程只与环境交互，
+        replay_ratio为每条经验对应的更新次数，publish_every为学习线程发布权重的间隔（更新次数），
+        max_lag为学习线程最多落后的更新次数，超过时actor等待。
+        """
+        learner = self._start_learner(replay_ratio, publish_every, max_lag) if learner_thread else None
+        start = (time.perf_counter(), self.steps, self.updates)
+        try:
+            await self._train_episodes(episodes, learner, start)
+        finally:
+            self._stop_learner(learner)
+        env_rate, update_rate = self._throughput(*start)
+        print(f"吞吐: 环境 {env_rate:.1f} 步/s, 更新 {update_rate:.1f} 次/s")
+
+        # 训练结束后添加可视化
+        self._plot_training_progress()
+
+    async def _train_episodes(self, episodes, learner, start):
         for episode in range(episodes):
             obs = await self.env.reset(use_msgpack=True)
             state = self._parse_observation(obs)
@@ -199,46 +514,7 @@ class DQNAgent:
             
             for _ in range(30):
                 # 为每个列车独立决策
-                action_indices = []
-                state_tensor = torch.FloatTensor(state)
-                
-                with torch.no_grad():
-                    q_values = self.q_net(state_tensor)  # [8, 5]
-                
-                for train_id in range(self.train_id_size):
-                    # 获取列车当前状态
-                    train_data = obs['trains'][train_id]
-                    status = train_data['status']
-                    station_id = train_data['stationId']
-                    
-                    # 根据状态确定允许的动作类型
-                    # 0: Monitor  1: Start  2: Stop  3: Reverse  4: Evacuate
-                    allowed_actions = []
-                    if status == 'running':
-                        allowed_actions = [0, 2, 3]  # monitor, stop, reverse
-                        if station_id is not None:
-                            allowed_actions.append(4)  # evacuate
-                    elif status == 'stopped':
-                        allowed_actions = [0, 1, 3]  # monitor, start, reverse
-                        if station_id is not None:
-                            allowed_actions.append(4)
-                    elif status == 'trapped':
-                        allowed_actions = [0]  # monitor
-                        if station_id is not None:
-                            allowed_actions.append(4)
-                    
-                    # 确保至少有一个允许动作
-                    if not allowed_actions:
-                        allowed_actions = [0]
-                    
-                    if random.random() < self.epsilon:
-                        action_idx = random.choice(allowed_actions)
-                    else:
-                        # 在允许动作中选择Q值最大的
-                        valid_q = q_values[train_id][allowed_actions]
-                        action_idx = allowed_actions[torch.argmax(valid_q).item()]
-                        
-                    action_indices.append(action_idx)
+                action_indices = self._select_actions(state[None])[0]
                 
                 # 执行动作
                 actions = self._action_mapping(action_indices)
@@ -250,26 +526,21 @@ class DQNAgent:
                 reward = next_obs['score'] - total_reward
                 
                 # 存储经验
-                self.buffer.push(state, action_indices, reward, next_state, done)
+                await self._record(learner, state, action_indices, reward, next_state, done)
                 state = next_state
                 obs = next_obs
                 total_reward = next_obs['score']
-                
-                # 经验回放
-                if len(self.buffer) >= self.batch_size:
-                    self._replay()
-                
-                # 更新目标网络
-                if self.steps % self.update_target_every == 0:
-                    self.target_net.load_state_dict(self.q_net.state_dict())
-                
-                self.steps += 1
+
+                # 经验回放、更新目标网络（或取学习线程的最新权重）
+                self._after_step(learner)
 
             
             # 衰减探索率
             self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay)
             
-            print(f"Episode: {episode+1}, Total Reward: {total_reward:.2f}, Epsilon: {self.epsilon:.2f}")
+            env_rate, update_rate = self._throughput(*start)
+            print(f"Episode: {episode+1}, Total Reward: {total_reward:.2f}, Epsilon: {self.epsilon:.2f}, "
+                  f"环境 {env_rate:.1f} 步/s, 更新 {update_rate:.1f} 次/s")
             
             # 添加记录
             self.episode_rewards.append(total_reward)
@@ -279,24 +550,70 @@ class DQNAgent:
             if episode % 10 == 0:  # 每10轮更新一次
                 self._plot_realtime(episode)
 
-        # 训练结束后添加可视化
+    async def train_vectorized(self, vec_env, episodes=1000, learner_thread=False, replay_ratio=1.0, publish_every=50,
+                               max_lag=1000):
+        """使用VectorMetroEnv并行采样的训练循环，每次向量step写入num_envs条经验；learner_thread等参数同train"""
+        learner = self._start_learner(replay_ratio, publish_every, max_lag) if learner_thread else None
+        start = (time.perf_counter(), self.steps, self.updates)
+        try:
+            await self._train_vectorized_episodes(vec_env, episodes, learner, start)
+        finally:
+            self._stop_learner(learner)
+        env_rate, update_rate = self._throughput(*start)
+        print(f"吞吐: 环境 {env_rate * vec_env.num_envs:.1f} 步/s（{env_rate:.1f} 次向量step/s）, 更新 {update_rate:.1f} 次/s")
+
         self._plot_training_progress()
 
+    async def _train_vectorized_episodes(self, vec_env, episodes, learner, start):
+        states, infos = await vec_env.reset()
+        episode = 0
+
+        while episode < episodes:
+            # 所有环境、所有列车一次完成决策
+            action_indices = self._select_actions(states)
+
+            next_states, rewards, dones, infos = await vec_env.step(action_indices)
+
+            for i in range(vec_env.num_envs):
+                # 自动重置的环境，next_state应为结束时的观察而不是新一局的初始观察
+                if dones[i] and 'terminal_state' in infos[i]:
+                    next_state = infos[i]['terminal_state']  # 已编码（BatchSimVectorEnv）
+                elif dones[i]:
+                    next_state = self._parse_observation(infos[i]['terminal_observation'])
+                else:
+                    next_state = next_states[i]
+                await self._record(learner, states[i], action_indices[i], float(rewards[i]), next_state, bool(dones[i]), i)
+            states = next_states
+
+            # 经验回放、更新目标网络（或取学习线程的最新权重）
+            self._after_step(learner)
+
+            for i in np.flatnonzero(dones):
+                total_reward = infos[i]['episode_score']
+                episode += 1
+
+                # 衰减探索率
+                self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay)
+
+                env_rate, update_rate = self._throughput(*start)
+                print(f"Episode: {episode}, Env: {i}, Total Reward: {total_reward:.2f}, Epsilon: {self.epsilon:.2f}, "
+                      f"环境 {env_rate * vec_env.num_envs:.1f} 步/s, 更新 {update_rate:.1f} 次/s")
+
+                self.episode_rewards.append(total_reward)
+                self.moving_avg.append(np.mean(self.episode_rewards[-100:]))
+
     def _replay(self):
         """执行经验回放更新网络"""
-        batch = self.buffer.sample(self.batch_size)
-        states, actions, rewards, next_states, dones = zip(*batch)
-        
-        states = torch.FloatTensor(np.array(states))
-        actions = torch.LongTensor(actions)
-        rewards = torch.FloatTensor(rewards)
-        next_states = torch.FloatTensor(np.array(next_states))
-        dones = torch.BoolTensor(dones)
+        states, actions, rewards, next_states, dones = self.buffer.sample(self.batch_size)
+        actions = actions.long()  # gather需要int64索引
         
         # 修改后的目标Q值计算
         with torch.no_grad():
             # 修改1：调整维度处理 [batch, 8, 5] -> [batch, 8]
-            target_q = self.target_net(next_states).max(dim=2)[0]  # 取每个列车动作的最大值
+            # 只在下一状态的允许动作中取最大值
+            next_q = self.target_net(next_states)[:, :, :self.action_type_size]
+            next_q = next_q.masked_fill(~self._action_mask(next_states), float('-inf'))
+            target_q = next_q.max(dim=2)[0]  # 取每个列车动作的最大值
             target_q = target_q.sum(dim=1)  # 对8个列车的Q值求和 [batch]
             target_q[dones] = 0.0
             target = rewards + self.gamma * target_q
@@ -314,9 +631,38 @@ class DQNAgent:
         self.optimizer.zero_grad()
         loss.backward()
         self.optimizer.step()
+        self.updates += 1
+
+    def pretrain(self, updates, behavior_cloning=False):
+        """只用回放缓冲区中已有的经验更新网络，不与环境交互（如offline_dataset.py由人类日志生成的经验）
+
+        behavior_cloning=True时改为行为克隆：对每个列车的动作做交叉熵，使贪心策略模仿日志中的操作
+        """
+        if len(self.buffer) < self.batch_size:
+            print(f"回放缓冲区只有 {len(self.buffer)} 条经验，跳过预训练")
+            return
+        for update in range(updates):
+            if behavior_cloning:
+                self._clone_step()
+            else:
+                self._replay()
+            if (update + 1) % self.update_target_every == 0:
+                self.target_net.load_state_dict(self.q_net.state_dict())
+        self.target_net.load_state_dict(self.q_net.state_dict())
+        print(f"预训练完成：{updates} 次更新（{'行为克隆' if behavior_cloning else 'DQN'}）")
+
+    def _clone_step(self):
+        """行为克隆的一次更新"""
+        states, actions, _, _, _ = self.buffer.sample(self.batch_size)
+        logits = self.q_net(states)[:, :, :self.action_type_size]  # [batch, 8, 5]
+        loss = nn.CrossEntropyLoss()(logits.reshape(-1, self.action_type_size), actions.long().reshape(-1))
+        self.optimizer.zero_grad()
+        loss.backward()
+        self.optimizer.step()
 
     def save(self, filename):
         """保存模型"""
+        self.buffer.flush()
         torch.save({
             'q_net': self.q_net.state_dict(),
             'target_net': self.target_net.state_dict(),
@@ -377,12 +723,57 @@ class DQNAgent:
         plt.close()
 
 async def main():
-    env = MetroEnv()
-    agent = DQNAgent(env)
+    parser = argparse.ArgumentParser(description="训练自定义DQN智能体")
+    parser.add_argument("--ports", type=int, nargs="+", default=[8765], help="游戏服务器端口，多个端口时并行采样")
+    parser.add_argument("--episodes", type=int, default=500)
+    parser.add_argument("--sim", action="store_true", help="使用进程内的MetroSim代替游戏服务器")
+    parser.add_argument("--num-games", type=int, default=1,
+                        help="与--sim一起使用，大于1时用BatchMetroSim同时推进这么多局，以train_vectorized训练")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--buffer-capacity", type=int, default=10000, help="经验回放容量（可设到百万级）")
+    parser.add_argument("--buffer-path", default=None, help="经验回放存放在该目录的内存映射文件中，重启后继续使用")
+    parser.add_argument("--dedup-frames", action="store_true", help="经验回放按帧存储，每个观察只存一次")
+    parser.add_argument("--pretrain-updates", type=int, default=0,
+                        help="开始训练前先在回放缓冲区已有的经验（如offline_dataset.py生成的人类经验）上更新的次数")
+    parser.add_argument("--behavior-cloning", action="store_true", help="预训练使用行为克隆而不是DQN更新")
+    parser.add_argument("--learner-thread", action="store_true",
+                        help="经验回放在独立的学习线程中进行，与环境交互（等待服务器、编码观察）重叠")
+    parser.add_argument("--replay-ratio", type=float, default=1.0, help="使用学习线程时，每条经验对应的更新次数")
+    parser.add_argument("--publish-every", type=int, default=50, help="使用学习线程时，每多少次更新向actor发布一次权重")
+    parser.add_argument("--max-lag", type=int, default=1000,
+                        help="使用学习线程时，学习线程最多落后 replay_ratio×经验数 的更新次数，超过时actor等待")
+    args = parser.parse_args()
+
+    vectorized = (args.num_games > 1) if args.sim else len(args.ports) > 1
+    if args.sim and vectorized:
+        env = BatchSimVectorEnv(args.num_games, seed=args.seed)
+        agent = DQNAgent(env, buffer_capacity=args.buffer_capacity, buffer_path=args.buffer_path,
+                         dedup_frames=args.dedup_frames)
+    elif args.sim:
+        env = SimMetroEnv(seed=args.seed)
+        agent = DQNAgent(env, buffer_capacity=args.buffer_capacity, buffer_path=args.buffer_path,
+                         dedup_frames=args.dedup_frames)
+    elif vectorized:
+        agent = DQNAgent(None, buffer_capacity=args.buffer_capacity, buffer_path=args.buffer_path,
+                         dedup_frames=args.dedup_frames)
+        env = VectorMetroEnv(args.ports, obs_encoder=agent.obs_encoder)
+        agent.env = env
+    else:
+        env = MetroEnv(port=args.ports[0])
+        agent = DQNAgent(env, buffer_capacity=args.buffer_capacity, buffer_path=args.buffer_path,
+                         dedup_frames=args.dedup_frames)
     
     try:
-        await agent.train(episodes=500)
+        if args.pretrain_updates > 0:
+            agent.pretrain(args.pretrain_updates, behavior_cloning=args.behavior_cloning)
+        learner_options = dict(learner_thread=args.learner_thread, replay_ratio=args.replay_ratio,
+                               publish_every=args.publish_every, max_lag=args.max_lag)
+        if vectorized:
+            await agent.train_vectorized(env, episodes=args.episodes, **learner_options)
+        else:
+            await agent.train(episodes=args.episodes, **learner_options)
         agent.save("custom_dqn_model.pth")
+        print(f"连接统计: {env.stats}")
     finally:
         await env.close()
 
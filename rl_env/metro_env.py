@@ -5,13 +5,29 @@ import asyncio
 import numpy as np
 import msgpack
 import io
+import time
+import uuid
 
 class MetroEnv(gym.Env):
-    def __init__(self, host='localhost', port=8765):
+    def __init__(self, host='localhost', port=8765, max_reconnect_attempts=5, backoff_base=0.5, backoff_max=8.0):
         super().__init__()
         self.ws_uri = f"ws://{host}:{port}"
         self.connection = None
         self.use_msgpack = True  # 添加类属性
+        self.seq = 0  # 动作批次序号，服务器在对应的观察值中原样返回
+        self.client_id = uuid.uuid4().hex  # 与seq一起标识批次，服务器据此识别重连后重发的批次
+
+        # 长连接：只在连接真正断开时才以指数退避方式重连
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stats = {
+            'connects': 0,              # 成功握手次数
+            'reconnects': 0,            # 断线后重连次数
+            'handshake_time': 0.0,      # 累计握手耗时（秒）
+            'last_handshake_time': 0.0, # 最近一次握手耗时（秒）
+            'requests': 0,              # 已发送的动作批次数
+        }
         
         # # 改进后的动态动作空间定义
         # self.action_space = gym.spaces.Dict({
@@ -59,38 +75,14 @@ class MetroEnv(gym.Env):
         # })
 
     async def reset(self, use_msgpack=False):
-        """重置环境并返回初始观察值"""
+        """在已有连接上重置游戏并返回初始观察值"""
         self.use_msgpack = use_msgpack  # 存储序列化方式
-        # 关闭之前的连接
-        if self.connection:
-            await self.connection.close()
-
-        # 连接到服务器
-        self.connection = await websockets.connect(self.ws_uri)
-        
-        # 新增：在发送reset前清空缓冲区
-        while True:
-            try:
-                await asyncio.wait_for(self.connection.recv(), timeout=0.1)
-            except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
-                break
 
         reset_msg = [{"trainId": 0, "actionType": "reset"}]
-        
-        if self.use_msgpack:
-            await self.connection.send(msgpack.packb(reset_msg))
-            response = await self.connection.recv()
-
-            # 修改缓冲区清理方式：改为接收所有剩余消息
-            while True:
-                try:
-                    await asyncio.wait_for(self.connection.recv(), timeout=0.1)
-                except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
-                    break
 
-            parse = msgpack.unpackb(response, raw=False, use_list=True)
-          
-            return parse
+        if self.use_msgpack:
+            # 连接时服务器主动推送的初始状态帧不带序号，会在_request中被丢弃
+            return await self._request(reset_msg)
 
         # else:
         #     await self.connection.send(json.dumps(reset_msg))
@@ -132,19 +124,7 @@ class MetroEnv(gym.Env):
             a['actionType'] = valid_actions_str[a['actionType']]
         
         if self.use_msgpack:
-            await self.connection.send(msgpack.packb(action))
-            
-            # 移除人为延迟，改用确定性等待
-            response = await self.connection.recv()  # 直接等待最新响应
-            
-            while True:
-                try:
-                    await asyncio.wait_for(self.connection.recv(), timeout=0.1)
-                except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
-                    break
-            
-            parsed = msgpack.unpackb(response, raw=False)
-            return parsed
+            return await self._request(action)
         # else:
         #     await self.connection.send(json.dumps(action))
         #     response = await self.connection.recv()
@@ -157,6 +137,58 @@ class MetroEnv(gym.Env):
         #     data['info']
         # )
 
+    async def connect(self):
+        """建立websocket连接并记录握手耗时"""
+        start = time.perf_counter()
+        self.connection = await websockets.connect(
+            self.ws_uri,
+            ping_interval=None,
+            max_size=1_000_000_000,
+            open_timeout=10,
+            subprotocols=["json", "msgpack"]
+        )
+        elapsed = time.perf_counter() - start
+        self.stats['connects'] += 1
+        self.stats['handshake_time'] += elapsed
+        self.stats['last_handshake_time'] = elapsed
+
+    async def _reconnect(self):
+        """连接断开后按指数退避重连"""
+        self.stats['reconnects'] += 1
+        for attempt in range(self.max_reconnect_attempts):
+            try:
+                await self.connect()
+                return
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+                if attempt == self.max_reconnect_attempts - 1:
+                    print(f"⚠️ 重连失败({attempt + 1}/{self.max_reconnect_attempts}): {repr(e)}")
+                    break  # 最后一次失败后直接报错，不再等待
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                print(f"⚠️ 重连失败({attempt + 1}/{self.max_reconnect_attempts}): {repr(e)}，{delay:.1f}s后重试")
+                await asyncio.sleep(delay)
+        raise ConnectionError(f"无法重新连接到 {self.ws_uri}")
+
+    async def _request(self, actions):
+        """发送带序号的动作批次，收到序号匹配的观察值后立即返回"""
+        if self.connection is None:
+            await self.connect()
+
+        self.seq += 1
+        self.stats['requests'] += 1
+        message = msgpack.packb({"client": self.client_id, "seq": self.seq, "actions": actions})
+
+        while True:
+            try:
+                await self.connection.send(message)
+                while True:
+                    response = msgpack.unpackb(await self.connection.recv(), raw=False, use_list=True)
+                    # 丢弃序号不匹配的旧帧，无需超时等待
+                    if response.get('seq') == self.seq:
+                        return response
+            except websockets.exceptions.ConnectionClosed:
+                # 游戏状态保存在服务器端，重连后重发同一批次；若断线前服务器已处理过，它会返回缓存的观察值而不再执行一次
+                await self._reconnect()
+
     # def _parse_observation(self, obs):
     #     """更新观察解析，包含有效动作掩码"""
     #     try:
@@ -202,7 +234,8 @@ class MetroEnv(gym.Env):
 
     async def close(self):
         if self.connection:
-            await self.connection.close() 
+            await self.connection.close()
+            self.connection = None
 
     # async def _get_observation(self):
     #     # 添加编码参数处理二进制键
@@ -0,0 +1,1024 @@
+import copy
+import json
+import math
+import sys
+import numpy as np
+from obs_encoder import OBS_DIM, TRAINS_DIM, TRAIN_DIM, STATION_DIM, TRAIN_OFFSETS, STATION_OFFSETS, NUM_STATIONS, NUM_LINES
+
+# 纯Python的无界面模拟器，逐回合复现GameServer的updateGameState（src/utils/gameUtils.ts）：
+# 列车移动(含防撞停车) → 水泵排水 → 故障点涨水(对数正态) → 洪水传播 → 乘客上下车 → trapped判定 → 计分
+
+# 与 src/data/initialGameState.ts 一致的默认设置，键名与日志中的 setting 相同
+DEFAULT_SETTINGS = {
+    'failurePointFloodIncreaseBaseMu': 5,
+    'failurePointFloodIncreaseSigmaMin': 0.3,
+    'failurePointFloodIncreaseSigmaMax': 0.7,
+    'getOnAndOffRatioMin': 0.2,
+    'getOnAndOffRatioMax': 0.4,
+    'trappedThreshold': 50,
+    'floodWarningThreshold': 40,
+    'defaultDecisionTime': 30,
+    'delayScorePerPassenger': 5,
+    'evacuationScorePerPassenger': -15,
+    'trappedInTrackScorePerPassenger': -50,
+    'PROPAGATION_FLOOD_INCREASE': 6,
+    'PROPAGATION_THRESHOLD': 20,
+    'elevationDifferenceFactor': 0.2,
+    'floodDifferenceFactor': 0.1,
+}
+
+# initializeFailurePoints(…, 3) 实际选取 slice(0, 3 - 1)，即2个故障点
+FAILURE_POINT_COUNT = 2
+
+ACTION_TYPES = ['monitor', 'start', 'stop', 'reverse', 'evacuate']
+
+
+def _station(id, name, x, y, passengers, is_transfer, connected, elevation):
+    return {'id': id, 'name': name, 'x': x, 'y': y, 'passengers': passengers, 'isTransfer': is_transfer,
+            'connected': connected, 'floodLevel': 0, 'previousFloodLevel': 0, 'isFailurePoint': False,
+            'elevation': elevation, 'hasPump': True, 'pumpThreshold': 10, 'pumpRate': 3, 'pumpUsed': False}
+
+
+# src/data/initialStations.ts
+INITIAL_STATIONS = [
+    _station(0, "H1-West", 100, 200, 30, False, [1], 5),
+    _station(1, "H1-WestXfer", 200, 200, 40, True, [0, 2], 4),
+    _station(2, "H1-EastXfer", 300, 200, 40, True, [1, 3], 4),
+    _station(3, "H1-East", 400, 200, 30, False, [2], 3),
+    _station(4, "H2-West", 100, 300, 30, False, [5], 3),
+    _station(5, "H2-WestXfer", 200, 300, 40, True, [4, 6], 2),
+    _station(6, "H2-EastXfer", 300, 300, 40, True, [5, 7], 2),
+    _station(7, "H2-East", 400, 300, 30, False, [6], 1),
+    _station(8, "V1-North", 200, 100, 30, False, [9], 5),
+    _station(9, "V1-NorthXfer", 200, 200, 40, True, [8, 10], 4),
+    _station(10, "V1-SouthXfer", 200, 300, 40, True, [9, 11], 2),
+    _station(11, "V1-South", 200, 400, 30, False, [10], 1),
+    _station(12, "V2-North", 300, 100, 30, False, [13], 5),
+    _station(13, "V2-NorthXfer", 300, 200, 40, True, [12, 14], 4),
+    _station(14, "V2-SouthXfer", 300, 300, 40, True, [13, 15], 2),
+    _station(15, "V2-South", 300, 400, 30, False, [14], 1),
+]
+
+
+def _track(id, line_id, station_a, station_b, node_id, x, y, name, elevation):
+    return {'id': id, 'lineId': line_id, 'stationA': station_a, 'stationB': station_b,
+            'nodes': [{'id': node_id, 'x': x, 'y': y, 'floodLevel': 0, 'isFailurePoint': False,
+                       'name': name, 'elevation': elevation}]}
+
+
+# src/data/initialTracks.ts（calculateNodeElevation取两端车站高程的均值）
+INITIAL_TRACKS = [
+    _track(0, 1, 0, 1, 100, 150, 200, "H1-1", (5 + 4) / 2),
+    _track(1, 1, 1, 2, 101, 250, 200, "H1-2", (4 + 4) / 2),
+    _track(2, 1, 2, 3, 102, 350, 200, "H1-3", 4.5),
+    _track(3, 2, 4, 5, 103, 150, 300, "H2-1", 4.5),
+    _track(4, 2, 5, 6, 104, 250, 300, "H2-2", 4.5),
+    _track(5, 2, 6, 7, 105, 350, 300, "H2-3", 4.5),
+    _track(6, 3, 8, 9, 106, 200, 150, "V1-1", 4.5),
+    _track(7, 3, 9, 10, 107, 200, 250, "V1-2", (4 + 2) / 2),
+    _track(8, 3, 10, 11, 108, 200, 350, "V1-3", 4.5),
+    _track(9, 4, 12, 13, 109, 300, 150, "V2-1", 4.5),
+    _track(10, 4, 13, 14, 110, 300, 250, "V2-2", 4.5),
+    _track(11, 4, 14, 15, 111, 300, 350, "V2-3", 4.5),
+]
+
+
+def _train(id, station_id, passengers, direction, line_id):
+    return {'id': id, 'stationId': station_id, 'trackId': None, 'nodePosition': 0, 'capacity': 100,
+            'passengers': passengers, 'status': 'running', 'direction': direction, 'lineId': line_id,
+            'delayedRounds': 0, 'lastMoveRound': 0}
+
+
+# src/data/initialGameState.ts
+INITIAL_TRAINS = [
+    _train(0, 0, 50, 'forward', 1),
+    _train(1, 3, 40, 'backward', 1),
+    _train(2, 4, 45, 'forward', 2),
+    _train(3, 7, 35, 'backward', 2),
+    _train(4, 8, 35, 'forward', 3),
+    _train(5, 11, 45, 'backward', 3),
+    _train(6, 12, 40, 'forward', 4),
+    _train(7, 15, 30, 'backward', 4),
+]
+
+
+def build_line_index(tracks):
+    """复现getLocationSequenceInLine，返回 {('station'|'track', id): indexInLine}"""
+    index = {}
+    for line_id in sorted({t['lineId'] for t in tracks}):
+        tracks_in_line = [t for t in tracks if t['lineId'] == line_id]
+        all_stations = [s for t in tracks_in_line for s in (t['stationA'], t['stationB'])]
+        unique_stations = [s for s in all_stations if all_stations.count(s) == 1]
+        start = next(s for s in unique_stations if any(t['stationA'] == s for t in tracks_in_line))
+
+        visited = set()
+        position = 0
+        current = start
+        while True:
+            track = next((t for t in tracks_in_line
+                          if current in (t['stationA'], t['stationB']) and t['id'] not in visited), None)
+            if track is None:
+                break
+            visited.add(track['id'])
+            index[('station', current)] = position
+            position += 1
+            nodes = track['nodes'] if track['stationA'] == current else track['nodes'][::-1]
+            for node in nodes:
+                index[('track', node['id'])] = position
+                position += 1
+            current = track['stationB'] if track['stationA'] == current else track['stationA']
+        index[('station', current)] = position
+    return index
+
+
+class MetroSim:
+    """无需Node服务器的进程内游戏引擎，step()返回与MetroEnv.step()相同结构的观察dict"""
+    def __init__(self, seed=None, settings=None, failure_point_count=FAILURE_POINT_COUNT):
+        self.rng = np.random.default_rng(seed)
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self.failure_point_count = failure_point_count
+        self.line_index = build_line_index(INITIAL_TRACKS)
+        self.station_by_xy = {}
+        for s in INITIAL_STATIONS:
+            self.station_by_xy.setdefault((s['x'], s['y']), []).append(s['id'])
+        # 与服务器一样，故障点在引擎创建时确定，之后每次reset沿用
+        self.failure_points = self._draw_failure_points()
+        self.reset()
+
+    def _draw_failure_points(self):
+        """在车站和轨道节点中随机选取故障点"""
+        candidates = [('station', s['id']) for s in INITIAL_STATIONS]
+        candidates += [('track', n['id']) for t in INITIAL_TRACKS for n in t['nodes']]
+        chosen = self.rng.permutation(len(candidates))[:self.failure_point_count]
+        return {candidates[i] for i in chosen}
+
+    def reset(self, seed=None):
+        """重置为初始状态；传入seed时重新设定随机数并重新选取故障点"""
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+            self.failure_points = self._draw_failure_points()
+
+        self.round = 0
+        self.score = 0
+        self.stations = copy.deepcopy(INITIAL_STATIONS)
+        self.tracks = copy.deepcopy(INITIAL_TRACKS)
+        self.trains = copy.deepcopy(INITIAL_TRAINS)
+        for s in self.stations:
+            s['isFailurePoint'] = ('station', s['id']) in self.failure_points
+            s['lastIncrease'] = None
+        for t in self.tracks:
+            for n in t['nodes']:
+                n['isFailurePoint'] = ('track', n['id']) in self.failure_points
+                n['lastIncrease'] = None
+        self.pending_actions = []
+        self.evacuated_train_ids = []
+        return self.observation()
+
+    def load_log_entry(self, entry):
+        """从一条metro_logs日志记录恢复该回合结束时的游戏状态"""
+        self.stations = copy.deepcopy(INITIAL_STATIONS)
+        self.tracks = copy.deepcopy(INITIAL_TRACKS)
+        for s, logged in zip(self.stations, entry['stations']):
+            s.update(floodLevel=logged['currentFloodLevel'], passengers=logged['currentPassengers'],
+                     isFailurePoint=logged['isFailurePoint'], pumpUsed=logged['pumpUsed'])
+        for t, logged in zip(self.tracks, entry['tracks']):
+            for n, logged_node in zip(t['nodes'], logged['nodes']):
+                n.update(floodLevel=logged_node['currentFloodLevel'], isFailurePoint=logged_node['isFailurePoint'])
+        self.trains = [{
+            'id': t['id'], 'stationId': t['stationId'], 'trackId': t['trackId'], 'nodePosition': t['nodePosition'],
+            'capacity': t['capacity'], 'passengers': t['currentPassengers'], 'status': t['currentStatus'],
+            'direction': t['currentDirection'], 'lineId': t['lineId'], 'delayedRounds': t.get('delayedRounds', 0),
+            'lastMoveRound': t.get('lastMoveRound', 0)
+        } for t in entry['trains']]
+        self.failure_points = {('station', s['id']) for s in self.stations if s['isFailurePoint']}
+        self.failure_points |= {('track', n['id']) for t in self.tracks for n in t['nodes'] if n['isFailurePoint']}
+        self.round = entry['round'] + 1
+        self.score = entry['totalScore']
+        self.pending_actions = []
+        self.evacuated_train_ids = []
+        return self.observation()
+
+    def observation(self):
+        """与GameServer.serializeState相同结构的观察"""
+        return {
+            'trains': [dict(t) for t in self.trains],
+            'stations': [dict(s) for s in self.stations],
+            'score': self.score,
+            'info': {'round': self.round},
+            'seq': None,
+        }
+
+    # ---------- 动作 ----------
+
+    def train_location(self, train):
+        """复现getTrainLocation，返回 (类型, id, indexInLine)，无法定位时返回None"""
+        if train['stationId'] is not None:
+            key = ('station', train['stationId'])
+        else:
+            track = self.tracks[train['trackId']] if train['trackId'] is not None else None
+            if track is None or not 0 <= train['nodePosition'] < len(track['nodes']):
+                return None
+            key = ('track', track['nodes'][train['nodePosition']]['id'])
+        if key not in self.line_index:
+            return None
+        return key[0], key[1], self.line_index[key]
+
+    def queue_action(self, train_id, action_type):
+        """复现handleRLAction：记录待执行操作，回合更新时统一生效"""
+        if isinstance(action_type, (int, np.integer)):
+            action_type = ACTION_TYPES[action_type]
+        if action_type == 'monitor':
+            return
+        train = next((t for t in self.trains if t['id'] == train_id), None)
+        if train is None:
+            return
+        self.pending_actions.append({
+            'type': action_type,
+            'targetTrain': dict(train),
+            'targetLocation': self.train_location(train),
+        })
+
+    def step(self, actions):
+        """执行一批动作并推进一回合，动作格式同MetroEnv.step（actionType可为索引或字符串）"""
+        if any(a['actionType'] == 'reset' for a in actions):
+            return self.reset()
+        for a in actions:
+            # 与GameServer.handleAction一致：`if (action.trainId && action.actionType)` 会忽略trainId为0的动作
+            if a['trainId'] and a['actionType'] is not None:
+                self.queue_action(a['trainId'], a['actionType'])
+        self.update()
+        return self.observation()
+
+    def _apply_pending_actions(self):
+        """复现processPendingActions/applyAction"""
+        for action in self.pending_actions:
+            train = next((t for t in self.trains if t['id'] == action['targetTrain']['id']), None)
+            if train is not None:
+                if action['type'] == 'start':
+                    train['status'] = 'running'
+                elif action['type'] == 'stop':
+                    train['status'] = 'stopped'
+                elif action['type'] == 'reverse':
+                    train['direction'] = 'backward' if train['direction'] == 'forward' else 'forward'
+                elif action['type'] == 'evacuate':
+                    location = action['targetLocation']
+                    if location is not None and location[0] == 'station':
+                        train['status'] = 'stopped'
+            if action['type'] == 'evacuate':
+                self.evacuated_train_ids.append(action['targetTrain']['id'])
+
+    # ---------- 回合更新 ----------
+
+    def update(self):
+        """复现updateGameState，推进一回合"""
+        original_trains = [dict(t) for t in self.trains]
+        self.trains = [dict(t) for t in self.trains]
+        self._apply_pending_actions()
+
+        self.trains = self._move_trains(self.trains)
+        self._update_flood_levels()
+        self._update_passengers()
+
+        threshold = self.settings['trappedThreshold']
+        for train in self.trains:
+            flood_level = self._flood_level_at(train)
+            if flood_level > threshold:
+                train['status'] = 'trapped'
+            elif train['status'] == 'trapped':
+                # 水位下降后从trapped转为stopped
+                train['status'] = 'stopped'
+
+        round_score = self._round_score(original_trains)
+        self.last_round_score = round_score
+        self.score += round_score
+        self.round += 1
+        self.pending_actions = []
+        self.evacuated_train_ids = []
+        return round_score
+
+    def _flood_level_at(self, train):
+        if train['stationId'] is not None:
+            return self.stations[train['stationId']]['floodLevel']
+        if train['trackId'] is not None:
+            nodes = self.tracks[train['trackId']]['nodes']
+            if 0 <= train['nodePosition'] < len(nodes):
+                return nodes[train['nodePosition']]['floodLevel']
+        return 0
+
+    def _collision_imminent(self, train, trains):
+        """复现getCollisionImminentTrains：同线同向、位置相差不超过1且对方停止/被困时返回True"""
+        location = self.train_location(train)
+        if location is None:
+            return False
+        for other in trains:
+            if other['id'] == train['id'] or other['lineId'] != train['lineId'] or other['direction'] != train['direction']:
+                continue
+            other_location = self.train_location(other)
+            if other_location is None or other['status'] not in ('stopped', 'trapped'):
+                continue
+            diff = location[2] - other_location[2]
+            if train['direction'] == 'forward' and 0 <= diff <= 1:
+                return True
+            if train['direction'] == 'backward' and diff == 1:
+                return True
+        return False
+
+    def _move_trains(self, trains):
+        """复现moveTrainToNextNode，按列车顺序依次处理（防撞停车会影响之后列车的判定）"""
+        current_round = self.round
+        moved = []
+        for train in trains:
+            if train['status'] != 'running':
+                moved.append({**train, 'delayedRounds': train['delayedRounds'] + (1 if current_round - train['lastMoveRound'] > 0 else 0)})
+                continue
+
+            if self._collision_imminent(train, trains):
+                train['status'] = 'stopped'
+                moved.append({**train, 'delayedRounds': train['delayedRounds'] + 1})
+                continue
+
+            forward = train['direction'] == 'forward'
+            if train['stationId'] is not None:
+                next_track = next((t for t in self.tracks
+                                   if (t['stationA'] if forward else t['stationB']) == train['stationId']), None)
+                if next_track is None:
+                    # 终点站：掉头
+                    moved.append({**train, 'direction': 'backward' if forward else 'forward', 'lastMoveRound': current_round})
+                else:
+                    moved.append({**train, 'stationId': None, 'trackId': next_track['id'],
+                                  'nodePosition': 0 if forward else len(next_track['nodes']) - 1,
+                                  'lastMoveRound': current_round})
+                continue
+
+            track = self.tracks[train['trackId']] if train['trackId'] is not None else None
+            if track is None:
+                moved.append(train)
+                continue
+            new_position = train['nodePosition'] + (1 if forward else -1)
+            if forward and new_position >= len(track['nodes']):
+                moved.append({**train, 'stationId': track['stationB'], 'nodePosition': len(track['nodes']),
+                              'lastMoveRound': current_round})
+            elif not forward and new_position < 0:
+                moved.append({**train, 'stationId': track['stationA'], 'nodePosition': -1,
+                              'lastMoveRound': current_round})
+            else:
+                moved.append({**train, 'nodePosition': new_position, 'lastMoveRound': current_round})
+        return moved
+
+    def _sample_flood_increase(self, kind, node_id):
+        """复现generateLognormalIncrease：众数为baseMu、σ在[min,max]均匀取值的对数正态分布，保留1位小数"""
+        s = self.settings
+        sigma = s['failurePointFloodIncreaseSigmaMin'] + self.rng.random() * (
+            s['failurePointFloodIncreaseSigmaMax'] - s['failurePointFloodIncreaseSigmaMin'])
+        mu = math.log(s['failurePointFloodIncreaseBaseMu']) + sigma * sigma
+        normal = mu + sigma * self.rng.standard_normal()
+        return math.floor(math.exp(normal) * 10 + 0.5) / 10
+
+    def _propagate(self, source_level, target_level, source_elevation, target_elevation):
+        """复现propagateFlood，返回 (新水位, 增量)"""
+        s = self.settings
+        if source_level >= s['PROPAGATION_THRESHOLD'] and source_level > target_level:
+            elevation_factor = 1 + (source_elevation - target_elevation) * s['elevationDifferenceFactor']
+            amount = min(s['PROPAGATION_FLOOD_INCREASE'],
+                         math.ceil((source_level - target_level) * s['floodDifferenceFactor'] * elevation_factor))
+            return min(100, target_level + amount), amount
+        return target_level, 0
+
+    def _update_flood_levels(self):
+        """复现updateFloodLevels：先排水后涨水，再依次在换乘站、站→轨、轨↔轨、轨→站之间传播"""
+        threshold = self.settings['PROPAGATION_THRESHOLD']
+
+        for station in self.stations:
+            station['previousFloodLevel'] = station['floodLevel']
+            level = station['floodLevel']
+            pump_used = False
+            if station['hasPump'] and station['floodLevel'] >= station['pumpThreshold']:
+                level = max(0, level - station['pumpRate'])
+                pump_used = True
+            increase = 0
+            if station['isFailurePoint']:
+                increase = self._sample_flood_increase('station', station['id'])
+                level = min(100, level + increase)
+            station['floodLevel'] = level
+            station['increaseInThisRound'] = level - (station['previousFloodLevel'] or 0)
+            station['lastIncrease'] = increase if station['isFailurePoint'] else None
+            station['pumpUsed'] = pump_used
+
+        for track in self.tracks:
+            for node in track['nodes']:
+                node['previousFloodLevel'] = node['floodLevel']
+                if node['isFailurePoint']:
+                    increase = self._sample_flood_increase('track', node['id'])
+                    node['floodLevel'] = min(100, node['floodLevel'] + increase)
+                    node['increaseInThisRound'] = node['floodLevel'] - (node['previousFloodLevel'] or 0)
+                    node['lastIncrease'] = increase
+                else:
+                    node['increaseInThisRound'] = 0
+
+        # 换乘站之间（坐标相同的换乘站）
+        for station in self.stations:
+            if station['isTransfer'] and station['floodLevel'] >= threshold:
+                for other_id in self.station_by_xy[(station['x'], station['y'])]:
+                    other = self.stations[other_id]
+                    if other_id == station['id'] or not other['isTransfer']:
+                        continue
+                    other['floodLevel'], increase = self._propagate(
+                        station['floodLevel'], other['floodLevel'], station['elevation'], other['elevation'])
+                    other['increaseInThisRound'] += increase
+
+        # 从站点向轨道
+        for station in self.stations:
+            if station['floodLevel'] >= threshold:
+                for track in self.tracks:
+                    if station['id'] not in (track['stationA'], track['stationB']):
+                        continue
+                    node = track['nodes'][0 if track['stationA'] == station['id'] else -1]
+                    node['floodLevel'], increase = self._propagate(
+                        station['floodLevel'], node['floodLevel'], station['elevation'], node['elevation'])
+                    node['increaseInThisRound'] += increase
+
+        # 轨道节点之间
+        for track in self.tracks:
+            nodes = track['nodes']
+            for i in range(len(nodes)):
+                if nodes[i]['floodLevel'] >= threshold:
+                    for j in (i - 1, i + 1):
+                        if 0 <= j < len(nodes):
+                            nodes[j]['floodLevel'], increase = self._propagate(
+                                nodes[i]['floodLevel'], nodes[j]['floodLevel'], nodes[i]['elevation'], nodes[j]['elevation'])
+                            nodes[j]['increaseInThisRound'] += increase
+
+        # 从轨道向站点
+        for track in self.tracks:
+            for node, station_id in ((track['nodes'][0], track['stationA']), (track['nodes'][-1], track['stationB'])):
+                if node['floodLevel'] >= threshold:
+                    station = self.stations[station_id]
+                    station['floodLevel'], increase = self._propagate(
+                        node['floodLevel'], station['floodLevel'], node['elevation'], station['elevation'])
+                    station['increaseInThisRound'] += increase
+
+    def _sample_ratio(self):
+        s = self.settings
+        return s['getOnAndOffRatioMin'] + self.rng.random() * (s['getOnAndOffRatioMax'] - s['getOnAndOffRatioMin'])
+
+    def _update_passengers(self):
+        """复现updatePassengers：在站列车（非trapped）疏散或随机上下车"""
+        for train in self.trains:
+            if train['status'] == 'trapped' or train['stationId'] is None:
+                continue
+            station = self.stations[train['stationId']]
+            if train['id'] in self.evacuated_train_ids:
+                station['passengers'] += train['passengers']
+                train['passengers'] = 0
+                continue
+            get_off = math.floor(train['passengers'] * self._sample_ratio())
+            get_on_ratio = self._sample_ratio()
+            train['passengers'] -= get_off
+            station['passengers'] += get_off
+            get_on = math.floor(station['passengers'] * get_on_ratio)
+            station['passengers'] -= get_on
+            train['passengers'] = min(train['capacity'], train['passengers'] + get_on)
+
+    def _round_score(self, original_trains):
+        """复现calculateRoundScore：准点/延误、疏散、轨道被困三项得分"""
+        s = self.settings
+        total = 0
+        for train in self.trains:
+            base = s['delayScorePerPassenger'] * train['passengers']
+            total += -base if train['delayedRounds'] > 0 else base
+            if train['id'] in self.evacuated_train_ids:
+                original = next(t for t in original_trains if t['id'] == train['id'])
+                total += s['evacuationScorePerPassenger'] * original['passengers']
+            if train['status'] == 'trapped' and train['stationId'] is None:
+                total += s['trappedInTrackScorePerPassenger'] * train['passengers']
+        return total
+
+
+class SimMetroEnv:
+    """以MetroSim为后端、接口与MetroEnv相同的异步环境，可直接替换MetroEnv用于训练"""
+    def __init__(self, seed=None, settings=None):
+        self.sim = MetroSim(seed=seed, settings=settings)
+        self.use_msgpack = True
+        self.stats = {'connects': 0, 'reconnects': 0, 'handshake_time': 0.0, 'last_handshake_time': 0.0, 'requests': 0}
+
+    async def reset(self, use_msgpack=False):
+        self.use_msgpack = use_msgpack
+        self.stats['requests'] += 1
+        return self.sim.reset()
+
+    async def step(self, action):
+        self.stats['requests'] += 1
+        return self.sim.step(action)
+
+    async def close(self):
+        pass
+
+
+# ---------- 批量模式：K局游戏的结构化数组(SoA)表示 ----------
+
+STATUS_CODES = {'running': 0, 'stopped': 1, 'trapped': 2}
+DIRECTION_CODES = {'forward': 0, 'backward': 1}
+
+
+class BatchMetroSim:
+    """同时推进K局独立游戏的向量化模拟器，回合逻辑与MetroSim一致
+
+    状态以NumPy数组保存：车站水位 [K,16]、轨道节点水位 [K,nodes]、列车位置/状态/方向 [K,8] 等，
+    每回合的涨水、排水、传播和列车移动都在K维上向量化执行。
+    与MetroSim不同，每局重置时都会重新选取故障点。
+    """
+    def __init__(self, num_games, seed=None, settings=None, max_rounds=30, failure_point_count=FAILURE_POINT_COUNT):
+        self.K = num_games
+        self.rng = np.random.default_rng(seed)
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self.max_rounds = max_rounds
+        self.failure_point_count = failure_point_count
+        self.terminal_states = np.empty((0, OBS_DIM), dtype=np.float32)  # 上一次结束的各局结束时的观察
+        self._build_topology()
+        self._allocate()
+        self.reset()
+
+    def _build_topology(self):
+        """将车站、轨道、列车的静态数据展开为索引数组"""
+        stations, tracks, trains = INITIAL_STATIONS, INITIAL_TRACKS, INITIAL_TRAINS
+        self.S, self.T, self.M = len(stations), len(tracks), len(trains)
+        self.station_elevation = np.array([s['elevation'] for s in stations], dtype=np.float64)
+        self.station_x = np.array([s['x'] for s in stations], dtype=np.float64)
+        self.station_y = np.array([s['y'] for s in stations], dtype=np.float64)
+        self.station_is_transfer = np.array([s['isTransfer'] for s in stations])
+        self.station_has_pump = np.array([s['hasPump'] for s in stations])
+        self.pump_threshold = np.array([s['pumpThreshold'] for s in stations], dtype=np.float64)
+        self.pump_rate = np.array([s['pumpRate'] for s in stations], dtype=np.float64)
+        self.initial_station_passengers = np.array([s['passengers'] for s in stations], dtype=np.int64)
+
+        # 轨道节点按轨道顺序展平
+        self.track_first_node = np.zeros(self.T, dtype=np.int64)
+        self.track_length = np.array([len(t['nodes']) for t in tracks], dtype=np.int64)
+        self.track_station_a = np.array([t['stationA'] for t in tracks], dtype=np.int64)
+        self.track_station_b = np.array([t['stationB'] for t in tracks], dtype=np.int64)
+        node_elevation = []
+        for i, t in enumerate(tracks):
+            self.track_first_node[i] = len(node_elevation)
+            node_elevation.extend(n['elevation'] for n in t['nodes'])
+        self.node_elevation = np.array(node_elevation, dtype=np.float64)
+        self.N = len(node_elevation)
+
+        # 列车在车站时，按方向驶入的下一条轨道（-1表示终点站，需要掉头）
+        self.next_track_forward = np.full(self.S, -1, dtype=np.int64)
+        self.next_track_backward = np.full(self.S, -1, dtype=np.int64)
+        for t in reversed(tracks):
+            self.next_track_forward[t['stationA']] = t['id']
+            self.next_track_backward[t['stationB']] = t['id']
+
+        # 车站/轨道节点在所属线路中的位置（indexInLine），用于防撞判定
+        line_index = build_line_index(tracks)
+        self.station_line_index = np.array([line_index[('station', s['id'])] for s in stations], dtype=np.int64)
+        self.node_line_index = np.array([line_index[('track', n['id'])] for t in tracks for n in t['nodes']], dtype=np.int64)
+
+        self.train_line = np.array([t['lineId'] for t in trains], dtype=np.int64)
+        self.train_capacity = np.array([t['capacity'] for t in trains], dtype=np.int64)
+        self.initial_train_station = np.array([t['stationId'] for t in trains], dtype=np.int64)
+        self.initial_train_passengers = np.array([t['passengers'] for t in trains], dtype=np.int64)
+        self.initial_train_direction = np.array([DIRECTION_CODES[t['direction']] for t in trains], dtype=np.int8)
+        # 与GameServer.handleAction一致，trainId为0的动作被忽略
+        self.actionable = np.arange(self.M) != 0
+
+        # 洪水传播的有序(源, 目标)列表：每一项在K维上向量化，但各项之间保持与JS相同的先后顺序
+        node_ids = {n['id']: self.track_first_node[i] + j for i, t in enumerate(tracks) for j, n in enumerate(t['nodes'])}
+        self.transfer_pairs = [(s['id'], o['id']) for s in stations for o in stations
+                               if s['isTransfer'] and o['isTransfer'] and s['id'] != o['id']
+                               and s['x'] == o['x'] and s['y'] == o['y']]
+        station_to_node = [(s['id'], node_ids[t['nodes'][0 if t['stationA'] == s['id'] else -1]['id']])
+                           for s in stations for t in tracks if s['id'] in (t['stationA'], t['stationB'])]
+        self.node_to_node = [(self.track_first_node[i] + a, self.track_first_node[i] + b)
+                             for i, t in enumerate(tracks) for a in range(len(t['nodes']))
+                             for b in (a - 1, a + 1) if 0 <= b < len(t['nodes'])]
+        node_to_station = [(node_ids[n['id']], station_id) for t in tracks
+                           for n, station_id in ((t['nodes'][0], t['stationA']), (t['nodes'][-1], t['stationB']))]
+        # 站→轨、轨→站两个阶段中源与目标互不相交，可按目标的出现次序分层，每层一次性向量化
+        self.station_to_node_layers = self._layers(station_to_node)
+        self.node_to_station_layers = self._layers(node_to_station)
+
+        # 同线路的其它列车，用于防撞判定
+        self.same_line_trains = [[o for o in range(self.M) if o != m and self.train_line[o] == self.train_line[m]]
+                                 for m in range(self.M)]
+
+    @staticmethod
+    def _layers(pairs):
+        """将有序(源, 目标)列表分层：第i层为各目标的第i次出现，层内目标不重复"""
+        layers, seen = [], {}
+        for source, target in pairs:
+            depth = seen.get(target, 0)
+            seen[target] = depth + 1
+            if depth == len(layers):
+                layers.append(([], []))
+            layers[depth][0].append(source)
+            layers[depth][1].append(target)
+        return [(np.array(src), np.array(dst)) for src, dst in layers]
+
+    def _allocate(self):
+        K, S, N, M = self.K, self.S, self.N, self.M
+        self.station_flood = np.zeros((K, S), dtype=np.float64)
+        self.station_passengers = np.zeros((K, S), dtype=np.int64)
+        self.station_pump_used = np.zeros((K, S), dtype=bool)
+        self.station_failure = np.zeros((K, S), dtype=bool)
+        self.node_flood = np.zeros((K, N), dtype=np.float64)
+        self.node_failure = np.zeros((K, N), dtype=bool)
+        self.train_station = np.zeros((K, M), dtype=np.int64)  # -1 表示不在车站
+        self.train_track = np.zeros((K, M), dtype=np.int64)  # -1 表示null
+        self.train_position = np.zeros((K, M), dtype=np.int64)
+        self.train_status = np.zeros((K, M), dtype=np.int8)
+        self.train_direction = np.zeros((K, M), dtype=np.int8)
+        self.train_passengers = np.zeros((K, M), dtype=np.int64)
+        self.train_delayed = np.zeros((K, M), dtype=np.int64)
+        self.train_last_move = np.zeros((K, M), dtype=np.int64)
+        self.round = np.zeros(K, dtype=np.int64)
+        self.score = np.zeros(K, dtype=np.int64)
+
+    def reset(self, games=None):
+        """重置全部或指定的若干局（games为索引数组），返回编码后的观察 [K, obs_dim]"""
+        games = np.arange(self.K) if games is None else np.asarray(games)
+        n = len(games)
+        self.station_flood[games] = 0
+        self.station_passengers[games] = self.initial_station_passengers
+        self.station_pump_used[games] = False
+        self.node_flood[games] = 0
+        self.train_station[games] = self.initial_train_station
+        self.train_track[games] = -1
+        self.train_position[games] = 0
+        self.train_status[games] = STATUS_CODES['running']
+        self.train_direction[games] = self.initial_train_direction
+        self.train_passengers[games] = self.initial_train_passengers
+        self.train_delayed[games] = 0
+        self.train_last_move[games] = 0
+        self.round[games] = 0
+        self.score[games] = 0
+
+        # 每局在车站和轨道节点中随机选取故障点
+        picks = np.argsort(self.rng.random((n, self.S + self.N)), axis=1)[:, :self.failure_point_count]
+        failure = np.zeros((n, self.S + self.N), dtype=bool)
+        np.put_along_axis(failure, picks, True, axis=1)
+        self.station_failure[games] = failure[:, :self.S]
+        self.node_failure[games] = failure[:, self.S:]
+        return self.encode()
+
+    # ---------- 回合更新 ----------
+
+    def _line_positions(self):
+        """每辆列车的indexInLine，无法定位时为-1"""
+        on_track = (self.train_station < 0) & (self.train_track >= 0)
+        track = np.where(self.train_track >= 0, self.train_track, 0)
+        valid_node = on_track & (self.train_position >= 0) & (self.train_position < self.track_length[track])
+        node = np.where(valid_node, self.track_first_node[track] + self.train_position, 0)
+        positions = np.where(valid_node, self.node_line_index[node], -1)
+        at_station = self.train_station >= 0
+        positions[at_station] = self.station_line_index[self.train_station[at_station]]
+        return positions
+
+    def _apply_actions(self, actions):
+        """复现processPendingActions：start/stop/reverse/evacuate，返回被疏散列车掩码 [K,8]"""
+        actions = np.where(self.actionable, actions, 0)
+        self.train_status[actions == 1] = STATUS_CODES['running']
+        self.train_status[actions == 2] = STATUS_CODES['stopped']
+        reverse = actions == 3
+        self.train_direction[reverse] = 1 - self.train_direction[reverse]
+        evacuated = actions == 4
+        self.train_status[evacuated & (self.train_station >= 0)] = STATUS_CODES['stopped']
+        return evacuated
+
+    def _move_trains(self):
+        """复现moveTrainToNextNode；按列车顺序处理，使防撞停车对之后列车的判定生效"""
+        positions = self._line_positions()  # 移动前的位置
+        station, track, position = self.train_station.copy(), self.train_track.copy(), self.train_position.copy()
+        direction, last_move, delayed = self.train_direction.copy(), self.train_last_move.copy(), self.train_delayed.copy()
+
+        for m in range(self.M):
+            running = self.train_status[:, m] == STATUS_CODES['running']
+            idle = ~running
+            delayed[idle, m] += (self.round[idle] - self.train_last_move[idle, m] > 0)
+
+            collision = np.zeros(self.K, dtype=bool)
+            for o in self.same_line_trains[m]:
+                diff = positions[:, m] - positions[:, o]
+                candidate = ((self.train_direction[:, o] == self.train_direction[:, m])
+                             & (self.train_status[:, o] != STATUS_CODES['running'])
+                             & (positions[:, m] >= 0) & (positions[:, o] >= 0))
+                forward = self.train_direction[:, m] == 0
+                collision |= candidate & np.where(forward, (diff >= 0) & (diff <= 1), diff == 1)
+            collision &= running
+            self.train_status[collision, m] = STATUS_CODES['stopped']
+            delayed[collision, m] += 1
+
+            moving = running & ~collision
+            forward = self.train_direction[:, m] == 0
+            at_station = moving & (self.train_station[:, m] >= 0)
+            st = np.where(at_station, self.train_station[:, m], 0)
+            next_track = np.where(forward, self.next_track_forward[st], self.next_track_backward[st])
+            terminal = at_station & (next_track < 0)
+            direction[terminal, m] = 1 - direction[terminal, m]
+            depart = at_station & (next_track >= 0)
+            station[depart, m] = -1
+            track[depart, m] = next_track[depart]
+            position[depart, m] = np.where(forward[depart], 0, self.track_length[next_track[depart]] - 1)
+
+            on_track = moving & (self.train_station[:, m] < 0) & (self.train_track[:, m] >= 0)
+            tr = np.where(on_track, self.train_track[:, m], 0)
+            new_position = self.train_position[:, m] + np.where(forward, 1, -1)
+            arrive_b = on_track & forward & (new_position >= self.track_length[tr])
+            arrive_a = on_track & ~forward & (new_position < 0)
+            station[arrive_b, m] = self.track_station_b[tr[arrive_b]]
+            position[arrive_b, m] = self.track_length[tr[arrive_b]]
+            station[arrive_a, m] = self.track_station_a[tr[arrive_a]]
+            position[arrive_a, m] = -1
+            advance = on_track & ~arrive_a & ~arrive_b
+            position[advance, m] = new_position[advance]
+
+            last_move[at_station | on_track, m] = self.round[at_station | on_track]
+
+        self.train_station, self.train_track, self.train_position = station, track, position
+        self.train_direction, self.train_last_move, self.train_delayed = direction, last_move, delayed
+
+    def _lognormal_increase(self, shape):
+        """复现generateLognormalIncrease，一次生成shape个样本"""
+        s = self.settings
+        sigma = s['failurePointFloodIncreaseSigmaMin'] + self.rng.random(shape) * (
+            s['failurePointFloodIncreaseSigmaMax'] - s['failurePointFloodIncreaseSigmaMin'])
+        mu = math.log(s['failurePointFloodIncreaseBaseMu']) + sigma * sigma
+        normal = mu + sigma * self.rng.standard_normal(shape)
+        return np.floor(np.exp(normal) * 10 + 0.5) / 10
+
+    def _propagate(self, source, target, source_elevation, target_elevation):
+        s = self.settings
+        flows = (source >= s['PROPAGATION_THRESHOLD']) & (source > target)
+        factor = 1 + (source_elevation - target_elevation) * s['elevationDifferenceFactor']
+        amount = np.minimum(s['PROPAGATION_FLOOD_INCREASE'], np.ceil((source - target) * s['floodDifferenceFactor'] * factor))
+        return np.where(flows, np.minimum(100, target + amount), target)
+
+    def _update_flood_levels(self):
+        """复现updateFloodLevels（先排水后涨水，再按固定顺序传播）"""
+        pump = self.station_has_pump & (self.station_flood >= self.pump_threshold)
+        self.station_flood = np.where(pump, np.maximum(0, self.station_flood - self.pump_rate), self.station_flood)
+        self.station_pump_used = pump
+        if self.station_failure.any():
+            increase = self._lognormal_increase(self.station_flood.shape)
+            self.station_flood = np.where(self.station_failure, np.minimum(100, self.station_flood + increase), self.station_flood)
+        if self.node_failure.any():
+            increase = self._lognormal_increase(self.node_flood.shape)
+            self.node_flood = np.where(self.node_failure, np.minimum(100, self.node_flood + increase), self.node_flood)
+
+        sf, nf = self.station_flood, self.node_flood
+        se, ne = self.station_elevation, self.node_elevation
+        for a, b in self.transfer_pairs:
+            sf[:, b] = self._propagate(sf[:, a], sf[:, b], se[a], se[b])
+        for a, b in self.station_to_node_layers:
+            nf[:, b] = self._propagate(sf[:, a], nf[:, b], se[a], ne[b])
+        for a, b in self.node_to_node:
+            nf[:, b] = self._propagate(nf[:, a], nf[:, b], ne[a], ne[b])
+        for a, b in self.node_to_station_layers:
+            sf[:, b] = self._propagate(nf[:, a], sf[:, b], ne[a], se[b])
+
+    def _sample_ratio(self, shape):
+        s = self.settings
+        return s['getOnAndOffRatioMin'] + self.rng.random(shape) * (s['getOnAndOffRatioMax'] - s['getOnAndOffRatioMin'])
+
+    def _update_passengers(self, evacuated):
+        """复现updatePassengers，按列车顺序处理（同站多车时顺序有影响）"""
+        rows = np.arange(self.K)
+        get_off_ratio = self._sample_ratio((self.K, self.M))
+        get_on_ratio = self._sample_ratio((self.K, self.M))
+        for m in range(self.M):
+            at_station = (self.train_station[:, m] >= 0) & (self.train_status[:, m] != STATUS_CODES['trapped'])
+            st = np.where(at_station, self.train_station[:, m], 0)
+            p = self.train_passengers[:, m]
+            sp = self.station_passengers[rows, st]
+
+            evac = at_station & evacuated[:, m]
+            board = at_station & ~evacuated[:, m]
+            get_off = np.floor(p * get_off_ratio[:, m]).astype(np.int64)
+            p_after_off = p - get_off
+            sp_after_off = sp + get_off
+            get_on = np.floor(sp_after_off * get_on_ratio[:, m]).astype(np.int64)
+
+            new_p = np.where(evac, 0, np.where(board, np.minimum(self.train_capacity[m], p_after_off + get_on), p))
+            new_sp = np.where(evac, sp + p, np.where(board, sp_after_off - get_on, sp))
+            self.train_passengers[:, m] = new_p
+            self.station_passengers[rows[at_station], st[at_station]] = new_sp[at_station]
+
+    def _location_flood(self):
+        """列车所在位置（车站或轨道节点）的水位 [K,8]"""
+        rows = np.arange(self.K)[:, None]
+        at_station = self.train_station >= 0
+        track = np.where(self.train_track >= 0, self.train_track, 0)
+        on_node = ~at_station & (self.train_track >= 0) & (self.train_position >= 0) & (self.train_position < self.track_length[track])
+        node = np.where(on_node, self.track_first_node[track] + self.train_position, 0)
+        station_level = self.station_flood[rows, np.where(at_station, self.train_station, 0)]
+        node_level = self.node_flood[rows, node]
+        return np.where(at_station, station_level, np.where(on_node, node_level, 0))
+
+    def step(self, actions):
+        """所有局同时推进一回合
+
+        actions: [K, 8] 动作索引（0: Monitor 1: Start 2: Stop 3: Reverse 4: Evacuate）
+        返回 (观察[K, obs_dim], 奖励[K], done[K], 结束局的最终得分[K])；达到max_rounds的局会自动重置，
+        返回的是新一局的初始观察，结束时的观察按局号顺序放在terminal_states中。
+        """
+        actions = np.asarray(actions)
+        original_passengers = self.train_passengers.copy()
+        evacuated = self._apply_actions(actions)
+        self._move_trains()
+        self._update_flood_levels()
+        self._update_passengers(evacuated)
+
+        trapped = self._location_flood() > self.settings['trappedThreshold']
+        self.train_status[self.train_status == STATUS_CODES['trapped']] = STATUS_CODES['stopped']
+        self.train_status[trapped] = STATUS_CODES['trapped']
+
+        s = self.settings
+        base = s['delayScorePerPassenger'] * self.train_passengers
+        scores = np.where(self.train_delayed > 0, -base, base)
+        scores += np.where(evacuated, s['evacuationScorePerPassenger'] * original_passengers, 0)
+        scores += np.where((self.train_status == STATUS_CODES['trapped']) & (self.train_station < 0),
+                           s['trappedInTrackScorePerPassenger'] * self.train_passengers, 0)
+        rewards = scores.sum(axis=1)
+        self.score += rewards
+        self.round += 1
+
+        dones = self.round >= self.max_rounds
+        final_scores = self.score.copy()
+        if not dones.any():
+            return self.encode(), rewards.astype(np.float32), dones, final_scores
+        self.terminal_states = self.encode()[dones]
+        return self.reset(np.flatnonzero(dones)), rewards.astype(np.float32), dones, final_scores
+
+    # ---------- 观察 ----------
+
+    def encode(self, out=None):
+        """直接由数组生成与ObsEncoder相同布局的观察向量 [K, obs_dim]；给出out时写入out"""
+        K, M, S = self.K, self.M, self.S
+        T, St = TRAIN_OFFSETS, STATION_OFFSETS
+        if out is None:
+            out = np.empty((K, OBS_DIM), dtype=np.float32)
+        out[:] = 0
+        rows = np.arange(K)[:, None]
+        tb = np.arange(M) * TRAIN_DIM  # 每辆列车块的起始列
+        out[:, tb + T['id'] + np.arange(M)] = 1
+        station_col = np.where(self.train_station >= 0, self.train_station, NUM_STATIONS)  # 最后一位表示null
+        out[rows, tb + T['station'] + station_col] = 1
+        has_track = self.train_track >= 0
+        out[rows, tb + np.where(has_track, T['track'] + self.train_track, 0)] += has_track
+        out[:, tb + T['nodePosition']] = self.train_position
+        out[:, tb + T['capacity']] = self.train_capacity
+        out[:, tb + T['passengers']] = self.train_passengers
+        out[:, tb + T['delayedRounds']] = self.train_delayed
+        out[:, tb + T['forward']] = self.train_direction == 0
+        has_line = self.train_line < NUM_LINES
+        out[:, tb[has_line] + T['line'] + self.train_line[has_line]] = 1
+        out[rows, tb + T['status'] + self.train_status] = 1
+
+        sb = TRAINS_DIM + np.arange(S) * STATION_DIM  # 每个车站块的起始列
+        out[:, sb + St['id'] + np.arange(S)] = 1
+        out[:, sb + St['x']] = self.station_x
+        out[:, sb + St['y']] = self.station_y
+        out[:, sb + St['passengers']] = self.station_passengers
+        out[:, sb + St['isTransfer']] = self.station_is_transfer
+        out[:, sb + St['floodLevel']] = self.station_flood
+        out[:, sb + St['isFailurePoint']] = self.station_failure
+        out[:, sb + St['elevation']] = self.station_elevation
+        out[:, sb + St['pumpUsed']] = self.station_pump_used
+        return out
+
+    def observation(self, k):
+        """第k局的原始观察dict（结构同MetroEnv.step()）"""
+        status_names = {v: n for n, v in STATUS_CODES.items()}
+        trains = [{
+            'id': m, 'stationId': int(self.train_station[k, m]) if self.train_station[k, m] >= 0 else None,
+            'trackId': int(self.train_track[k, m]) if self.train_track[k, m] >= 0 else None,
+            'nodePosition': int(self.train_position[k, m]), 'capacity': int(self.train_capacity[m]),
+            'passengers': int(self.train_passengers[k, m]), 'status': status_names[int(self.train_status[k, m])],
+            'direction': 'forward' if self.train_direction[k, m] == 0 else 'backward',
+            'lineId': int(self.train_line[m]), 'delayedRounds': int(self.train_delayed[k, m]),
+            'lastMoveRound': int(self.train_last_move[k, m]),
+        } for m in range(self.M)]
+        stations = [{
+            **INITIAL_STATIONS[i], 'floodLevel': float(self.station_flood[k, i]),
+            'passengers': int(self.station_passengers[k, i]), 'isFailurePoint': bool(self.station_failure[k, i]),
+            'pumpUsed': bool(self.station_pump_used[k, i]),
+        } for i in range(self.S)]
+        return {'trains': trains, 'stations': stations, 'score': int(self.score[k]),
+                'info': {'round': int(self.round[k])}, 'seq': None}
+
+
+class BatchSimVectorEnv:
+    """以BatchMetroSim为后端、接口与VectorMetroEnv相同的向量环境，可直接用于DQNAgent.train_vectorized
+
+    K局游戏一次推进，观察直接由数组编码；结束的局自动重置，结束时的编码观察放在 info['terminal_state']。
+    """
+    def __init__(self, num_games, seed=None, settings=None, max_rounds=30):
+        self.sim = BatchMetroSim(num_games, seed=seed, settings=settings, max_rounds=max_rounds)
+        self.num_envs = num_games
+        self.stats = {'requests': 0}
+
+    async def reset(self):
+        """重置所有局，返回 (观察[K, obs_dim], 每局的info)"""
+        self.stats['requests'] += 1
+        return self.sim.reset(), [{} for _ in range(self.num_envs)]
+
+    async def step(self, actions):
+        """actions: [K, 8] 动作索引；返回 (观察, 奖励[K], done[K], infos)，同VectorMetroEnv.step"""
+        self.stats['requests'] += 1
+        states, rewards, dones, final_scores = self.sim.step(actions)
+        infos = [{} for _ in range(self.num_envs)]
+        for i, terminal_state in zip(np.flatnonzero(dones), self.sim.terminal_states):
+            infos[i]['terminal_state'] = terminal_state
+            infos[i]['episode_score'] = float(final_scores[i])
+        return states, rewards, dones, infos
+
+    async def close(self):
+        pass
+
+
+# ---------- 与记录日志的一致性检查 ----------
+
+class _LogReplaySim(MetroSim):
+    """回放日志用：故障点涨水量与乘客数取自下一条日志，使其余确定性逻辑可逐项比对"""
+    def __init__(self, settings):
+        super().__init__(seed=0, settings=settings)
+        self.target = None
+
+    def _sample_flood_increase(self, kind, node_id):
+        if kind == 'station':
+            station = self.stations[node_id]
+            logged = self.target['stations'][node_id]['currentFloodLevel']
+            pumped = station['previousFloodLevel']
+            if station['hasPump'] and pumped >= station['pumpThreshold']:
+                pumped = max(0, pumped - station['pumpRate'])
+            return logged - pumped
+        for t, logged_track in zip(self.tracks, self.target['tracks']):
+            for n, logged_node in zip(t['nodes'], logged_track['nodes']):
+                if n['id'] == node_id:
+                    return logged_node['currentFloodLevel'] - n['previousFloodLevel']
+        return 0
+
+    def _update_passengers(self):
+        for train, logged in zip(self.trains, self.target['trains']):
+            train['passengers'] = logged['currentPassengers']
+        for station, logged in zip(self.stations, self.target['stations']):
+            station['passengers'] = logged['currentPassengers']
+
+
+def check_log_parity(log_path, tolerance=1e-6):
+    """逐回合回放日志：以上一回合状态和本回合玩家操作为输入，比对列车、水位、水泵和得分，返回不一致项列表"""
+    with open(log_path, 'r') as f:
+        logs = json.load(f)
+
+    sim = _LogReplaySim(settings=logs[0].get('setting'))
+    sim.failure_points = {('station', s['id']) for s in logs[0]['stations'] if s['isFailurePoint']}
+    sim.failure_points |= {('track', n['id']) for t in logs[0]['tracks'] for n in t['nodes'] if n['isFailurePoint']}
+    sim.reset()
+
+    mismatches = []
+    for i, entry in enumerate(logs):
+        if i > 0:
+            sim.load_log_entry(logs[i - 1])
+        sim.target = entry
+        for action in entry['playerActions']:
+            sim.pending_actions.append({
+                'type': action['type'],
+                'targetTrain': action['targetTrain'],
+                'targetLocation': (action['targetLocation']['type'], action['targetLocation']['id'],
+                                   action['targetLocation']['indexInLine']),
+            })
+        score_change = sim.update()
+
+        if score_change != entry['scoreChange']:
+            mismatches.append((entry['round'], 'scoreChange', score_change, entry['scoreChange']))
+        for train, logged in zip(sim.trains, entry['trains']):
+            for key, log_key in (('stationId', 'stationId'), ('trackId', 'trackId'), ('nodePosition', 'nodePosition'),
+                                 ('status', 'currentStatus'), ('direction', 'currentDirection'),
+                                 ('delayedRounds', 'delayedRounds'), ('lastMoveRound', 'lastMoveRound')):
+                if train[key] != logged[log_key]:
+                    mismatches.append((entry['round'], f"train{train['id']}.{key}", train[key], logged[log_key]))
+        for station, logged in zip(sim.stations, entry['stations']):
+            if abs(station['floodLevel'] - logged['currentFloodLevel']) > tolerance:
+                mismatches.append((entry['round'], f"station{station['id']}.floodLevel",
+                                   station['floodLevel'], logged['currentFloodLevel']))
+            if station['pumpUsed'] != logged['pumpUsed']:
+                mismatches.append((entry['round'], f"station{station['id']}.pumpUsed",
+                                   station['pumpUsed'], logged['pumpUsed']))
+        for track, logged in zip(sim.tracks, entry['tracks']):
+            for node, logged_node in zip(track['nodes'], logged['nodes']):
+                if abs(node['floodLevel'] - logged_node['currentFloodLevel']) > tolerance:
+                    mismatches.append((entry['round'], f"node{node['id']}.floodLevel",
+                                       node['floodLevel'], logged_node['currentFloodLevel']))
+    return mismatches
+
+
+# 使用示例：python metro_sim.py metro_logs_2025-02-25T01_40_19.393Z.json
+if __name__ == "__main__":
+    log_path = sys.argv[1] if len(sys.argv) > 1 else "metro_logs_2025-02-25T01_40_19.393Z.json"
+    mismatches = check_log_parity(log_path)
+    if mismatches:
+        for round_num, field, simulated, logged in mismatches:
+            print(f"❌ 回合{round_num} {field}: 模拟={simulated} 日志={logged}")
+        sys.exit(1)
+    print(f"✅ {log_path} 回放一致")
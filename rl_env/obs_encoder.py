@@ -0,0 +1,136 @@
+import numpy as np
+
+# 观察向量的字段布局（与原DQNAgent.obs_parser逐字段拼接的顺序一致）：
+# 每辆列车49维、每个车站24维，先依次排列8辆列车，再依次排列16个车站
+
+NUM_TRAINS = 8
+NUM_STATIONS = 16
+NUM_TRACKS = 12
+NUM_LINES = 4  # lineId按range(4)独热编码，lineId为4时全为0（保持原解析器的行为）
+STATUS_CODES = {'running': 0, 'stopped': 1, 'trapped': 2}
+
+
+def _offsets(fields):
+    """由 [(字段名, 宽度)] 计算 {字段名: 起始偏移} 和总宽度"""
+    offsets, position = {}, 0
+    for name, width in fields:
+        offsets[name] = position
+        position += width
+    return offsets, position
+
+
+TRAIN_FIELDS = [
+    ('id', NUM_TRAINS),
+    ('station', NUM_STATIONS + 1),  # 最后一位表示stationId为null
+    ('track', NUM_TRACKS),
+    ('nodePosition', 1),
+    ('capacity', 1),
+    ('passengers', 1),
+    ('delayedRounds', 1),
+    ('forward', 1),
+    ('line', NUM_LINES),
+    ('status', len(STATUS_CODES)),
+]
+STATION_FIELDS = [
+    ('id', NUM_STATIONS),
+    ('x', 1),
+    ('y', 1),
+    ('passengers', 1),
+    ('isTransfer', 1),
+    ('floodLevel', 1),
+    ('isFailurePoint', 1),
+    ('elevation', 1),
+    ('pumpUsed', 1),
+]
+TRAIN_OFFSETS, TRAIN_DIM = _offsets(TRAIN_FIELDS)
+STATION_OFFSETS, STATION_DIM = _offsets(STATION_FIELDS)
+TRAINS_DIM = NUM_TRAINS * TRAIN_DIM
+OBS_DIM = TRAINS_DIM + NUM_STATIONS * STATION_DIM
+
+# 各列车状态独热（running/stopped/trapped）与stationId为null标志所在的列，用于生成动作掩码
+STATUS_COLS = np.arange(NUM_TRAINS)[:, None] * TRAIN_DIM + TRAIN_OFFSETS['status'] + np.arange(len(STATUS_CODES))
+STATION_NULL_COLS = np.arange(NUM_TRAINS) * TRAIN_DIM + TRAIN_OFFSETS['station'] + NUM_STATIONS
+
+
+def _check_id(value, limit, name):
+    """独热编码的id必须在 [0, limit) 内，否则会写到相邻字段"""
+    if not 0 <= value < limit:
+        raise ValueError(f"{name}={value} 超出范围 [0, {limit})")
+
+
+class ObsEncoder:
+    """将原始观察dict编码为float32向量
+
+    数值字段的列位置是固定的，预先算好；每个观察只需在Python中收集数值和独热列号，
+    再由两次NumPy散射写入预分配的输出缓冲区。
+    """
+    obs_dim = OBS_DIM
+
+    def __init__(self):
+        T, S = TRAIN_OFFSETS, STATION_OFFSETS
+        train_value_fields = ['nodePosition', 'capacity', 'passengers', 'delayedRounds', 'forward']
+        station_value_fields = ['x', 'y', 'passengers', 'isTransfer', 'floodLevel', 'isFailurePoint', 'elevation', 'pumpUsed']
+        # 数值字段的列号，顺序与 _collect 中收集数值的顺序一致
+        self.value_cols = np.array(
+            [m * TRAIN_DIM + T[f] for m in range(NUM_TRAINS) for f in train_value_fields]
+            + [TRAINS_DIM + i * STATION_DIM + S[f] for i in range(NUM_STATIONS) for f in station_value_fields])
+        self.train_onehot_offsets = (T['id'], T['station'], T['track'], T['line'], T['status'])
+        self.station_id_offset = S['id']
+
+    def _collect(self, obs, values, onehots, row_offset):
+        """把一个观察的数值追加到values，独热位置（展平后的列号）追加到onehots"""
+        id_off, station_off, track_off, line_off, status_off = self.train_onehot_offsets
+        if len(obs['trains']) > NUM_TRAINS or len(obs['stations']) > NUM_STATIONS:
+            raise ValueError(f"观察中有 {len(obs['trains'])} 辆列车、{len(obs['stations'])} 个车站，"
+                             f"最多 {NUM_TRAINS} / {NUM_STATIONS}")
+        for m, t in enumerate(obs['trains']):
+            base = row_offset + m * TRAIN_DIM
+            station_id, track_id, line_id = t['stationId'], t['trackId'], t['lineId']
+            status = STATUS_CODES.get(t['status'])
+            _check_id(t['id'], NUM_TRAINS, 'trainId')
+            onehots.append(base + id_off + t['id'])
+            if station_id is not None:
+                _check_id(station_id, NUM_STATIONS, 'stationId')
+            onehots.append(base + station_off + (NUM_STATIONS if station_id is None else station_id))
+            if track_id is not None:
+                _check_id(track_id, NUM_TRACKS, 'trackId')
+                onehots.append(base + track_off + track_id)
+            if 0 <= line_id < NUM_LINES:
+                onehots.append(base + line_off + line_id)
+            if status is not None:
+                onehots.append(base + status_off + status)
+            values += (t['nodePosition'], t['capacity'], t['passengers'], t['delayedRounds'], t['direction'] == 'forward')
+        for i, s in enumerate(obs['stations']):
+            _check_id(s['id'], NUM_STATIONS, 'station id')
+            onehots.append(row_offset + TRAINS_DIM + i * STATION_DIM + self.station_id_offset + s['id'])
+            values += (s['x'], s['y'], s['passengers'], s['isTransfer'], s['floodLevel'],
+                       s['isFailurePoint'], s['elevation'], s['pumpUsed'])
+
+    def encode(self, obs, out=None):
+        """编码单个观察，返回 [obs_dim]；给出out时写入out"""
+        if out is None:
+            out = np.zeros(OBS_DIM, dtype=np.float32)
+        else:
+            out[:] = 0
+        values, onehots = [], []
+        self._collect(obs, values, onehots, 0)
+        out[onehots] = 1
+        out[self.value_cols] = values
+        return out
+
+    def encode_batch(self, observations, out=None):
+        """编码一批观察，返回 [B, obs_dim]；给出out时写入out（可复用同一块缓冲区）"""
+        B = len(observations)
+        if out is None:
+            out = np.zeros((B, OBS_DIM), dtype=np.float32)
+        else:
+            out[:] = 0
+        values, onehots = [], []
+        for b, obs in enumerate(observations):
+            self._collect(obs, values, onehots, b * OBS_DIM)
+        out[np.divmod(onehots, OBS_DIM)] = 1  # 展平列号拆回 (行, 列)，out不必是连续内存
+        out[:, self.value_cols] = np.array(values, dtype=np.float32).reshape(B, -1)
+        return out
+
+    def __call__(self, obs):
+        return self.encode(obs)
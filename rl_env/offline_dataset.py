@@ -0,0 +1,100 @@
+import argparse
+import time
+import numpy as np
+from custom_dqn import ReplayBuffer
+from metro_log_parser import MetroLogCorpus, ACTION_CODES, iter_log_entries
+from metro_sim import MetroSim
+from obs_encoder import ObsEncoder, NUM_TRAINS
+
+# 离线数据集：把人类玩家的metro_logs日志转成DQN的经验 (state, action[8], reward, next_state, done)，
+# 批量写入回放缓冲区文件，供DQNAgent在接入环境前预训练或行为克隆。
+# 日志逐条流式读取、按批编码写入内存映射文件，内存占用与日志总量无关。
+
+
+def iter_log_transitions(file_path, sim=None):
+    """逐条产出一个日志文件中的经验 (state_obs, action[8], reward, next_state_obs, done)，观察为原始dict
+
+    第r条经验：state为第r-1条记录结束时的状态，action为第r条记录中的玩家操作（没有操作的列车为monitor，
+    同一列车有多个操作时取最后一个），reward为第r条记录的scoreChange，next_state为第r条记录结束时的状态；
+    文件的最后一条经验done为True。观察由MetroSim.load_log_entry还原，与游戏服务器的观察结构相同。
+    """
+    sim = sim or MetroSim()
+    previous = None
+    pending = None  # 推迟一条产出，以便在文件结束时把最后一条标记为done
+    for entry in iter_log_entries(file_path):
+        obs = sim.load_log_entry(entry)
+        if previous is not None:
+            actions = np.zeros(NUM_TRAINS, dtype=np.int8)  # 0为monitor
+            for a in entry['playerActions']:
+                actions[a['targetTrain']['id']] = ACTION_CODES[a['type']]
+            if pending is not None:
+                yield pending
+            pending = (previous, actions, float(entry['scoreChange']), obs, False)
+        previous = obs
+    if pending is not None:
+        yield pending[:4] + (True,)
+
+
+def build_replay_buffer(source, buffer_path, capacity=1_000_000, dedup_frames=False, batch_size=1024, encoder=None):
+    """把日志（目录、glob模式或文件列表，同MetroLogCorpus）中的经验写入buffer_path处的回放缓冲区
+
+    已有的回放文件会被接着写入。返回 (回放缓冲区, 写入的经验数)。
+    """
+    encoder = encoder or ObsEncoder()
+    buffer = ReplayBuffer(capacity, obs_dim=encoder.obs_dim, path=buffer_path, dedup_frames=dedup_frames)
+    paths = MetroLogCorpus._resolve_paths(source)
+    if not paths:
+        raise ValueError(f"没有找到日志文件: {source}")
+
+    # 编码缓冲区按批复用
+    states = np.zeros((batch_size, encoder.obs_dim), dtype=np.float32)
+    next_states = np.zeros((batch_size, encoder.obs_dim), dtype=np.float32)
+    actions = np.zeros((batch_size, NUM_TRAINS), dtype=np.int8)
+    rewards = np.zeros(batch_size, dtype=np.float32)
+    dones = np.zeros(batch_size, dtype=bool)
+    batch = []
+    total = 0
+
+    def write(batch):
+        n = len(batch)
+        encoder.encode_batch([t[0] for t in batch], out=states[:n])
+        encoder.encode_batch([t[3] for t in batch], out=next_states[:n])
+        for i, (_, action, reward, _, done) in enumerate(batch):
+            actions[i], rewards[i], dones[i] = action, reward, done
+        buffer.push_batch(states[:n], actions[:n], rewards[:n], next_states[:n], dones[:n])
+
+    sim = MetroSim()
+    for path in paths:
+        for transition in iter_log_transitions(path, sim):
+            batch.append(transition)
+            if len(batch) == batch_size:
+                write(batch)
+                total += len(batch)
+                batch = []
+    if batch:
+        write(batch)
+        total += len(batch)
+    buffer.flush()
+    if total > buffer.capacity:
+        print(f"⚠️ 经验数 {total} 超过回放容量 {buffer.capacity}，只保留了最后写入的部分")
+    return buffer, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="由人类玩家日志生成DQN离线经验回放文件")
+    parser.add_argument("source", help="日志目录（读取其中的metro_logs_*.json）或glob模式")
+    parser.add_argument("--buffer-path", required=True, help="回放缓冲区目录，训练时用custom_dqn.py --buffer-path读取")
+    parser.add_argument("--capacity", type=int, default=1_000_000)
+    parser.add_argument("--dedup-frames", action="store_true", help="回放按帧存储，每个观察只存一次")
+    parser.add_argument("--batch-size", type=int, default=1024, help="每批编码、写入的经验数")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    buffer, total = build_replay_buffer(args.source, args.buffer_path, capacity=args.capacity,
+                                        dedup_frames=args.dedup_frames, batch_size=args.batch_size)
+    elapsed = time.perf_counter() - start
+    print(f"写入 {total} 条经验，回放缓冲区现有 {len(buffer)} 条，用时 {elapsed:.2f}s（{total / elapsed:.0f} 条/s）")
+
+
+if __name__ == "__main__":
+    main()
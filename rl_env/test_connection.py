@@ -1,18 +1,10 @@
 import asyncio
 from metro_env import MetroEnv
 import numpy as np
-import websockets
 
 async def test_env():
     try:
         env = MetroEnv()
-        env.ws = await websockets.connect(
-            "ws://localhost:8765",
-            ping_interval=None,
-            max_size=1_000_000_000,
-            open_timeout=10,
-            subprotocols=["json", "msgpack"]
-        )
 
         initial_response = await env.reset(use_msgpack=True)
      
@@ -54,6 +46,7 @@ async def test_env():
             # print(f"Step {step}: Trains={response['trains']}, Stations={response['stations']}, Score={response['score']:.2f}, Round={response['info']['round']}")
 
         print('游戏结束')
+        print(f"连接统计: {env.stats}")
 
     # except Exception as e:
     #     print(f"测试失败: {str(e)}")
@@ -0,0 +1,81 @@
+import asyncio
+import numpy as np
+from metro_env import MetroEnv
+
+
+class VectorMetroEnv:
+    """并行管理多个游戏服务器（不同端口）的MetroEnv，用于并行采样"""
+    def __init__(self, ports, host='localhost', obs_encoder=None, max_rounds=30):
+        self.envs = [MetroEnv(host=host, port=port) for port in ports]
+        self.num_envs = len(self.envs)
+        self.obs_encoder = obs_encoder  # 将原始观察dict编码为向量，如ObsEncoder或DQNAgent._parse_observation
+        self.max_rounds = max_rounds  # 每局回合数，达到后自动重置
+
+        # 保留每个环境最新的原始观察dict，供IBL等需要dict观察的智能体使用
+        self.observations = [None] * self.num_envs
+        self.scores = np.zeros(self.num_envs, dtype=np.float32)
+        self.rounds = np.zeros(self.num_envs, dtype=np.int64)
+
+    def _stack(self, observations):
+        """将多个原始观察编码并堆叠为 [num_envs, obs_dim]"""
+        if self.obs_encoder is None:
+            return None
+        if hasattr(self.obs_encoder, 'encode_batch'):
+            return self.obs_encoder.encode_batch(observations)
+        return np.stack([self.obs_encoder(obs) for obs in observations])
+
+    async def reset(self):
+        """并发重置所有环境，返回 (堆叠观察, 每个环境的info)"""
+        observations = await asyncio.gather(*(env.reset(use_msgpack=True) for env in self.envs))
+        self.observations = list(observations)
+        self.scores[:] = [obs['score'] for obs in observations]
+        self.rounds[:] = 0
+        infos = [{'obs': obs} for obs in observations]
+        return self._stack(observations), infos
+
+    async def step(self, actions):
+        """并发执行所有环境的动作
+
+        actions: [num_envs, 8] 的动作索引（0: Monitor 1: Start 2: Stop 3: Reverse 4: Evacuate）
+        返回 (堆叠观察, 奖励[num_envs], done[num_envs], infos)。
+        结束的环境会自动重置：返回的观察为新一局的初始观察，结束时的观察放在 info['terminal_observation']。
+        """
+        batches = [[{'trainId': train_id, 'actionType': int(action_idx)}
+                    for train_id, action_idx in enumerate(env_actions)]
+                   for env_actions in actions]
+        observations = list(await asyncio.gather(
+            *(env.step(batch) for env, batch in zip(self.envs, batches))
+        ))
+
+        # 本次得分或奖励
+        new_scores = np.array([obs['score'] for obs in observations], dtype=np.float32)
+        rewards = new_scores - self.scores
+        self.scores = new_scores
+        self.rounds += 1
+        dones = self.rounds >= self.max_rounds
+
+        infos = [{} for _ in range(self.num_envs)]
+        done_ids = np.flatnonzero(dones)
+        if len(done_ids) > 0:
+            reset_observations = await asyncio.gather(
+                *(self.envs[i].reset(use_msgpack=True) for i in done_ids)
+            )
+            for i, reset_obs in zip(done_ids, reset_observations):
+                infos[i]['terminal_observation'] = observations[i]
+                infos[i]['episode_score'] = float(new_scores[i])
+                observations[i] = reset_obs
+                self.scores[i] = reset_obs['score']
+                self.rounds[i] = 0
+
+        for info, obs in zip(infos, observations):
+            info['obs'] = obs
+        self.observations = observations
+        return self._stack(observations), rewards, dones, infos
+
+    @property
+    def stats(self):
+        """各环境的连接统计"""
+        return [env.stats for env in self.envs]
+
+    async def close(self):
+        await asyncio.gather(*(env.close() for env in self.envs))
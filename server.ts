@@ -3,8 +3,10 @@ import { GameServer } from './src/server/gameServer';
 // 只在Node环境启动服务器
 if (import.meta.url.endsWith(process.argv[1]?.replace(/^(file:\/\/)?/, 'file://'))) {
 
-  const gameServer = new GameServer(8765);
-  console.log('✅ RL服务器已启动在端口8765');
+  // 可通过环境变量PORT指定端口，便于同时启动多个服务器并行采样
+  const port = Number(process.env.PORT) || 8765;
+  const gameServer = new GameServer(port);
+  console.log(`✅ RL服务器已启动在端口${port}`);
 
   gameServer.wss.on('listening', () => {
     const address = gameServer.wss.address()!;
@@ -16,7 +18,7 @@ if (import.meta.url.endsWith(process.argv[1]?.replace(/^(file:\/\/)?/, 'file://'
     console.error('❌ 服务器错误:', error);
     if (error.code === 'EADDRINUSE') {
       console.error('  端口已被占用，请尝试：');
-      console.error('  1. 关闭其他占用8765端口的程序');
+      console.error(`  1. 关闭其他占用${port}端口的程序`);
       console.error('  2. 使用新端口重启应用');
     }
   });
@@ -8,6 +8,8 @@ import msgpack from 'msgpack-lite';
 export class GameServer {
   public wss: WebSocketServer;
   private gameState: GameState;
+  // 最近处理的 (client, seq) 及其观察值：客户端断线重连后重发同一批次时直接返回，游戏不会多推进一回合
+  private lastBatch: { client: string; seq: number; response: Buffer } | null = null;
 
   constructor(port: number) {    
     // 将初始游戏状态的isPaused设置为false
@@ -56,7 +58,18 @@ export class GameServer {
       
       ws.on('message', (message: Buffer) => {
         try {
-          const actions = msgpack.decode(message);
+          // 新协议为 { client, seq, actions }，seq 会原样写回对应的观察值；兼容直接发送动作数组的旧协议
+          const decoded = msgpack.decode(message);
+          const seq: number | null = Array.isArray(decoded) ? null : (decoded.seq ?? null);
+          const client: string | null = Array.isArray(decoded) ? null : (decoded.client ?? null);
+          const actions = Array.isArray(decoded) ? decoded : decoded.actions;
+
+          // 已处理过的批次（断线前响应没有送达），重发缓存的观察值
+          const last = this.lastBatch;
+          if (client !== null && seq !== null && last !== null && last.client === client && last.seq === seq) {
+            ws.send(last.response);
+            return;
+          }
 
           // 判断是否包含reset
           const isReset = actions.some((action: { actionType: string }) => action.actionType === 'reset');
@@ -78,7 +91,9 @@ export class GameServer {
 
           this.gameState = newState;
 
-          ws.send(this.serializeState(newState));
+          const response = this.serializeState(newState, seq);
+          this.lastBatch = client !== null && seq !== null ? { client, seq, response } : null;
+          ws.send(response);
         } catch (error) {
           console.error('处理动作失败:', error);
         }
@@ -86,12 +101,14 @@ export class GameServer {
     });
   }
 
-  private serializeState(state: GameState): Buffer {
+  private serializeState(state: GameState, seq: number | null = null): Buffer {
     const observation = {
       trains: Array.from(state.trains.values()),
       stations: Array.from(state.stations.values()),
       score: state.score,
-      info: { round: state.round }
+      info: { round: state.round },
+      // 连接时主动推送的初始状态帧 seq 为 null，客户端据此丢弃
+      seq
     };
     return msgpack.encode(observation);
   }